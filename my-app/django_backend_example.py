@@ -21,6 +21,88 @@ class Content(models.Model):
     platforms = models.JSONField(default=list)  # Store as list of strings
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Normalized copies of genres/platforms for indexed filtering; the JSON
+    # lists stay the serialized form and sync_tags() keeps these in step
+    genre_tags = models.ManyToManyField('Genre', through='ContentGenre', related_name='content')
+    platform_tags = models.ManyToManyField('Platform', through='ContentPlatform', related_name='content')
+
+    class Meta:
+        indexes = [
+            # Keyset order of trending/recommended/discover
+            models.Index(fields=['-rating', '-id'], name='content_rating_idx'),
+            # Discover filtered by type, in keyset order
+            models.Index(fields=['content_type', '-rating', '-id'], name='content_type_rating_idx'),
+            # No index on year: discover's year range is checked while walking
+            # the rating indexes, since a year index makes SQLite pick a range
+            # scan plus a sort over most of the catalog
+        ]
+
+    def sync_tags(self):
+        for tag_model, link_model, field, names in (
+            (Genre, ContentGenre, 'genre_id', self.genres),
+            (Platform, ContentPlatform, 'platform_id', self.platforms),
+        ):
+            tag_ids = set(get_tag_ids(tag_model, names).values())
+            link_model.objects.filter(content=self).exclude(**{f'{field}__in': tag_ids}).delete()
+            link_model.objects.bulk_create(
+                [link_model(content=self, **{field: tag_id}) for tag_id in tag_ids], ignore_conflicts=True
+            )
+
+class Genre(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+class Platform(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+
+class ContentGenre(models.Model):
+    content = models.ForeignKey(Content, on_delete=models.CASCADE)
+    genre = models.ForeignKey(Genre, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content', 'genre'], name='unique_content_genre'),
+        ]
+        indexes = [
+            # "Titles in genre X", answered from the index alone
+            models.Index(fields=['genre', 'content'], name='content_genre_idx'),
+        ]
+
+class ContentPlatform(models.Model):
+    content = models.ForeignKey(Content, on_delete=models.CASCADE)
+    platform = models.ForeignKey(Platform, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content', 'platform'], name='unique_content_platform'),
+        ]
+        indexes = [
+            models.Index(fields=['platform', 'content'], name='content_platform_idx'),
+        ]
+
+def get_tag_ids(tag_model, names):
+    # {name: id} for a Genre/Platform model, creating missing rows
+    names = set(names)
+    ids = dict(tag_model.objects.filter(name__in=names).values_list('name', 'id'))
+    if len(ids) < len(names):
+        tag_model.objects.bulk_create([tag_model(name=name) for name in names - ids.keys()], ignore_conflicts=True)
+        ids = dict(tag_model.objects.filter(name__in=names).values_list('name', 'id'))
+    return ids
+
+def replace_tag_links(rows):
+    # Bulk form of Content.sync_tags() for titles written without signals;
+    # rows are (content_id, genres, platforms)
+    rows = list(rows)
+    genre_ids = get_tag_ids(Genre, {name for _, genres, _ in rows for name in genres})
+    platform_ids = get_tag_ids(Platform, {name for _, _, platforms in rows for name in platforms})
+    content_ids = [content_id for content_id, _, _ in rows]
+    ContentGenre.objects.filter(content_id__in=content_ids).delete()
+    ContentPlatform.objects.filter(content_id__in=content_ids).delete()
+    ContentGenre.objects.bulk_create(
+        [ContentGenre(content_id=content_id, genre_id=genre_ids[name]) for content_id, genres, _ in rows for name in set(genres)]
+    )
+    ContentPlatform.objects.bulk_create(
+        [ContentPlatform(content_id=content_id, platform_id=platform_ids[name]) for content_id, _, platforms in rows for name in set(platforms)]
+    )
 
 class UserList(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -37,6 +119,7 @@ class WatchedContent(models.Model):
     content = models.ForeignKey(Content, on_delete=models.CASCADE)
     watched_at = models.DateTimeField(auto_now_add=True)
     ranking_score = models.FloatField(default=0)  # For comparison-based ranking
+    placed = models.BooleanField(default=False)  # Ranked by binary insertion; no more comparisons are offered
 
 class ContentComparison(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -45,62 +128,611 @@ class ContentComparison(models.Model):
     preferred = models.CharField(max_length=10)  # 'a' or 'b'
     created_at = models.DateTimeField(auto_now_add=True)
 
+class Profile(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='profile')
+    # Denormalized from Follow; only changed in the same transaction as the edge
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    # Entries fanned out to the user's feed since it was last trimmed (an
+    # upper bound on its length)
+    feed_size = models.PositiveIntegerField(default=0)
+
+class Follow(models.Model):
+    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name='following_edges')
+    followee = models.ForeignKey(User, on_delete=models.CASCADE, related_name='follower_edges')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # Its index also serves "who does X follow" lookups
+            models.UniqueConstraint(fields=['follower', 'followee'], name='unique_follow'),
+        ]
+        indexes = [
+            # "Who follows X", newest first, for follower listings
+            models.Index(fields=['followee', '-id'], name='follow_followee_idx'),
+        ]
+
+def ensure_profiles(user_ids):
+    # Users created before the Profile table (or its post_save receiver) have
+    # no row, and the F() count updates would silently match nothing. Missing
+    # profiles are created with counts taken from Follow; call this before the
+    # edge is written so it isn't counted twice.
+    user_ids = set(user_ids)
+    missing = user_ids - set(Profile.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+    if not missing:
+        return
+    followers = dict(Follow.objects.filter(followee_id__in=missing).values_list('followee_id').annotate(n=models.Count('id')))
+    following = dict(Follow.objects.filter(follower_id__in=missing).values_list('follower_id').annotate(n=models.Count('id')))
+    Profile.objects.bulk_create(
+        [Profile(user_id=user_id, followers_count=followers.get(user_id, 0), following_count=following.get(user_id, 0)) for user_id in missing],
+        ignore_conflicts=True,
+    )
+
+class FeedEntry(models.Model):
+    # One row per (timeline owner, event). Events of accounts over the
+    # celebrity threshold are stored once in the actor's outbox (outbox=True,
+    # user == actor) and pulled into their followers' feeds at read time.
+    # Timelines and outboxes are trimmed to FEED_TIMELINE_SIZE entries.
+    VERBS = [
+        ('watched', 'Watched'),
+        ('listed', 'Added to a list'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='feed_entries')
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    verb = models.CharField(max_length=20, choices=VERBS)
+    content = models.ForeignKey(Content, on_delete=models.CASCADE)
+    outbox = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # A user's timeline, newest first
+            models.Index(fields=['user', '-id'], name='feed_user_idx'),
+            # Outbox entries only, so pulling an account's outbox never walks
+            # the copies of its events fanned out to its followers
+            models.Index(fields=['actor', '-id'], name='feed_outbox_idx', condition=models.Q(outbox=True)),
+        ]
+
 # views.py
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from itertools import islice
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Q
-from .models import Content, UserList, WatchedContent, ContentComparison
-from .serializers import ContentSerializer, UserListSerializer
+from rest_framework.renderers import JSONRenderer
+from rest_framework.pagination import BasePagination
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.utils.urls import replace_query_param
+from django.contrib.auth.models import User
+from django.db.models import F, Q, Case, When, Exists, IntegerField, OuterRef, Prefetch, Subquery
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from .cache import ResponseCache, etag_matches
+from .feed import CELEBRITY_THRESHOLD, FEED_TIMELINE_SIZE, FEED_WATCHED, FEED_LISTED
+from .metrics import PROMETHEUS_CONTENT_TYPE, RouteMetrics
+from .pagination import encode_cursor, decode_cursor, keyset_page, iter_json_array
+from .ranking import InsertionSession, elo_update, bradley_terry, insertion_score
+from .recommender import WATCHED_WEIGHT, merge_candidates, similar_key, recommendations_key
+from .search import TrigramIndex, UserPrefixIndex
+from .models import (
+    Content, ContentGenre, ContentPlatform, UserList, UserListItem, WatchedContent, ContentComparison, Profile, Follow, FeedEntry, ensure_profiles,
+)
+from .serializers import ContentSerializer, UserListSerializer, UserSummarySerializer, FeedEntrySerializer
+
+# Per-process cache of encoded trending/recommended responses
+response_cache = ResponseCache()
+
+# Per-process request metrics, recorded by MetricsMiddleware
+request_metrics = RouteMetrics()
+
+def metrics(request):
+    # Prometheus scrape endpoint; each worker process reports its own counters
+    return HttpResponse(request_metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+class SharedChanges:
+    # Generation counter in the shared cache for data that every process
+    # keeps its own index of. Each write starts a new generation once it
+    # commits, recording the changed row's id under it; bulk writes record
+    # nothing. A process that last synced at `seen` gets the ids changed
+    # since from changed_since(), or None when they can't be replayed (a gap,
+    # an expired id, a bulk write) and it has to reload instead.
+    def __init__(self, name, replay_limit=1000, timeout=60 * 60):
+        self.name = name
+        self.replay_limit = replay_limit
+        self.timeout = timeout
+        self.generation_key = f'{name}:generation'
+
+    def change_key(self, generation):
+        return f'{self.name}:change:{generation}'
+
+    def generation(self):
+        return cache.get_or_set(self.generation_key, 0, None)
+
+    def publish(self, item_id=None):
+        try:
+            generation = cache.incr(self.generation_key)
+        except ValueError:
+            generation = 1
+            cache.set(self.generation_key, generation, None)
+        if item_id is not None:
+            cache.set(self.change_key(generation), item_id, self.timeout)
+
+    def changed_since(self, seen, generation):
+        if seen is None or not 0 < generation - seen <= self.replay_limit:
+            return None
+        keys = [self.change_key(g) for g in range(seen + 1, generation + 1)]
+        changes = cache.get_many(keys)
+        if len(changes) < len(keys):
+            return None
+        return set(changes.values())
+
+# Every Content write is published here. Each process brings its response
+# cache and title index up to date before using them: a short run of changed
+# titles is re-read and patched into the index, anything else reloads it.
+# Bulk writes (bulk_create, QuerySet.update/delete) send no signals, so code
+# writing titles that way calls publish_catalog_change() itself once they
+# commit, as import_catalog and load_test do.
+catalog_changes = SharedChanges('catalog')
+
+def publish_catalog_change(content_id=None):
+    catalog_changes.publish(content_id)
+
+@receiver([post_save, post_delete], sender=Content)
+def publish_content_change(sender, instance, **kwargs):
+    content_id = instance.id
+    transaction.on_commit(lambda: publish_catalog_change(content_id))
+
+# Per-process trigram index over Content titles/descriptions, loaded on first
+# search and kept current by sync_catalog()
+title_search = TrigramIndex()
+_title_search_loaded = False
+_title_search_lock = threading.Lock()
+_catalog_generation = None  # last generation this process synced with
+
+def sync_catalog():
+    global _title_search_loaded, _catalog_generation
+    if catalog_changes.generation() == _catalog_generation:
+        return
+    with _title_search_lock:
+        generation = catalog_changes.generation()
+        if generation == _catalog_generation:
+            return
+        response_cache.clear()
+        changed = catalog_changes.changed_since(_catalog_generation, generation) if _title_search_loaded else None
+        if changed is None:
+            _title_search_loaded = False
+        else:
+            rows = {content_id: (title, description) for content_id, title, description in Content.objects.filter(id__in=changed).values_list('id', 'title', 'description')}
+            for content_id in changed:
+                if content_id in rows:
+                    title_search.add(content_id, *rows[content_id])
+                else:
+                    title_search.remove(content_id)
+        _catalog_generation = generation
+
+def get_title_search():
+    global title_search, _title_search_loaded
+    sync_catalog()
+    if not _title_search_loaded:
+        with _title_search_lock:
+            if not _title_search_loaded:
+                # Built aside and swapped in, so searches running meanwhile
+                # use the previous index rather than a half-filled one
+                index = TrigramIndex()
+                for content_id, title, description in Content.objects.values_list('id', 'title', 'description').iterator():
+                    index.add(content_id, title, description)
+                title_search = index
+                _title_search_loaded = True
+    return title_search
+
+@receiver(post_save, sender=Content)
+def sync_content_tags(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance.sync_tags()
+
+@receiver(post_save, sender=User)
+def create_profile(sender, instance, created, **kwargs):
+    if created:
+        Profile.objects.get_or_create(user=instance)
+
+# Per-process prefix index for user typeahead, loaded on first search and
+# kept current like the title index: new users, renames and deletions, and
+# the follower count changes of follow/unfollow, are published to
+# user_changes, and each process re-reads the changed users (or reloads)
+# before searching. Bulk user or profile writes call user_changes.publish().
+user_changes = SharedChanges('users')
+user_search = UserPrefixIndex()
+_user_search_loaded = False
+_user_search_lock = threading.Lock()
+_user_generation = None  # last generation this process synced with
+
+def user_search_rows(users):
+    # (user_id, username, display_name, followers_count) for UserPrefixIndex
+    rows = users.values_list('id', 'username', 'first_name', 'last_name', 'profile__followers_count')
+    for user_id, username, first_name, last_name, followers_count in rows.iterator(chunk_size=10000):
+        yield user_id, username, f'{first_name} {last_name}', followers_count or 0
+
+def get_user_search():
+    global _user_search_loaded, _user_generation
+    if _user_search_loaded and user_changes.generation() == _user_generation:
+        return user_search
+    with _user_search_lock:
+        generation = user_changes.generation()
+        if _user_search_loaded and generation == _user_generation:
+            return user_search
+        changed = user_changes.changed_since(_user_generation, generation) if _user_search_loaded else None
+        if changed is None:
+            # One sort over all the keys; searches meanwhile use the old index
+            user_search.build(user_search_rows(User.objects.all()))
+            _user_search_loaded = True
+        else:
+            rows = {row[0]: row for row in user_search_rows(User.objects.filter(id__in=changed))}
+            for user_id in changed:
+                if user_id in rows:
+                    user_search.add(*rows[user_id])
+                else:
+                    user_search.remove(user_id)
+        _user_generation = generation
+    return user_search
+
+@receiver([post_save, post_delete], sender=User)
+def publish_user_change(sender, instance, **kwargs):
+    user_id = instance.id
+    transaction.on_commit(lambda: user_changes.publish(user_id))
+
+# Materialized profile documents in the shared cache. Writes to a user's
+# watched titles, lists, name or follow counts delete that user's document;
+# a Content write starts a new generation since any document may list it.
+PROFILE_GENERATION_KEY = 'profile:generation'
+PROFILE_TIMEOUT = 60 * 60
+
+def profile_key(user_id):
+    generation = cache.get_or_set(PROFILE_GENERATION_KEY, 0, None)
+    return f'profile:{generation}:{user_id}'
+
+def invalidate_profile(user_id):
+    cache.delete(profile_key(user_id))
+
+def user_profile_queryset():
+    # A fixed number of queries however many titles the user has
+    return User.objects.select_related('profile').prefetch_related(
+        Prefetch('watchedcontent_set', queryset=WatchedContent.objects.select_related('content').order_by('-watched_at')),
+        Prefetch('userlist_set__userlistitem_set', queryset=UserListItem.objects.select_related('content').order_by('-added_at')),
+    )
+
+def listed_content(user):
+    # Titles across the user's lists, deduplicated, from a prefetched user
+    content = {}
+    for user_list in user.userlist_set.all():
+        for item in user_list.userlistitem_set.all():
+            content.setdefault(item.content_id, item.content)
+    return list(content.values())
+
+def build_profile(user_id):
+    user = user_profile_queryset().filter(id=user_id).first()
+    if user is None:
+        return None
+    return {
+        **UserSummarySerializer(user).data,
+        'display_name': user.get_full_name(),
+        'watched_content': list(ContentSerializer([w.content for w in user.watchedcontent_set.all()], many=True).data),
+        'watchlist_content': list(ContentSerializer(listed_content(user), many=True).data),
+    }
+
+@receiver([post_save, post_delete], sender=Content)
+def invalidate_profiles(sender, **kwargs):
+    try:
+        cache.incr(PROFILE_GENERATION_KEY)
+    except ValueError:
+        cache.set(PROFILE_GENERATION_KEY, 1, None)
+
+@receiver([post_save, post_delete], sender=WatchedContent)
+def invalidate_watched_profile(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_profile(instance.user_id))
+
+@receiver([post_save, post_delete], sender=UserListItem)
+def invalidate_listed_profile(sender, instance, **kwargs):
+    user_id = UserList.objects.filter(id=instance.user_list_id).values_list('user_id', flat=True).first()
+    if user_id is not None:
+        transaction.on_commit(lambda: invalidate_profile(user_id))
+
+@receiver(post_save, sender=User)
+def invalidate_user_profile(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_profile(instance.id))
+
+# A timeline may grow this far past FEED_TIMELINE_SIZE before it is cut back,
+# so each trim is paid for by that many fanned-out entries
+FEED_TRIM_SLACK = 50
+
+def publish_activity(actor_id, verb, content_id, batch_size=1000, timeline_size=FEED_TIMELINE_SIZE, trim_slack=FEED_TRIM_SLACK):
+    # Fan the event out to every follower's feed, or store it once in the
+    # outbox of accounts big enough to be pulled at read time
+    followers_count = Profile.objects.filter(user_id=actor_id).values_list('followers_count', flat=True).first() or 0
+    if followers_count >= CELEBRITY_THRESHOLD:
+        FeedEntry.objects.create(user_id=actor_id, actor_id=actor_id, verb=verb, content_id=content_id, outbox=True)
+        trim_feed(FeedEntry.objects.filter(outbox=True, actor_id=actor_id), timeline_size)
+        return
+    followers = Follow.objects.filter(followee_id=actor_id).values_list('follower_id', flat=True).iterator()
+    while batch := list(islice(followers, batch_size)):
+        FeedEntry.objects.bulk_create([FeedEntry(user_id=follower_id, actor_id=actor_id, verb=verb, content_id=content_id) for follower_id in batch])
+        trim_timelines(batch, timeline_size, trim_slack)
+
+def trim_feed(entries, size):
+    # Deletes all but the newest `size` of one timeline's or outbox's entries
+    cutoff = entries.order_by('-id').values('id')[size - 1:size]
+    entries.filter(id__lt=Subquery(cutoff)).delete()
+
+def trim_timelines(user_ids, size=FEED_TIMELINE_SIZE, slack=FEED_TRIM_SLACK):
+    # Counts one new entry in each of the users' timelines and trims those
+    # that are `slack` past `size`. (Users without a Profile row aren't
+    # counted; backfill_profiles creates them.)
+    Profile.objects.filter(user_id__in=user_ids).update(feed_size=F('feed_size') + 1)
+    full = list(Profile.objects.filter(user_id__in=user_ids, feed_size__gt=size + slack).values_list('user_id', flat=True))
+    for user_id in full:
+        trim_feed(FeedEntry.objects.filter(user_id=user_id, outbox=False), size)
+    Profile.objects.filter(user_id__in=full).update(feed_size=size)
+
+@receiver(post_save, sender=WatchedContent)
+def publish_watched(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: publish_activity(instance.user_id, FEED_WATCHED, instance.content_id))
+
+@receiver(post_save, sender=UserListItem)
+def publish_listed(sender, instance, created, **kwargs):
+    if created:
+        user_id = UserList.objects.filter(id=instance.user_list_id).values_list('user_id', flat=True).first()
+        transaction.on_commit(lambda: publish_activity(user_id, FEED_LISTED, instance.content_id))
+
+def keyset_filter(ordering, values):
+    # Rows strictly after `values` in `ordering`, e.g. for ('-rating', '-id'):
+    # rating < r OR (rating = r AND id < i)
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    return condition
+
+class KeysetPagination(BasePagination):
+    # Cursor pagination on a unique ordering, (-rating, -id) by default. Unlike
+    # offsets, every page is an index range scan no matter how deep it is.
+    ordering = ('-rating', '-id')
+    page_size = 50
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def paginate_queryset(self, queryset, request, view=None, ordering=None):
+        self.request = request
+        self.ordering = ordering or self.ordering
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        queryset = queryset.order_by(*self.ordering)
+        if cursor:
+            try:
+                queryset = queryset.filter(keyset_filter(self.ordering, decode_cursor(cursor, len(self.ordering))))
+            except ValueError:
+                raise NotFound('Invalid cursor')
+        page = list(queryset[:page_size + 1])
+        self.next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            last = page[-1]
+            self.next_cursor = encode_cursor(getattr(last, field.lstrip('-')) for field in self.ordering)
+        return page
+
+    def paginate_merged(self, querysets, request, view=None, ordering=None):
+        # One page over the union of querysets that are each paged on their
+        # own, so every one of them stays an ordered index range instead of
+        # an OR the database has to sort. Orderings are on numeric fields.
+        rows = []
+        more = False
+        for queryset in querysets:
+            rows += self.paginate_queryset(queryset, request, view, ordering)
+            more = more or self.next_cursor is not None
+        fields = [(field.lstrip('-'), -1 if field.startswith('-') else 1) for field in self.ordering]
+        rows.sort(key=lambda row: [sign * getattr(row, name) for name, sign in fields])
+        page_size = self.get_page_size(request)
+        page = rows[:page_size]
+        self.next_cursor = None
+        if page and (more or len(rows) > page_size):
+            self.next_cursor = encode_cursor(getattr(page[-1], name) for name, _ in fields)
+        return page
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_data(self, data):
+        return {'next': self.get_next_link(), 'results': data}
+
+    def get_paginated_response(self, data):
+        return Response(self.get_paginated_data(data))
+
+# Discover search returns at most SEARCH_LIMIT titles, filtered in chunks
+SEARCH_LIMIT = 500
+SEARCH_CHUNK_SIZE = 500
+
+def discover_queryset(queryset, params):
+    # Discover's filters as one statement that walks a rating index in keyset
+    # order: genre/platform membership is a correlated EXISTS probe into the
+    # link tables' indexes, so the planner can't drive from the link table and
+    # sort afterwards. Returns (queryset, ordering).
+    search = params.get('search', '')
+    content_type = params.get('content_type', '')
+    platform = params.get('platform', '')
+    genres = set(params.get('genres', '').split(',')) - {''}
+    min_rating = float(params.get('min_rating', 0))
+    year_range_start = int(params.get('year_range_start', 1990))
+    year_range_end = int(params.get('year_range_end', 2024))
+    
+    ordering = KeysetPagination.ordering
+    if content_type and content_type != 'all':
+        queryset = queryset.filter(content_type=content_type)
+    if platform and platform != 'all':
+        queryset = queryset.filter(Exists(ContentPlatform.objects.filter(content=OuterRef('pk'), platform__name=platform)))
+    # Titles linked to every requested genre
+    for genre in sorted(genres):
+        queryset = queryset.filter(Exists(ContentGenre.objects.filter(content=OuterRef('pk'), genre__name=genre)))
+    if min_rating > 0:
+        queryset = queryset.filter(rating__gte=min_rating)
+    if year_range_start <= year_range_end:
+        queryset = queryset.filter(year__range=(year_range_start, year_range_end))
+    if search:
+        # Ranked, typo-tolerant matches from the trigram index, paged in
+        # relevance order. The other filters run first, so the cap applies to
+        # matching titles rather than to raw search hits.
+        ranked_ids = get_title_search().search(search, limit=None)
+        matched = []
+        for start in range(0, len(ranked_ids), SEARCH_CHUNK_SIZE):
+            chunk = ranked_ids[start:start + SEARCH_CHUNK_SIZE]
+            found = set(queryset.filter(id__in=chunk).values_list('id', flat=True))
+            matched.extend(content_id for content_id in chunk if content_id in found)
+            if len(matched) >= SEARCH_LIMIT:
+                break
+        matched = matched[:SEARCH_LIMIT]
+        if matched:
+            queryset = queryset.filter(id__in=matched).annotate(search_rank=Case(
+                *[When(id=content_id, then=position) for position, content_id in enumerate(matched)],
+                output_field=IntegerField(),
+            ))
+            ordering = ('search_rank', 'id')
+        else:
+            queryset = queryset.none()
+    return queryset, ordering
 
 class ContentViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Content.objects.all()
     serializer_class = ContentSerializer
     
+    def keyset_data(self, request, queryset, ordering=None):
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(queryset, request, self, ordering)
+        return paginator.get_paginated_data(self.get_serializer(page, many=True).data)
+    
+    def streaming_response(self, queryset):
+        # ?stream=1: one JSON array written row by row from a server-side cursor
+        renderer = JSONRenderer()
+        context = self.get_serializer_context()
+        rows = (renderer.render(ContentSerializer(obj, context=context).data) for obj in queryset.iterator(chunk_size=500))
+        return StreamingHttpResponse(iter_json_array(rows), content_type='application/json')
+    
+    def cached_response(self, request, get_data):
+        sync_catalog()
+        key = ResponseCache.make_key(request.path, request.META.get('QUERY_STRING', ''))
+        entry = response_cache.get(key)
+        if entry is None:
+            generation = response_cache.generation
+            entry = response_cache.put(key, JSONRenderer().render(get_data()), generation)
+        if etag_matches(request.headers.get('If-None-Match'), entry.etag):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(entry.body, content_type='application/json')
+        response['ETag'] = entry.etag
+        response['Cache-Control'] = 'no-cache'
+        return response
+    
     @action(detail=False, methods=['get'])
     def trending(self, request):
         # Return trending content based on some algorithm
-        trending_content = Content.objects.order_by('-rating')[:20]
-        serializer = self.get_serializer(trending_content, many=True)
-        return Response(serializer.data)
+        def get_data():
+            trending_content = Content.objects.order_by('-rating', '-id')[:20]
+            return self.get_serializer(trending_content, many=True).data
+        return self.cached_response(request, get_data)
     
     @action(detail=False, methods=['get'])
     def discover(self, request):
-        queryset = self.get_queryset()
-        
-        # Apply filters
-        search = request.query_params.get('search', '')
-        content_type = request.query_params.get('content_type', '')
-        platform = request.query_params.get('platform', '')
-        genres = request.query_params.get('genres', '').split(',') if request.query_params.get('genres') else []
-        min_rating = float(request.query_params.get('min_rating', 0))
-        year_range_start = int(request.query_params.get('year_range_start', 1990))
-        year_range_end = int(request.query_params.get('year_range_end', 2024))
-        
-        if search:
-            queryset = queryset.filter(title__icontains=search)
-        if content_type and content_type != 'all':
-            queryset = queryset.filter(content_type=content_type)
-        if platform and platform != 'all':
-            queryset = queryset.filter(platforms__contains=[platform])
-        if genres:
-            for genre in genres:
-                queryset = queryset.filter(genres__contains=[genre])
-        if min_rating > 0:
-            queryset = queryset.filter(rating__gte=min_rating)
-        if year_range_start <= year_range_end:
-            queryset = queryset.filter(year__range=(year_range_start, year_range_end))
-        
-        serializer = self.get_serializer(queryset[:50], many=True)
-        return Response(serializer.data)
+        queryset, ordering = discover_queryset(self.get_queryset(), request.query_params)
+        if request.query_params.get('stream'):
+            return self.streaming_response(queryset.order_by(*ordering))
+        return Response(self.keyset_data(request, queryset, ordering))
     
     @action(detail=False, methods=['get'])
     def recommended(self, request):
-        # Return recommended content based on some algorithm
-        recommended_content = Content.objects.order_by('-rating')[20:]
-        serializer = self.get_serializer(recommended_content, many=True)
-        return Response(serializer.data)
+        # Personalized candidates precomputed by build_recommendations when we
+        # have them; otherwise everything ranked below the trending titles,
+        # paged by (rating, id)
+        if request.user.is_authenticated:
+            candidates = cache.get(recommendations_key(request.user.id))
+            if candidates:
+                return self.personalized_response(request, [content_id for content_id, _ in candidates])
+        ordering = KeysetPagination.ordering
+        queryset = Content.objects.all()
+        last_trending = Content.objects.order_by(*ordering).values_list('rating', 'id')[19:20]
+        if last_trending:
+            queryset = queryset.filter(keyset_filter(ordering, last_trending[0]))
+        else:
+            queryset = queryset.none()
+        if request.query_params.get('stream'):
+            return self.streaming_response(queryset.order_by(*ordering))
+        return self.cached_response(request, lambda: self.keyset_data(request, queryset))
+    
+    def personalized_response(self, request, content_ids):
+        watched = set(WatchedContent.objects.filter(user=request.user, content_id__in=content_ids).values_list('content_id', flat=True))
+        content_ids = [content_id for content_id in content_ids if content_id not in watched]
+        rank = {content_id: position for position, content_id in enumerate(content_ids)}
+        paginator = KeysetPagination()
+        cursor = request.query_params.get(paginator.cursor_query_param)
+        try:
+            page_ids, next_cursor = keyset_page(content_ids, lambda content_id: (rank[content_id],), decode_cursor(cursor, 1) if cursor else None, paginator.get_page_size(request))
+        except ValueError:
+            raise NotFound('Invalid cursor')
+        content = Content.objects.in_bulk(page_ids)
+        serializer = self.get_serializer([content[content_id] for content_id in page_ids if content_id in content], many=True)
+        next_link = replace_query_param(request.build_absolute_uri(), paginator.cursor_query_param, next_cursor) if next_cursor else None
+        return Response({'next': next_link, 'results': serializer.data})
+    
+    @action(detail=False, methods=['get'])
+    def cache_stats(self, request):
+        return Response(response_cache.stats())
+
+# rerank refits on the request, so its Bradley-Terry sweeps are capped
+RERANK_ITERATIONS = 50
+
+# Binary-insertion state for a title being ranked, kept between the
+# comparisons and submit_comparison calls
+INSERTION_SESSION_TIMEOUT = 60 * 60
+
+def insertion_session_key(user, content_id):
+    return f'ranking:insertion:{user.id}:{content_id}'
+
+# Short per-key mutex in the shared cache, for read-modify-write updates of
+# cached values that several workers may run at once. cache.add is atomic, so
+# only one holder gets the lock; it expires after `timeout` seconds in case
+# the holder dies, and waiters give up and go ahead after as long.
+CACHE_LOCK_TIMEOUT = 5
+
+@contextmanager
+def cache_lock(key, timeout=CACHE_LOCK_TIMEOUT, poll=0.01):
+    lock_key = f'lock:{key}'
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + timeout
+    while not cache.add(lock_key, token, timeout) and time.monotonic() < deadline:
+        time.sleep(poll)
+    try:
+        yield
+    finally:
+        if cache.get(lock_key) == token:
+            cache.delete(lock_key)
 
 class UserContentViewSet(viewsets.ViewSet):
     permission_classes = [IsAuthenticated]
@@ -108,67 +740,315 @@ class UserContentViewSet(viewsets.ViewSet):
     @action(detail=False, methods=['get'])
     def watchlist(self, request):
         # Get user's watchlist content
-        user_lists = UserList.objects.filter(user=request.user)
-        # Implementation to get content from lists
-        return Response([])
+        user = user_profile_queryset().get(id=request.user.id)
+        serializer = ContentSerializer(listed_content(user), many=True)
+        return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def watched(self, request):
-        watched = WatchedContent.objects.filter(user=request.user).order_by('-watched_at')
-        content_ids = [w.content.id for w in watched]
-        content = Content.objects.filter(id__in=content_ids)
-        serializer = ContentSerializer(content, many=True)
+        watched = WatchedContent.objects.filter(user=request.user).select_related('content').order_by('-watched_at')
+        serializer = ContentSerializer([w.content for w in watched], many=True)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'])
+    def profile(self, request, pk=None):
+        try:
+            user_id = int(pk)
+        except ValueError:
+            raise ValidationError({'error': 'Invalid user ID'})
+        key = profile_key(user_id)
+        document = cache.get(key)
+        if document is None:
+            document = build_profile(user_id)
+            if document is None:
+                raise NotFound({'error': 'User not found'})
+            cache.set(key, document, PROFILE_TIMEOUT)
+        # Only the viewer-dependent fields are computed per request
+        following = Follow.objects.filter(follower=request.user).values('followee_id')
+        followed_by = Follow.objects.filter(followee_id=user_id, follower_id__in=following).values_list('follower_id', flat=True)
+        return Response({
+            **document,
+            'is_following': Follow.objects.filter(follower=request.user, followee_id=user_id).exists(),
+            'followed_by': sorted(followed_by),
+        })
+    
     @action(detail=False, methods=['post'])
     def mark_watched(self, request):
         content_id = request.data.get('content_id')
         content = Content.objects.get(id=content_id)
-        WatchedContent.objects.get_or_create(user=request.user, content=content)
+        _, created = WatchedContent.objects.get_or_create(user=request.user, content=content)
+        if created:
+            # Fold the new title's neighbours into the user's stored candidates;
+            # locked so concurrent marks from the same user don't overwrite
+            # each other's merge
+            key = recommendations_key(request.user.id)
+            neighbours = cache.get(similar_key(content.id), [])
+            with cache_lock(key):
+                cache.set(key, merge_candidates(cache.get(key, []), content.id, WATCHED_WEIGHT, neighbours), None)
         return Response({'status': 'success'})
     
     @action(detail=True, methods=['get'])
     def comparisons(self, request, pk=None):
-        # Get content to compare with for ranking
-        watched_content = WatchedContent.objects.filter(user=request.user).exclude(content_id=pk)
-        content_ids = [w.content.id for w in watched_content[:3]]  # Get up to 3 for comparison
-        content = Content.objects.filter(id__in=content_ids)
+        # Get the next content to compare with for ranking: the middle of the
+        # range the new title can still land in. Empty once it has been placed.
+        try:
+            pk = int(pk)
+        except ValueError:
+            raise ValidationError({'error': 'Invalid content ID'})
+        if WatchedContent.objects.filter(user=request.user, content_id=pk, placed=True).exists():
+            return Response([])
+        key = insertion_session_key(request.user, pk)
+        state = cache.get(key)
+        if state is None:
+            ranking = WatchedContent.objects.filter(user=request.user).exclude(content_id=pk).order_by('-ranking_score', 'id')
+            session = InsertionSession(ranking.values_list('content_id', flat=True))
+            cache.set(key, session.to_dict(), INSERTION_SESSION_TIMEOUT)
+        else:
+            session = InsertionSession.from_dict(state)
+        pivot = session.pivot()
+        content = Content.objects.filter(id=pivot) if pivot is not None else Content.objects.none()
         serializer = ContentSerializer(content, many=True)
         return Response(serializer.data)
     
     @action(detail=False, methods=['post'])
     def submit_comparison(self, request):
-        new_content_id = request.data.get('new_content_id')
-        existing_content_id = request.data.get('existing_content_id')
-        preferred = request.data.get('preferred')  # 'new' or 'existing'
-        
-        ContentComparison.objects.create(
-            user=request.user,
-            content_a_id=new_content_id,
-            content_b_id=existing_content_id,
-            preferred='a' if preferred == 'new' else 'b'
-        )
+        # Accepts a single judgment or {"comparisons": [...]} with many of them
+        if not isinstance(request.data, dict):
+            raise ValidationError({'error': 'Expected a JSON object'})
+        judgments = request.data.get('comparisons') or [request.data]
+        if not isinstance(judgments, list):
+            raise ValidationError({'error': 'comparisons must be a list'})
+        comparisons = []
+        for judgment in judgments:
+            if not isinstance(judgment, dict) or judgment.get('preferred') not in ('new', 'existing'):
+                raise ValidationError({'error': 'Each comparison needs new_content_id, existing_content_id and preferred ("new" or "existing")'})
+            try:
+                content_a_id = int(judgment.get('new_content_id'))
+                content_b_id = int(judgment.get('existing_content_id'))
+            except (TypeError, ValueError):
+                raise ValidationError({'error': 'Invalid content ID'})
+            comparisons.append(ContentComparison(
+                user=request.user,
+                content_a_id=content_a_id,
+                content_b_id=content_b_id,
+                preferred='a' if judgment['preferred'] == 'new' else 'b',
+            ))
         
-        # Update ranking scores based on comparison
-        self.update_ranking_scores(request.user, new_content_id, existing_content_id, preferred)
+        # Judgments against a title's insertion pivot only narrow where it
+        # goes; Elo on them would move the pivots and reorder the titles the
+        # user has already ranked
+        sessions, rated = self.advance_insertions(request.user, comparisons)
+        with transaction.atomic():
+            ContentComparison.objects.bulk_create(comparisons)
+            # Update ranking scores based on comparison
+            self.update_ranking_scores(request.user, comparisons, rated)
+            for content_id, session in sessions.items():
+                if session.done:
+                    self.place_inserted(request.user, content_id, session)
+        for content_id, session in sessions.items():
+            key = insertion_session_key(request.user, content_id)
+            if session.done:
+                cache.delete(key)
+            else:
+                cache.set(key, session.to_dict(), INSERTION_SESSION_TIMEOUT)
         
-        return Response({'status': 'success'})
+        return Response({'status': 'success', 'count': len(comparisons)})
     
-    def update_ranking_scores(self, user, new_content_id, existing_content_id, preferred):
-        # Implement ELO-like ranking system based on comparisons
-        # This is a simplified version - you'd want a more sophisticated algorithm
-        new_watched = WatchedContent.objects.get(user=user, content_id=new_content_id)
-        existing_watched = WatchedContent.objects.get(user=user, content_id=existing_content_id)
-        
-        if preferred == 'new':
-            new_watched.ranking_score += 10
-            existing_watched.ranking_score -= 5
+    def advance_insertions(self, user, comparisons):
+        # Judgments against the current pivot narrow that title's insertion
+        # range. Returns the sessions they advanced, by title, and the other
+        # judgments.
+        sessions = {}
+        rest = []
+        for c in comparisons:
+            session = sessions.get(c.content_a_id)
+            if session is None:
+                state = cache.get(insertion_session_key(user, c.content_a_id))
+                session = InsertionSession.from_dict(state) if state is not None else None
+            if session is None or str(session.pivot()) != str(c.content_b_id):
+                rest.append(c)
+                continue
+            session.record(c.preferred == 'a')
+            sessions[c.content_a_id] = session
+        return sessions, rest
+    
+    def place_inserted(self, user, content_id, session):
+        # Score the placed title strictly between its new neighbours in the
+        # current ranking and mark it placed. Where their scores tie, the
+        # tied titles are spread out too, keeping their order.
+        watched = WatchedContent.objects.select_for_update().filter(user=user).exclude(content_id=content_id).order_by('id')
+        ranked = sorted(watched, key=lambda w: (-w.ranking_score, w.id))
+        content_ids = [w.content_id for w in ranked]
+        above, below = session.neighbours()
+        if above in content_ids:
+            position = content_ids.index(above) + 1
+        elif below in content_ids:
+            position = content_ids.index(below)
         else:
-            new_watched.ranking_score -= 5
-            existing_watched.ranking_score += 10
+            position = min(session.lo, len(ranked))
+        score, rescored = insertion_score([w.ranking_score for w in ranked], position)
+        for index, new_score in rescored.items():
+            ranked[index].ranking_score = new_score
+        WatchedContent.objects.bulk_update([ranked[index] for index in rescored], ['ranking_score'])
+        WatchedContent.objects.filter(user=user, content_id=content_id).update(ranking_score=score, placed=True)
+    
+    def update_ranking_scores(self, user, comparisons, rated=None):
+        # Incremental Elo over `rated` (default: all of `comparisons`, which
+        # must all be between watched titles). The affected rows are locked
+        # (in a stable order, so concurrent submissions can't deadlock),
+        # updated in memory and written back with one bulk_update;
+        # concurrent submissions serialize instead of overwriting each
+        # other's scores.
+        content_ids = {c.content_a_id for c in comparisons} | {c.content_b_id for c in comparisons}
+        watched = {
+            w.content_id: w
+            for w in WatchedContent.objects.select_for_update().filter(user=user, content_id__in=content_ids).order_by('id')
+        }
+        missing = content_ids - watched.keys()
+        if missing:
+            raise ValidationError({'error': f'Content {sorted(missing)} has not been marked as watched'})
         
-        new_watched.save()
-        existing_watched.save()
+        scores = {content_id: w.ranking_score for content_id, w in watched.items()}
+        for c in comparisons if rated is None else rated:
+            if c.preferred == 'a':
+                elo_update(scores, c.content_a_id, c.content_b_id)
+            else:
+                elo_update(scores, c.content_b_id, c.content_a_id)
+        for content_id, w in watched.items():
+            w.ranking_score = scores[content_id]
+        WatchedContent.objects.bulk_update(watched.values(), ['ranking_score'])
+    
+    @action(detail=False, methods=['post'])
+    def rerank(self, request):
+        # Refit every ranking_score from the user's whole comparison history.
+        # The fit starts from the current scores and is capped at
+        # RERANK_ITERATIONS sweeps, so the request stays short however long
+        # the history; repeated calls keep converging from where the last
+        # one stopped.
+        history = ContentComparison.objects.filter(user=request.user).values_list('content_a_id', 'content_b_id', 'preferred')
+        current = dict(WatchedContent.objects.filter(user=request.user).values_list('content_id', 'ranking_score'))
+        scores = bradley_terry(
+            ((a, b) if preferred == 'a' else (b, a) for a, b, preferred in history.iterator()),
+            iterations=RERANK_ITERATIONS, initial=current,
+        )
+        with transaction.atomic():
+            watched = list(WatchedContent.objects.select_for_update().filter(user=request.user))
+            for w in watched:
+                w.ranking_score = scores.get(w.content_id, 0)
+            WatchedContent.objects.bulk_update(watched, ['ranking_score'], batch_size=1000)
+        return Response({'status': 'success', 'ranked': len(scores)})
+
+    def follow_page(self, request, edges, user_field):
+        # Keyset-paged users on one side of a Follow queryset, newest edge first
+        paginator = KeysetPagination()
+        page = paginator.paginate_queryset(edges.select_related(f'{user_field}__profile'), request, self, ordering=('-id',))
+        serializer = UserSummarySerializer([getattr(edge, user_field) for edge in page], many=True)
+        return paginator.get_paginated_response(serializer.data)
+    
+    def target_user_id(self, request, default=None):
+        # ?user_id=, or `default` when it is absent
+        user_id = request.query_params.get('user_id')
+        if user_id is None and default is not None:
+            return default
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            raise ValidationError({'error': 'Invalid user ID'})
+        if not User.objects.filter(id=user_id).exists():
+            raise NotFound({'error': 'User not found'})
+        return user_id
+    
+    @action(detail=False, methods=['get'])
+    def followers(self, request):
+        return self.follow_page(request, Follow.objects.filter(followee_id=self.target_user_id(request, request.user.id)), 'follower')
+    
+    @action(detail=False, methods=['get'])
+    def following(self, request):
+        return self.follow_page(request, Follow.objects.filter(follower_id=self.target_user_id(request, request.user.id)), 'followee')
+    
+    @action(detail=False, methods=['get'])
+    def mutuals(self, request):
+        # People the user follows who follow them back
+        followers = Follow.objects.filter(followee=request.user).values('follower_id')
+        return self.follow_page(request, Follow.objects.filter(follower=request.user, followee_id__in=followers), 'followee')
+    
+    @action(detail=False, methods=['get'])
+    def followed_by(self, request):
+        # Which of the people the user follows also follow ?user_id=
+        following = Follow.objects.filter(follower=request.user).values('followee_id')
+        edges = Follow.objects.filter(followee_id=self.target_user_id(request), follower_id__in=following)
+        return self.follow_page(request, edges, 'follower')
+    
+    @action(detail=False, methods=['get'])
+    def feed(self, request):
+        # The user's fanned-out entries merged with the outboxes of everyone
+        # they follow, newest first. Outboxes are pulled whatever the
+        # followee's current follower count, so events written while an
+        # account was over the celebrity threshold stay visible after it
+        # drops below it. The timeline is a feed_user_idx range and the
+        # outboxes are feed_outbox_idx ranges, sorted together. Timelines and
+        # outboxes are trimmed, so a page reads at most FEED_TIMELINE_SIZE
+        # rows per followed outbox plus one page of the timeline, however
+        # long the history.
+        following = Follow.objects.filter(follower=request.user).values('followee_id')
+        entries = FeedEntry.objects.select_related('actor__profile', 'content')
+        paginator = KeysetPagination()
+        page = paginator.paginate_merged([
+            entries.filter(user=request.user, outbox=False, actor_id__in=following),
+            entries.filter(outbox=True, actor_id__in=following),
+        ], request, self, ordering=('-id',))
+        return paginator.get_paginated_response(FeedEntrySerializer(page, many=True).data)
+    
+    def _followee_id(self, request):
+        try:
+            followee_id = int(request.data.get('user_id'))
+        except (TypeError, ValueError):
+            raise ValidationError({'error': 'Invalid user ID'})
+        if not User.objects.filter(id=followee_id).exists():
+            raise NotFound({'error': 'User not found'})
+        return followee_id
+
+    @action(detail=False, methods=['post'])
+    def follow(self, request):
+        followee_id = self._followee_id(request)
+        if followee_id == request.user.id:
+            raise ValidationError({'error': 'You cannot follow yourself'})
+        with transaction.atomic():
+            ensure_profiles([followee_id, request.user.id])
+            _, created = Follow.objects.get_or_create(follower=request.user, followee_id=followee_id)
+            if created:
+                Profile.objects.filter(user_id=followee_id).update(followers_count=F('followers_count') + 1)
+                Profile.objects.filter(user=request.user).update(following_count=F('following_count') + 1)
+                transaction.on_commit(lambda: user_changes.publish(followee_id))
+                transaction.on_commit(lambda: invalidate_profile(followee_id))
+                transaction.on_commit(lambda: invalidate_profile(request.user.id))
+        return Response({'status': 'success'})
+    
+    @action(detail=False, methods=['post'])
+    def unfollow(self, request):
+        followee_id = self._followee_id(request)
+        with transaction.atomic():
+            ensure_profiles([followee_id, request.user.id])
+            deleted, _ = Follow.objects.filter(follower=request.user, followee_id=followee_id).delete()
+            if deleted:
+                Profile.objects.filter(user_id=followee_id).update(followers_count=F('followers_count') - 1)
+                Profile.objects.filter(user=request.user).update(following_count=F('following_count') - 1)
+                transaction.on_commit(lambda: user_changes.publish(followee_id))
+                transaction.on_commit(lambda: invalidate_profile(followee_id))
+                transaction.on_commit(lambda: invalidate_profile(request.user.id))
+        return Response({'status': 'success'})
+
+class UserSearchViewSet(viewsets.ViewSet):
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        try:
+            limit = int(request.query_params.get('limit', user_search.limit))
+        except ValueError:
+            raise ValidationError({'error': 'Invalid limit'})
+        user_ids = get_user_search().search(request.query_params.get('query', ''), limit)
+        users = User.objects.select_related('profile').in_bulk(user_ids)
+        serializer = UserSummarySerializer([users[user_id] for user_id in user_ids if user_id in users], many=True)
+        return Response(serializer.data)
 
 # urls.py
 from django.urls import path, include
@@ -178,15 +1058,18 @@ from . import views
 router = DefaultRouter()
 router.register(r'content', views.ContentViewSet)
 router.register(r'user', views.UserContentViewSet, basename='user')
+router.register(r'users', views.UserSearchViewSet, basename='users')
 
 urlpatterns = [
     path('api/', include(router.urls)),
     path('api/auth/', include('rest_framework.urls')),
+    path('metrics', views.metrics, name='metrics'),
 ]
 
 # serializers.py
+from django.contrib.auth.models import User
 from rest_framework import serializers
-from .models import Content, UserList
+from .models import Content, UserList, FeedEntry
 
 class ContentSerializer(serializers.ModelSerializer):
     class Meta:
@@ -203,218 +1086,4125 @@ class UserListSerializer(serializers.ModelSerializer):
     def get_content_count(self, obj):
         return obj.userlistitem_set.count()
 
-import json
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib.parse import urlparse, parse_qs
+class UserSummarySerializer(serializers.ModelSerializer):
+    followers_count = serializers.IntegerField(source='profile.followers_count', read_only=True)
+    following_count = serializers.IntegerField(source='profile.following_count', read_only=True)
+    
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'followers_count', 'following_count']
 
-# Mock database for demonstration purposes
-db = {
-    "content": [
-        {"id": 1, "title": "Dune: Part Two", "image": "/placeholder.svg?height=450&width=300&text=Dune+Part+Two", "rating": 4.8, "year": 2024, "platforms": ["HBO Max", "Prime Video"], "type": "Movie", "watched": False},
-        {"id": 2, "title": "The Bear", "image": "/placeholder.svg?height=450&width=300&text=The+Bear", "rating": 4.9, "year": 2023, "platforms": ["Hulu", "Disney+"], "type": "TV Series", "watched": False},
-        {"id": 3, "title": "Slow Horses", "image": "/placeholder.svg?height=450&width=300&text=Slow+Horses", "rating": 4.7, "year": 2023, "platforms": ["Apple TV+"], "type": "TV Series", "watched": False},
-        {"id": 4, "title": "Oppenheimer", "image": "/placeholder.svg?height=450&width=300&text=Oppenheimer", "rating": 4.7, "year": 2023, "platforms": ["Prime Video"], "type": "Movie", "watched": False},
-        {"id": 5, "title": "Poor Things", "image": "/placeholder.svg?height=450&width=300&text=Poor+Things", "rating": 4.5, "year": 2023, "platforms": ["Hulu"], "type": "Movie", "watched": False},
-        {"id": 6, "title": "Shogun", "image": "/placeholder.svg?height=450&width=300&text=Shogun", "rating": 4.6, "year": 2024, "platforms": ["Hulu", "Disney+"], "type": "TV Series", "watched": False},
-        {"id": 7, "title": "The Gentlemen", "image": "/placeholder.svg?height=450&width=300&text=The+Gentlemen", "rating": 4.3, "year": 2024, "platforms": ["Netflix"], "type": "TV Series", "watched": False},
-        {"id": 8, "title": "Severance", "image": "/placeholder.svg?height=450&width=300&text=Severance", "rating": 4.8, "year": 2022, "platforms": ["Apple TV+"], "type": "TV Series", "watched": False},
-        {"id": 9, "title": "Past Lives", "image": "/placeholder.svg?height=450&width=300&text=Past+Lives", "rating": 4.6, "year": 2023, "platforms": ["Showtime"], "type": "Movie", "watched": False},
-        {"id": 10, "title": "Anatomy of a Fall", "image": "/placeholder.svg?height=450&width=300&text=Anatomy+of+a+Fall", "rating": 4.4, "year": 2023, "platforms": ["Hulu"], "type": "Movie", "watched": False},
-    ],
-    "users": [
-        {"id": 1, "username": "johndoe", "display_name": "John Doe", "avatar": "/placeholder.svg?height=100&width=100&text=JD", "followers_count": 156, "following_count": 89, "is_following": False, "bio": "Movie enthusiast and TV show binge-watcher. Always looking for the next great story to dive into!", "favorite_genres": ["Sci-Fi", "Thriller", "Drama", "Comedy"], "streaming_platforms": ["Netflix", "HBO Max", "Prime Video", "Disney+"], "watched_content_ids": [4, 5, 2], "watchlist_content_ids": [1, 7]},
-        {"id": 2, "username": "moviefanatic", "display_name": "Movie Fanatic", "avatar": "/placeholder.svg?height=50&width=50&text=MF", "followers_count": 230, "following_count": 120, "is_following": True, "bio": "Just a simple movie lover.", "favorite_genres": ["Action"], "streaming_platforms": ["Netflix"], "watched_content_ids": [1, 3], "watchlist_content_ids": [6]},
-        {"id": 3, "username": "tvjunkie", "display_name": "TV Junkie", "avatar": "/placeholder.svg?height=50&width=50&text=TJ", "followers_count": 80, "following_count": 45, "is_following": False, "bio": "TV shows are my life.", "favorite_genres": ["Comedy"], "streaming_platforms": ["Hulu"], "watched_content_ids": [7, 8], "watchlist_content_ids": [9]},
-        {"id": 4, "username": "filmlover", "display_name": "Film Lover", "avatar": "/placeholder.svg?height=50&width=50&text=FL", "followers_count": 300, "following_count": 200, "is_following": True, "bio": "Cinema is my passion.", "favorite_genres": ["Drama"], "streaming_platforms": ["Apple TV+"], "watched_content_ids": [9, 10], "watchlist_content_ids": [4]},
-    ],
-    "relationships": {
-        1: [2, 4], # User 1 follows users 2 and 4
-        2: [1],
-        4: [1]
-    }
-}
+class FeedEntrySerializer(serializers.ModelSerializer):
+    actor = UserSummarySerializer(read_only=True)
+    content = ContentSerializer(read_only=True)
+    
+    class Meta:
+        model = FeedEntry
+        fields = ['id', 'actor', 'verb', 'content', 'created_at']
 
-class RequestHandler(BaseHTTPRequestHandler):
-    def _set_headers(self, status_code=200):
-        self.send_response(status_code)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*') # Allow CORS for development
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Authorization')
-        self.end_headers()
+# middleware.py
+import time
 
-    def do_OPTIONS(self):
-        self._set_headers(200)
+from django.db import connection
+from .views import request_metrics
 
-    def do_GET(self):
-        parsed_path = urlparse(self.path)
-        path = parsed_path.path
-        query_params = parse_qs(parsed_path.query)
+class QueryCounter:
+    # connection.execute_wrapper() hook counting the queries run through it
+    def __init__(self):
+        self.count = 0
 
-        if path == '/api/content/trending':
-            self._set_headers()
-            response = db["content"][:5]
-            self.wfile.write(json.dumps(response).encode('utf-8'))
-        elif path == '/api/user/watchlist':
-            self._set_headers()
-            user_id = 1 # Mock current user ID
-            user_data = next((u for u in db["users"] if u["id"] == user_id), None)
-            watchlist_content = [c for c in db["content"] if c["id"] in user_data["watchlist_content_ids"]] if user_data else []
-            self.wfile.write(json.dumps(watchlist_content).encode('utf-8'))
-        elif path == '/api/user/watched':
-            self._set_headers()
-            user_id = 1 # Mock current user ID
-            user_data = next((u for u in db["users"] if u["id"] == user_id), None)
-            watched_content = [c for c in db["content"] if c["id"] in user_data["watched_content_ids"]] if user_data else []
-            self.wfile.write(json.dumps(watched_content).encode('utf-8'))
-        elif path == '/api/content/recommended':
-            self._set_headers()
-            response = db["content"][5:]
-            self.wfile.write(json.dumps(response).encode('utf-8'))
-        elif path == '/api/content/discover':
-            self._set_headers()
-            # Basic filtering logic for discover page
-            filtered_content = db["content"]
-            search_query = query_params.get('search', [''])[0].lower()
-            content_type = query_params.get('contentType', ['all'])[0].lower()
-            min_rating = float(query_params.get('minRating', [0])[0])
-            year_range_start = int(query_params.get('yearRange[0]', [1990])[0])
-            year_range_end = int(query_params.get('yearRange[1]', [2024])[0])
-
-            if search_query:
-                filtered_content = [c for c in filtered_content if search_query in c['title'].lower()]
-            if content_type != 'all':
-                filtered_content = [c for c in filtered_content if c.get('type', '').lower() == content_type]
-            if min_rating > 0:
-                filtered_content = [c for c in filtered_content if c['rating'] >= min_rating]
-            filtered_content = [c for c in filtered_content if year_range_start <= c['year'] <= year_range_end]
-
-            self.wfile.write(json.dumps(filtered_content).encode('utf-8'))
-        elif path.startswith('/api/content/'):
-            try:
-                content_id = int(path.split('/')[-1])
-                content = next((c for c in db["content"] if c["id"] == content_id), None)
-                if content:
-                    self._set_headers()
-                    self.wfile.write(json.dumps(content).encode('utf-8'))
-                else:
-                    self._set_headers(404)
-                    self.wfile.write(json.dumps({"error": "Content not found"}).encode('utf-8'))
-            except ValueError:
-                self._set_headers(400)
-                self.wfile.write(json.dumps({"error": "Invalid content ID"}).encode('utf-8'))
-        elif path == '/api/users/search':
-            search_query = query_params.get('query', [''])[0].lower()
-            results = [u for u in db["users"] if search_query in u['username'].lower() or search_query in u['display_name'].lower()]
-            self._set_headers()
-            self.wfile.write(json.dumps(results).encode('utf-8'))
-        elif path == '/api/user/followers':
-            user_id = 1 # Mock current user ID
-            followers_ids = [u_id for u_id, following_list in db["relationships"].items() if user_id in following_list]
-            followers = [u for u in db["users"] if u["id"] in followers_ids]
-            self._set_headers()
-            self.wfile.write(json.dumps(followers).encode('utf-8'))
-        elif path == '/api/user/following':
-            user_id = 1 # Mock current user ID
-            following_ids = db["relationships"].get(user_id, [])
-            following = [u for u in db["users"] if u["id"] in following_ids]
-            self._set_headers()
-            self.wfile.write(json.dumps(following).encode('utf-8'))
-        elif path.startswith('/api/user/profile/'):
-            try:
-                user_id = int(path.split('/')[-1])
-                user_data = next((u for u in db["users"] if u["id"] == user_id), None)
-                if user_data:
-                    profile = {
-                        "id": user_data["id"],
-                        "username": user_data["username"],
-                        "display_name": user_data["display_name"],
-                        "avatar": user_data["avatar"],
-                        "bio": user_data["bio"],
-                        "followers_count": user_data["followers_count"],
-                        "following_count": user_data["following_count"],
-                        "is_following": user_id in db["relationships"].get(1, []), # Mock if current user (ID 1) follows this user
-                        "favorite_genres": user_data["favorite_genres"],
-                        "streaming_platforms": user_data["streaming_platforms"],
-                        "watched_content": [c for c in db["content"] if c["id"] in user_data["watched_content_ids"]],
-                        "watchlist_content": [c for c in db["content"] if c["id"] in user_data["watchlist_content_ids"]],
-                    }
-                    self._set_headers()
-                    self.wfile.write(json.dumps(profile).encode('utf-8'))
-                else:
-                    self._set_headers(404)
-                    self.wfile.write(json.dumps({"error": "User not found"}).encode('utf-8'))
-            except ValueError:
-                self._set_headers(400)
-                self.wfile.write(json.dumps({"error": "Invalid user ID"}).encode('utf-8'))
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+class MetricsMiddleware:
+    # Records latency, status, response size and ORM query count of every
+    # request in request_metrics, labelled with the URL name (e.g.
+    # 'content-trending'; 'unmatched' when nothing resolved). Goes first in
+    # MIDDLEWARE so the timing covers the rest of the stack. Queries a
+    # streamed body runs while it is being sent aren't counted.
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+        match = request.resolver_match
+        route = match.view_name if match else 'unmatched'
+        if response.streaming:
+            request_metrics.observe(request.method, route, response.status_code, elapsed, queries=queries.count)
+            response.streaming_content = request_metrics.count_stream(request.method, route, response.streaming_content)
         else:
-            self._set_headers(404)
-            self.wfile.write(json.dumps({"error": "Not Found"}).encode('utf-8'))
+            request_metrics.observe(request.method, route, response.status_code, elapsed, len(response.content), queries.count)
+        return response
 
-    def do_POST(self):
-        parsed_path = urlparse(self.path)
-        path = parsed_path.path
-        content_length = int(self.headers['Content-Length'])
-        post_data = json.loads(self.rfile.read(content_length))
-
-        if path == '/api/content/mark-watched':
-            content_id = post_data.get('contentId')
-            # In a real app, update database
-            self._set_headers(200)
-            self.wfile.write(json.dumps({"message": f"Content {content_id} marked as watched"}).encode('utf-8'))
-        elif path == '/api/content/update-watched':
-            content_id = post_data.get('contentId')
-            rating = post_data.get('rating')
-            # In a real app, update database
-            self._set_headers(200)
-            self.wfile.write(json.dumps({"message": f"Content {content_id} updated with rating {rating}"}).encode('utf-8'))
-        elif path == '/api/list/add-content':
-            content_id = post_data.get('contentId')
-            list_name = post_data.get('listName')
-            # In a real app, update database
-            self._set_headers(200)
-            self.wfile.write(json.dumps({"message": f"Content {content_id} added to list {list_name}"}).encode('utf-8'))
-        elif path == '/api/list/create-and-add':
-            list_name = post_data.get('listName')
-            content_id = post_data.get('contentId')
-            # In a real app, create list and add content
-            self._set_headers(200)
-            self.wfile.write(json.dumps({"message": f"List {list_name} created and content {content_id} added"}).encode('utf-8'))
-        elif path == '/api/user/follow':
-            user_to_follow_id = post_data.get('userId')
-            current_user_id = 1 # Mock current user
-            if current_user_id not in db["relationships"]:
-                db["relationships"][current_user_id] = []
-            if user_to_follow_id not in db["relationships"][current_user_id]:
-                db["relationships"][current_user_id].append(user_to_follow_id)
-                # Update followers count for the followed user (mock)
-                for user in db["users"]:
-                    if user["id"] == user_to_follow_id:
-                        user["followers_count"] += 1
-                        break
-            self._set_headers(200)
-            self.wfile.write(json.dumps({"message": f"User {user_to_follow_id} followed"}).encode('utf-8'))
-        elif path == '/api/user/unfollow':
-            user_to_unfollow_id = post_data.get('userId')
-            current_user_id = 1 # Mock current user
-            if current_user_id in db["relationships"] and user_to_unfollow_id in db["relationships"][current_user_id]:
-                db["relationships"][current_user_id].remove(user_to_unfollow_id)
-                # Update followers count for the unfollowed user (mock)
-                for user in db["users"]:
-                    if user["id"] == user_to_unfollow_id:
-                        user["followers_count"] -= 1
-                        break
-            self._set_headers(200)
-            self.wfile.write(json.dumps({"message": f"User {user_to_unfollow_id} unfollowed"}).encode('utf-8'))
+# management/commands/build_recommendations.py
+from collections import defaultdict
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from ...models import WatchedContent, UserListItem, ContentComparison
+from ...recommender import (
+    WATCHED_WEIGHT, LISTED_WEIGHT, PREFERRED_WEIGHT,
+    item_neighbours, user_candidates, similar_key, recommendations_key,
+)
+
+class Command(BaseCommand):
+    help = 'Precompute item-item similarities and per-user recommendation candidates'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--neighbours', type=int, default=50)
+        parser.add_argument('--candidates', type=int, default=200)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        profiles = defaultdict(dict)
+        for user_id, content_id in WatchedContent.objects.values_list('user_id', 'content_id').iterator(chunk_size=10000):
+            profiles[user_id][content_id] = profiles[user_id].get(content_id, 0) + WATCHED_WEIGHT
+        for user_id, content_id in UserListItem.objects.values_list('user_list__user_id', 'content_id').iterator(chunk_size=10000):
+            profiles[user_id][content_id] = profiles[user_id].get(content_id, 0) + LISTED_WEIGHT
+        comparisons = ContentComparison.objects.values_list('user_id', 'content_a_id', 'content_b_id', 'preferred')
+        for user_id, content_a_id, content_b_id, preferred in comparisons.iterator(chunk_size=10000):
+            winner = content_a_id if preferred == 'a' else content_b_id
+            profiles[user_id][winner] = profiles[user_id].get(winner, 0) + PREFERRED_WEIGHT
+
+        neighbours = item_neighbours(profiles, options['neighbours'])
+        self._store({similar_key(item): similar for item, similar in neighbours.items()}, options['batch_size'])
+        self._store(
+            {recommendations_key(user_id): user_candidates(profile, neighbours, options['candidates']) for user_id, profile in profiles.items()},
+            options['batch_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(f'Built recommendations for {len(profiles)} users over {len(neighbours)} titles'))
+
+    def _store(self, entries, batch_size):
+        batch = {}
+        for key, value in entries.items():
+            batch[key] = value
+            if len(batch) >= batch_size:
+                cache.set_many(batch, timeout=None)
+                batch = {}
+        if batch:
+            cache.set_many(batch, timeout=None)
+
+# management/commands/backfill_content_tags.py
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ...models import Content, Genre, Platform, replace_tag_links
+
+class Command(BaseCommand):
+    help = 'Fill the Genre/Platform tables and link rows from the Content genres/platforms lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        # Data migration for the normalized tags; safe to re-run, each batch
+        # of titles has its links replaced
+        rows = Content.objects.values_list('id', 'genres', 'platforms').iterator(chunk_size=10000)
+        count = 0
+        while batch := list(islice(rows, options['batch_size'])):
+            with transaction.atomic():
+                replace_tag_links(batch)
+            count += len(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f'Linked {count} titles to {Genre.objects.count()} genres and {Platform.objects.count()} platforms'
+        ))
+
+# management/commands/backfill_profiles.py
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from ...models import Follow, Profile
+from ...views import user_changes
+
+class Command(BaseCommand):
+    help = 'Create missing Profile rows and recount followers/following from Follow'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        # Data migration for the denormalized counts; safe to re-run, and also
+        # repairs counts that drifted while profiles were missing
+        user_ids = User.objects.order_by('id').values_list('id', flat=True).iterator(chunk_size=10000)
+        count = 0
+        while batch := list(islice(user_ids, options['batch_size'])):
+            followers = dict(Follow.objects.filter(followee_id__in=batch).values_list('followee_id').annotate(n=Count('id')))
+            following = dict(Follow.objects.filter(follower_id__in=batch).values_list('follower_id').annotate(n=Count('id')))
+            profiles = [
+                Profile(user_id=user_id, followers_count=followers.get(user_id, 0), following_count=following.get(user_id, 0))
+                for user_id in batch
+            ]
+            with transaction.atomic():
+                Profile.objects.bulk_create(profiles, ignore_conflicts=True)
+                Profile.objects.bulk_update(profiles, ['followers_count', 'following_count'])
+            count += len(batch)
+        # Follower counts may have changed; user search indexes reload
+        user_changes.publish()
+        self.stdout.write(self.style.SUCCESS(f'Backfilled profiles for {count} users'))
+
+# management/commands/trim_feeds.py
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from ...feed import FEED_TIMELINE_SIZE
+from ...models import FeedEntry, Profile
+from ...views import trim_feed
+
+class Command(BaseCommand):
+    help = 'Flag outbox entries written before FeedEntry.outbox and trim every timeline and outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=FEED_TIMELINE_SIZE)
+
+    def handle(self, *args, **options):
+        # Data migration for the bounded feeds; safe to re-run. Outbox
+        # entries written before the flag existed have user == actor.
+        size = options['size']
+        flagged = FeedEntry.objects.filter(user_id=F('actor_id'), outbox=False).update(outbox=True)
+        actors = FeedEntry.objects.filter(outbox=True).values_list('actor_id', flat=True).distinct()
+        for actor_id in actors.iterator():
+            trim_feed(FeedEntry.objects.filter(outbox=True, actor_id=actor_id), size)
+        users = FeedEntry.objects.filter(outbox=False).values_list('user_id', flat=True).distinct()
+        for user_id in users.iterator():
+            trim_feed(FeedEntry.objects.filter(user_id=user_id, outbox=False), size)
+        # An upper bound; the next trim of a shorter timeline deletes nothing
+        Profile.objects.update(feed_size=size)
+        self.stdout.write(self.style.SUCCESS(f'Flagged {flagged} outbox entries and trimmed feeds to {size} entries'))
+
+# management/commands/check_discover_plan.py
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+from ...models import Content
+from ...views import KeysetPagination, discover_queryset
+
+# Representative discover requests; each must be answered in keyset order from
+# an index, without a full table scan or a sort
+DISCOVER_PLAN_CASES = [
+    '',
+    'content_type=movie',
+    'min_rating=4',
+    'content_type=show&min_rating=4',
+    'year_range_start=2020&year_range_end=2024',
+    'platform=Netflix',
+    'genres=Drama,Comedy',
+    'content_type=movie&platform=Hulu&genres=Drama&year_range_start=2020&year_range_end=2024',
+]
+
+class Command(BaseCommand):
+    help = "EXPLAIN discover's queries and fail if any of them scans a table without an index or sorts"
+
+    def handle(self, *args, **options):
+        failures = []
+        for case in DISCOVER_PLAN_CASES:
+            queryset, ordering = discover_queryset(Content.objects.all(), QueryDict(case))
+            plan = queryset.order_by(*ordering)[:KeysetPagination.page_size].explain()
+            # SQLite reports "SCAN <table>" for full scans and adds
+            # "USING [COVERING] INDEX" when it walks an index instead;
+            # "USE TEMP B-TREE FOR ORDER BY" means every match gets sorted
+            # before the first page comes back
+            problems = [
+                line for line in plan.splitlines()
+                if (re.search(r'\bSCAN\b', line) and 'INDEX' not in line) or 'TEMP B-TREE' in line
+            ]
+            if problems:
+                failures.append(f'{case or "(no filters)"}: ' + '; '.join(line.strip() for line in problems))
+            self.stdout.write(f'{case or "(no filters)"}\n{plan}\n')
+        if failures:
+            raise CommandError('Unindexed scans or sorts in discover:\n' + '\n'.join(failures))
+        self.stdout.write(self.style.SUCCESS(f'All {len(DISCOVER_PLAN_CASES)} discover queries read an index in keyset order'))
+
+# management/commands/import_catalog.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from ...importer import FieldSpec, import_catalog
+from ...models import Content, replace_tag_links
+from ...views import invalidate_profiles, publish_catalog_change
+
+FIELD_KINDS = {
+    'AutoField': int, 'BigAutoField': int, 'IntegerField': int, 'FloatField': float,
+    'CharField': str, 'URLField': str, 'TextField': str, 'JSONField': list,
+}
+
+def content_schema():
+    # Importer schema derived from Content, so validation follows the model
+    schema = {}
+    for field in Content._meta.concrete_fields:
+        if getattr(field, 'auto_now_add', False):
+            continue
+        schema[field.name] = FieldSpec(
+            FIELD_KINDS[field.get_internal_type()],
+            field.primary_key or not (field.blank or field.has_default()),
+            field.max_length,
+            {value for value, _ in field.choices} if field.choices else None,
+        )
+    return schema
+
+class Command(BaseCommand):
+    help = 'Stream a JSONL or CSV catalog file into Content with batched upserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--checkpoint', help='checkpoint file (default: PATH.checkpoint)')
+        parser.add_argument('--restart', action='store_true', help='ignore an existing checkpoint')
+
+    def handle(self, *args, **options):
+        schema = content_schema()
+        update_fields = [name for name in schema if name != 'id']
+
+        def write_batch(rows):
+            with transaction.atomic():
+                Content.objects.bulk_create(
+                    [Content(**row) for row in rows],
+                    update_conflicts=True, unique_fields=['id'], update_fields=update_fields,
+                )
+                replace_tag_links((row['id'], row.get('genres', []), row.get('platforms', [])) for row in rows)
+
+        def progress(stats):
+            self.stdout.write(
+                f"{stats['rows']} rows, {stats['imported']} imported, {stats['rejected']} rejected, {stats['rows_per_s']:.0f} rows/s"
+            )
+
+        stats = import_catalog(
+            options['path'], write_batch, schema, options['batch_size'],
+            options['checkpoint'] or options['path'] + '.checkpoint', progress, resume=not options['restart'],
+        )
+        # bulk_create sends no signals; a catalog change without an id makes
+        # every process clear its response cache and reload its title index
+        invalidate_profiles(Content)
+        publish_catalog_change()
+        for row_number, message in stats['errors']:
+            self.stderr.write(f'row {row_number}: {message}')
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats['imported']} titles ({stats['rejected']} rejected) at {stats['rows_per_s']:.0f} rows/s"
+        ))
+
+# management/commands/load_test.py
+import json
+import random
+from collections import Counter
+from itertools import islice
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from ...loadtest import (
+    SYNTHETIC_CONTENT_TYPES, SYNTHETIC_GENRES, SYNTHETIC_PLATFORMS,
+    LoadRoute, check_load, run_load, synthetic_catalog, synthetic_follows, synthetic_users,
+)
+from ...models import Content, Follow, Profile, UserList, UserListItem, WatchedContent, replace_tag_links
+from ...views import invalidate_profiles, publish_catalog_change, user_changes
+
+# Ids and names the requests pick from
+SAMPLE_SIZE = 10_000
+
+def discover_path(rng):
+    params = {}
+    if rng.random() < 0.5:
+        params['content_type'] = rng.choice(SYNTHETIC_CONTENT_TYPES)
+    if rng.random() < 0.3:
+        params['platform'] = rng.choice(SYNTHETIC_PLATFORMS)
+    if rng.random() < 0.3:
+        params['genres'] = ','.join(rng.sample(SYNTHETIC_GENRES, rng.randint(1, 2)))
+    if rng.random() < 0.3:
+        params['min_rating'] = rng.choice([3, 4, 4.5])
+    if rng.random() < 0.2:
+        params['search'] = f'title {rng.randint(1, 999)}'
+    return '/api/content/discover/?' + urlencode(params)
+
+def search_path(rng, data):
+    username = rng.choice(data['usernames'])
+    return '/api/users/search/?' + urlencode({'query': username[:rng.randint(3, len(username))]})
+
+def other_user(rng, data, viewer):
+    # Anyone but the viewer, since following yourself is an error
+    user_ids = data['user_ids']
+    user_id = rng.choice(user_ids)
+    if user_id == viewer and len(user_ids) > 1:
+        user_id = user_ids[user_ids.index(viewer) - 1]
+    return user_id
+
+def comparison(rng, data, viewer):
+    new, existing = rng.sample(data['watched'][viewer], 2)
+    return {'new_content_id': new, 'existing_content_id': existing, 'preferred': rng.choice(['new', 'existing'])}
+
+def _get(path):
+    return lambda rng, data, viewer: ('GET', path, None)
+
+# Every ContentViewSet, UserContentViewSet and UserSearchViewSet action,
+# named by URL name like the metrics and weighted roughly like app traffic
+DJANGO_LOAD_ROUTES = [
+    LoadRoute('content-list', 1, _get('/api/content/')),
+    LoadRoute('content-detail', 10, lambda rng, data, viewer: ('GET', f"/api/content/{rng.choice(data['content_ids'])}/", None)),
+    LoadRoute('content-trending', 10, _get('/api/content/trending/')),
+    LoadRoute('content-discover', 10, lambda rng, data, viewer: ('GET', discover_path(rng), None)),
+    LoadRoute('content-recommended', 10, _get('/api/content/recommended/?page_size=20')),
+    LoadRoute('content-cache-stats', 1, _get('/api/content/cache_stats/')),
+    LoadRoute('user-watchlist', 5, _get('/api/user/watchlist/')),
+    LoadRoute('user-watched', 5, _get('/api/user/watched/')),
+    LoadRoute('user-profile', 10, lambda rng, data, viewer: ('GET', f"/api/user/{rng.choice(data['user_ids'])}/profile/", None)),
+    LoadRoute('user-feed', 5, _get('/api/user/feed/')),
+    LoadRoute('user-followers', 2, lambda rng, data, viewer: ('GET', f"/api/user/followers/?user_id={rng.choice(data['user_ids'])}", None)),
+    LoadRoute('user-following', 2, lambda rng, data, viewer: ('GET', f"/api/user/following/?user_id={rng.choice(data['user_ids'])}", None)),
+    LoadRoute('user-mutuals', 2, _get('/api/user/mutuals/')),
+    LoadRoute('user-followed-by', 2, lambda rng, data, viewer: ('GET', f"/api/user/followed_by/?user_id={other_user(rng, data, viewer)}", None)),
+    LoadRoute('user-comparisons', 2, lambda rng, data, viewer: ('GET', f"/api/user/{rng.choice(data['content_ids'])}/comparisons/", None)),
+    LoadRoute('users-search', 5, lambda rng, data, viewer: ('GET', search_path(rng, data), None)),
+    LoadRoute('metrics', 1, _get('/metrics')),
+    LoadRoute('user-mark-watched', 2, lambda rng, data, viewer: ('POST', '/api/user/mark_watched/', {'content_id': rng.choice(data['content_ids'])})),
+    LoadRoute('user-submit-comparison', 2, lambda rng, data, viewer: ('POST', '/api/user/submit_comparison/', comparison(rng, data, viewer))),
+    LoadRoute('user-rerank', 1, lambda rng, data, viewer: ('POST', '/api/user/rerank/', {})),
+    LoadRoute('user-follow', 2, lambda rng, data, viewer: ('POST', '/api/user/follow/', {'user_id': other_user(rng, data, viewer)})),
+    LoadRoute('user-unfollow', 2, lambda rng, data, viewer: ('POST', '/api/user/unfollow/', {'user_id': other_user(rng, data, viewer)})),
+]
+
+class DjangoLoadClient:
+    # In-process requests through the whole middleware stack, logged in as
+    # `viewer`. Each client thread uses its own database connection.
+    def __init__(self, viewer, host):
+        self.viewer = viewer
+        self.client = Client(HTTP_HOST=host, raise_request_exception=False)
+        self.client.force_login(User.objects.get(id=viewer))
+
+    def send(self, method, path, body=None):
+        if method == 'POST':
+            response = self.client.post(path, body, content_type='application/json')
         else:
-            self._set_headers(404)
-            self.wfile.write(json.dumps({"error": "Not Found"}).encode('utf-8'))
+            response = self.client.get(path)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return response.status_code, content
+
+    def close(self):
+        connection.close()
+
+class Command(BaseCommand):
+    help = 'Drive every API route with concurrent clients and report throughput and p50/p95/p99 latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generate', action='store_true', help='first create --titles titles and --users users following each other')
+        parser.add_argument('--titles', type=int, default=10_000)
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--follows', type=int, default=10, help='follows per generated user')
+        parser.add_argument('--prefix', default='loadtest_', help='username prefix of generated users, whom the clients log in as')
+        parser.add_argument('--clients', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=200, help='requests per client')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--host', default='localhost', help='Host header; must be in ALLOWED_HOSTS')
+        parser.add_argument('--max-p99-ms', type=float, help='fail if the overall p99 latency is higher')
+        parser.add_argument('--max-error-rate', type=float, default=0.0, help='fail if a larger share of requests fail')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        users = User.objects.all()
+        if options['generate']:
+            self.generate(options, rng)
+            users = users.filter(username__startswith=options['prefix'])
+        viewers = list(
+            users.annotate(watched_count=Count('watchedcontent')).filter(watched_count__gte=2)
+            .order_by('id').values_list('id', flat=True)[:options['clients']]
+        )
+        content_ids = list(Content.objects.order_by('id').values_list('id', flat=True)[:SAMPLE_SIZE])
+        if not viewers or not content_ids:
+            raise CommandError('Nothing to load test: no titles or no users with two watched titles; try --generate')
+        data = {
+            'content_ids': content_ids,
+            'user_ids': list(users.order_by('id').values_list('id', flat=True)[:SAMPLE_SIZE]),
+            'usernames': list(users.order_by('id').values_list('username', flat=True)[:SAMPLE_SIZE]),
+            'watched': {viewer: [] for viewer in viewers},
+        }
+        for user_id, content_id in WatchedContent.objects.filter(user_id__in=viewers).values_list('user_id', 'content_id'):
+            data['watched'][user_id].append(content_id)
+
+        report = run_load(
+            lambda index: DjangoLoadClient(viewers[index % len(viewers)], options['host']),
+            DJANGO_LOAD_ROUTES, data, options['clients'], options['requests'], options['seed'],
+        )
+        self.stdout.write(json.dumps(report, indent=2))
+        failures = check_load(report, options['max_p99_ms'], options['max_error_rate'])
+        if failures:
+            raise CommandError('Load test over budget: ' + '; '.join(failures))
+        self.stdout.write(self.style.SUCCESS(
+            f"{report['requests']} requests from {report['clients']} clients at {report['throughput_rps']:.0f} req/s, "
+            f"p50 {report['p50_ms']}ms, p95 {report['p95_ms']}ms, p99 {report['p99_ms']}ms"
+        ))
+
+    def generate(self, options, rng):
+        # Synthetic titles, users, follow graph, watched titles and watchlists,
+        # written with bulk_create. Needs a backend that returns primary keys
+        # from bulk_create (PostgreSQL, SQLite).
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f'Users named {prefix}* already exist; pass another --prefix')
+        titles, users = options['titles'], options['users']
+        with transaction.atomic():
+            content = Content.objects.bulk_create(
+                [Content(**{name: value for name, value in row.items() if name != 'id'}) for row in synthetic_catalog(titles, rng)],
+                batch_size=1000,
+            )
+            rows = iter((c.id, c.genres, c.platforms) for c in content)
+            while batch := list(islice(rows, 1000)):
+                replace_tag_links(batch)
+            # Synthetic ids are 1-based positions in these lists
+            content_ids = [c.id for c in content]
+            synthetic = list(synthetic_users(users, titles, rng))
+            user_ids = [u.id for u in User.objects.bulk_create(
+                [User(username=prefix + row['username'], first_name=row['display_name'].partition(' ')[0],
+                      last_name=row['display_name'].partition(' ')[2]) for row in synthetic],
+                batch_size=1000,
+            )]
+            follows = synthetic_follows(users, options['follows'], rng)
+            followers = Counter(followee for followees in follows.values() for followee in followees)
+            # bulk_create sends no signals, so profiles are created here
+            Profile.objects.bulk_create(
+                [Profile(user_id=user_ids[user - 1], followers_count=followers[user], following_count=len(follows[user])) for user in follows],
+                batch_size=5000,
+            )
+            Follow.objects.bulk_create(
+                [Follow(follower_id=user_ids[user - 1], followee_id=user_ids[followee - 1]) for user, followees in follows.items() for followee in followees],
+                batch_size=5000,
+            )
+            WatchedContent.objects.bulk_create(
+                [WatchedContent(user_id=user_ids[row['id'] - 1], content_id=content_ids[title - 1]) for row in synthetic for title in row['watched']],
+                batch_size=5000,
+            )
+            watchlists = UserList.objects.bulk_create([UserList(user_id=user_id, name='Watchlist') for user_id in user_ids], batch_size=5000)
+            UserListItem.objects.bulk_create(
+                [UserListItem(user_list=watchlist, content_id=content_ids[title - 1]) for watchlist, row in zip(watchlists, synthetic) for title in row['watchlist']],
+                batch_size=5000,
+            )
+        invalidate_profiles(Content)
+        publish_catalog_change()
+        user_changes.publish()
+        self.stdout.write(f'Generated {titles} titles, {users} users and {sum(followers.values())} follows')
+
+# tests.py
+import base64
+import json
+import math
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+from .catalog import CatalogIndex
+from .feed import CELEBRITY_THRESHOLD, ActivityFeed, FEED_LISTED, FEED_WATCHED
+from .graph import SocialGraph
+from .models import Content, Follow, FeedEntry, Profile, WatchedContent
+from .pagination import encode_cursor, decode_cursor, keyset_page
+from .ranking import InsertionSession, insertion_score
+from .search import TrigramIndex, UserPrefixIndex
+from .store import WAL_FRAME, Store, WriteAheadLog, read_wal
+from .views import publish_activity
+
+def raw_cursor(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii')
+
+class CursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor((4.5, 12)), 2), (4.5, 12))
+
+    def test_rejects_cursors_we_did_not_issue(self):
+        cursors = [raw_cursor(value) for value in (['a'], [True], [], [[1]], {'rating': 4}, [None])]
+        cursors += [raw_cursor([float('nan')]), 'not a cursor', '%%%']
+        for cursor in cursors:
+            with self.subTest(cursor=cursor), self.assertRaises(ValueError):
+                decode_cursor(cursor)
+        with self.assertRaises(ValueError):
+            decode_cursor(encode_cursor((4.5, 12, 3)), 2)
+
+    def test_pages_cover_every_item_once(self):
+        # (rating, id) keys with tied ratings, walked in both directions
+        items = sorted(((i % 5) / 2, i) for i in range(103))
+        for reverse in (False, True):
+            ordered = items[::-1] if reverse else items
+            seen = []
+            cursor = None
+            while True:
+                page, next_cursor = keyset_page(ordered, lambda item: item, cursor, page_size=10, reverse=reverse)
+                seen += page
+                if next_cursor is None:
+                    break
+                cursor = decode_cursor(next_cursor, 2)
+            self.assertEqual(seen, ordered)
+
+class WriteAheadLogTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.wal_path = os.path.join(self.directory, 'wal.log')
+
+    def open_store(self):
+        # A store whose state is the list of records applied to it
+        applied = []
+        store = Store(self.directory, lambda: {'applied': list(applied)}, lambda sections: applied.extend(sections['applied']), applied.append)
+        store.open()
+        self.addCleanup(store.close)
+        return store, applied
+
+    def write(self, store, applied, *values):
+        # Applied, then logged, like the mock server's mutate()
+        for value in values:
+            record = {'op': 'append', 'args': [value], 'at': 0}
+            applied.append(record)
+            lsn = store.log(record['op'], record['args'], record['at'])
+        store.commit(lsn)
+
+    def test_records_are_read_back_in_order(self):
+        wal = WriteAheadLog(self.wal_path)
+        for value in range(5):
+            wal.append({'op': 'append', 'args': [value]})
+        wal.close()
+        self.assertEqual([(lsn, record['args']) for lsn, record in read_wal(self.wal_path)], [(i + 1, [i]) for i in range(5)])
+
+    def test_reopen_replays_the_log(self):
+        store, applied = self.open_store()
+        self.write(store, applied, 'a', 'b', 'c')
+        store.close()
+        _, applied = self.open_store()
+        self.assertEqual([record['args'] for record in applied], [['a'], ['b'], ['c']])
+
+    def test_torn_tail_is_dropped_and_truncated(self):
+        store, applied = self.open_store()
+        self.write(store, applied, 'a', 'b')
+        store.close()
+        intact = os.path.getsize(self.wal_path)
+        with open(self.wal_path, 'ab') as f:
+            f.write(WAL_FRAME.pack(3, 100, 0) + b'{"op":"app')  # crashed mid-write
+        store, applied = self.open_store()
+        self.assertEqual([record['args'] for record in applied], [['a'], ['b']])
+        self.assertEqual(os.path.getsize(self.wal_path), intact)
+        # New records follow the intact ones and survive the next restart
+        self.write(store, applied, 'c')
+        store.close()
+        _, applied = self.open_store()
+        self.assertEqual([record['args'] for record in applied], [['a'], ['b'], ['c']])
+
+    def test_corrupt_frame_ends_replay(self):
+        store, applied = self.open_store()
+        self.write(store, applied, 'a', 'b')
+        store.close()
+        with open(self.wal_path, 'r+b') as f:
+            f.seek(-2, os.SEEK_END)
+            f.write(b'!!')
+        _, applied = self.open_store()
+        self.assertEqual([record['args'] for record in applied], [['a']])
+
+    def test_snapshot_covers_rotated_segments(self):
+        store, applied = self.open_store()
+        self.write(store, applied, 'a', 'b')
+        store.snapshot()
+        self.write(store, applied, 'c')
+        store.close()
+        _, applied = self.open_store()
+        self.assertEqual([record['args'] for record in applied], [['a'], ['b'], ['c']])
+
+def scan_catalog(content, search='', content_type='all', platform='all', min_rating=0, year_start=1990, year_end=2024):
+    # The list-comprehension filters CatalogIndex.query() replaced
+    return [
+        c for c in content
+        if search in c['title'].lower()
+        and (content_type == 'all' or c.get('type', '').lower() == content_type)
+        and (platform == 'all' or platform in c.get('platforms', []))
+        and (min_rating <= 0 or c['rating'] >= min_rating)
+        and year_start <= c['year'] <= year_end
+    ]
+
+class CatalogIndexTests(SimpleTestCase):
+    QUERIES = [
+        {},
+        {'search': 'the'},
+        {'content_type': 'show'},
+        {'platform': 'Hulu'},
+        {'min_rating': 4.5},
+        {'year_start': 2020, 'year_end': 2022},
+        {'year_start': 2024, 'year_end': 2020},
+        {'search': 'a', 'content_type': 'movie', 'platform': 'Netflix', 'min_rating': 3, 'year_start': 2000},
+    ]
+
+    def setUp(self):
+        self.content = [
+            {'id': content_id, 'title': title, 'type': content_type, 'platforms': platforms, 'rating': rating, 'year': year}
+            for content_id, title, content_type, platforms, rating, year in (
+                (1, 'The Bear', 'Show', ['Hulu'], 4.8, 2022),
+                (2, 'Dune', 'Movie', ['Max', 'Netflix'], 4.5, 2021),
+                (3, 'Alien', 'Movie', ['Hulu'], 4.7, 1979),
+                (4, 'The Crown', 'Show', ['Netflix'], 4.5, 2016),
+                (5, 'Past Lives', 'Movie', ['Netflix'], 3.9, 2023),
+                (6, 'Arcane', 'Show', ['Netflix'], 4.9, 2021),
+                (7, 'Barbie', 'Movie', ['Max'], 3.5, 2023),
+            )
+        ]
+        self.index = CatalogIndex(self.content)
+
+    def assertMatchesScan(self):
+        for filters in self.QUERIES:
+            with self.subTest(**filters):
+                self.assertEqual(self.index.query(**filters), scan_catalog(self.content, **filters))
+
+    def test_query_matches_a_full_scan(self):
+        self.assertMatchesScan()
+
+    def test_writes_keep_the_indexes_in_step(self):
+        self.index.add({'id': 8, 'title': 'Shogun', 'type': 'Show', 'platforms': ['Hulu'], 'rating': 4.6, 'year': 2024})
+        self.index.update({'id': 1, 'type': 'Movie', 'platforms': ['Netflix'], 'rating': 2.0, 'year': 1985})
+        self.index.remove(4)
+        self.index.add_many([
+            {'id': 9, 'title': 'Nope', 'type': 'Movie', 'platforms': ['Netflix'], 'rating': 3.0, 'year': 2022},
+            {'id': 5, 'rating': 4.95},
+            {'id': 9, 'title': 'Nope', 'type': 'Movie', 'platforms': ['Netflix'], 'rating': 3.6, 'year': 2022},
+        ])
+        self.assertEqual([c['id'] for c in self.content], [1, 2, 3, 5, 6, 7, 8, 9])
+        self.assertEqual(self.index.get(9)['rating'], 3.6)
+        self.assertIsNone(self.index.get(4))
+        self.assertMatchesScan()
+
+    def test_top_rated_pages_in_rating_order(self):
+        expected = sorted(scan_catalog(self.content, year_start=0), key=lambda c: (c['rating'], c['id']), reverse=True)
+        first = self.index.top_rated(year_start=0, limit=4)
+        rest = self.index.top_rated(year_start=0, before=(first[-1]['rating'], first[-1]['id']), limit=4)
+        self.assertEqual(first + rest, expected)
+        self.assertEqual(self.index.top_rated(platform='Hulu', min_rating=4.7, year_start=0), [self.content[0], self.content[2]])
+
+class TrigramIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = TrigramIndex()
+        for doc_id, title, description in (
+            (1, 'Dune', 'A noble family on a desert planet'),
+            (2, 'Dune: Part Two', 'Paul joins the Fremen'),
+            (3, 'The Bear', 'A chef returns to run the family sandwich shop'),
+            (4, 'Breaking Bad', 'A chemistry teacher turns to crime'),
+            (5, 'Slow Horses', 'Spies, and a dune buggy chase'),
+        ):
+            self.index.add(doc_id, title, description)
+
+    def test_closest_title_ranks_first(self):
+        self.assertEqual(self.index.search('dune')[:2], [1, 2])
+
+    def test_title_matches_rank_above_description_matches(self):
+        results = self.index.search('dune')
+        self.assertLess(results.index(2), results.index(5))
+
+    def test_misspellings_match(self):
+        self.assertEqual(self.index.search('breking bad')[0], 4)
+        self.assertIn(1, self.index.search('duen'))
+
+    def test_prefix_while_typing(self):
+        self.assertEqual(self.index.search('brea')[0], 4)
+
+    def test_substrings_match(self):
+        self.assertIn(3, self.index.search('e', limit=None))
+        self.assertEqual(self.index.search('e bea'), [3])
+
+    def test_removed_titles_are_not_returned(self):
+        self.index.remove(1)
+        self.assertNotIn(1, self.index.search('dune'))
+
+    def test_short_queries_match_substrings(self):
+        # Too short for a trigram, so answered from the character pairs
+        self.assertIn(3, self.index.search('ea', limit=None))
+        self.assertIn(3, self.index.search('e b', limit=None))
+        self.assertEqual(self.index.search('zq'), [])
+        self.index.remove(3)
+        self.assertNotIn(3, self.index.search('ea', limit=None))
+
+class UserPrefixIndexTests(SimpleTestCase):
+    USERS = [
+        (1, 'johndoe', 'John Doe', 156),
+        (2, 'moviefanatic', 'Movie Fanatic', 230),
+        (3, 'jane', 'Jane Moviegoer', 80),
+        (4, 'jo', 'Jo March', 300),
+    ]
+
+    def setUp(self):
+        self.index = UserPrefixIndex(scan_limit=2)
+        self.index.build(self.USERS)
+
+    def test_prefixes_rank_by_followers(self):
+        self.assertEqual(self.index.search('jo'), [4, 1])
+        self.assertEqual(self.index.search('movie'), [2, 3])
+        self.assertEqual(self.index.search('march'), [4])
+        self.assertEqual(self.index.search('j', limit=2), [4, 1])
+
+    def test_incremental_adds_match_build(self):
+        index = UserPrefixIndex(scan_limit=2)
+        for user in self.USERS:
+            index.add(*user)
+        for query in ('j', 'jo', 'movie', 'fan', 'doe'):
+            self.assertEqual(index.search(query), self.index.search(query))
+
+    def test_renames_and_removals(self):
+        self.index.add(1, 'jdoe', 'Johnny Doe', 156)
+        self.assertEqual(self.index.search('johndoe'), [])
+        self.assertEqual(self.index.search('johnny'), [1])
+        self.index.remove(4)
+        self.assertEqual(self.index.search('jo'), [1])
+
+    def test_score_changes_reorder_broad_prefixes(self):
+        # 'j' matches more keys than scan_limit, so it is served from a top list
+        self.assertEqual(self.index.search('j'), [4, 1, 3])
+        self.index.adjust_score(3, 500)
+        self.index.set_score(4, 0)
+        self.assertEqual(self.index.search('j'), [3, 1, 4])
+
+    def test_results_are_capped(self):
+        index = UserPrefixIndex(max_limit=3)
+        index.build((user_id, f'user{user_id}', '', user_id) for user_id in range(100))
+        self.assertEqual(index.search('user', limit=10), [99, 98, 97])
+
+class ActivityFeedTests(SimpleTestCase):
+    # User 10 follows 1, 2 and 3; 3 starts out over the celebrity threshold
+    def setUp(self):
+        self.followers = {1: {10}, 2: {10}, 3: {10, 11}}
+        self.following = {10: {1, 2, 3}, 11: {3}}
+        self.feed = ActivityFeed(lambda actor: self.followers.get(actor, ()), lambda user: self.following.get(user, set()), celebrity_threshold=2)
+        for actor in (1, 3, 2, 3, 1):
+            self.feed.publish(actor, FEED_WATCHED, 100 + actor)
+
+    def read_ids(self, user, before=None, limit=20):
+        events, next_before = self.feed.read(user, before, limit)
+        return [event.id for event in events], next_before
+
+    def test_timeline_and_outboxes_merge_newest_first(self):
+        self.assertEqual(self.feed.celebrities, {3})
+        self.assertEqual(self.read_ids(10), ([5, 4, 3, 2, 1], None))
+        self.assertEqual(self.read_ids(11), ([4, 2], None))
+
+    def test_pages_follow_the_cursor(self):
+        self.assertEqual(self.read_ids(10, limit=2), ([5, 4], 4))
+        self.assertEqual(self.read_ids(10, before=4, limit=2), ([3, 2], 2))
+        self.assertEqual(self.read_ids(10, before=2, limit=2), ([1], None))
+
+    def test_unfollowed_accounts_are_skipped(self):
+        self.following[10].discard(3)
+        self.assertEqual(self.read_ids(10), ([5, 3, 1], None))
+
+    def test_outbox_stays_visible_below_the_threshold(self):
+        self.followers[3] = {10}
+        self.feed.publish(3, FEED_LISTED, 103)
+        self.assertEqual(self.read_ids(10), ([6, 5, 4, 3, 2, 1], None))
+
+    def test_dump_and_load_keep_events_and_ids(self):
+        restored = ActivityFeed(self.feed.followers_of, self.feed.following_of, celebrity_threshold=2)
+        restored.load(self.feed.dump())
+        self.assertEqual(restored.read(10), self.feed.read(10))
+        self.assertEqual(restored.publish(1, FEED_WATCHED, 101).id, 6)
+
+class SocialGraphTests(SimpleTestCase):
+    def setUp(self):
+        self.users = [{'id': user_id, 'followers_count': 0, 'following_count': 0} for user_id in range(1, 6)]
+        self.graph = SocialGraph(self.users, {})
+        for follower, followee in ((1, 2), (1, 3), (2, 1), (3, 4), (2, 4), (4, 1)):
+            self.graph.follow(follower, followee)
+
+    def counts(self, user_id):
+        user = self.graph.user(user_id)
+        return user['followers_count'], user['following_count']
+
+    def test_counters_follow_the_edges(self):
+        self.assertFalse(self.graph.follow(1, 2))
+        self.assertFalse(self.graph.follow(5, 5))
+        self.assertEqual(self.counts(1), (2, 2))
+        self.assertTrue(self.graph.unfollow(1, 2))
+        self.assertFalse(self.graph.unfollow(1, 2))
+        self.assertEqual(self.counts(1), (2, 1))
+        self.assertEqual(self.counts(2), (0, 2))
+        self.assertEqual(self.graph.followers_of(2), [])
+
+    def test_listings_page_by_id(self):
+        self.assertEqual(self.graph.followers_of(1), [2, 4])
+        self.assertEqual(self.graph.followers_of(4, after=2), [3])
+        self.assertEqual(self.graph.following_of(1, limit=1), [2])
+
+    def test_mutuals_and_followed_by_followees(self):
+        self.assertEqual(self.graph.mutuals(1), {2})
+        # 1 follows 2 and 3, both of whom follow 4
+        self.assertEqual(self.graph.followed_by_followees(1, 4), {2, 3})
+        self.assertEqual(self.graph.suggestions(1), [4])
+
+    def test_reverse_adjacency_is_rebuilt_on_load(self):
+        restored = SocialGraph(self.users, {follower: list(followees) for follower, followees in self.graph.following.items()})
+        self.assertEqual(dict(restored.followers), dict(self.graph.followers))
+
+class InsertionTests(SimpleTestCase):
+    def test_places_with_log2_comparisons(self):
+        ranking = list(range(100, 200))
+        for position in range(len(ranking) + 1):
+            session = InsertionSession(ranking)
+            comparisons = 0
+            while not session.done:
+                session.record(position <= ranking.index(session.pivot()))
+                comparisons += 1
+            self.assertEqual(session.lo, position)
+            self.assertLessEqual(comparisons, math.ceil(math.log2(len(ranking) + 1)))
+
+    def test_inserted_score_keeps_every_other_item_in_place(self):
+        scores = [90, 60, 60, 60, 10, 0, 0, -40]
+        for position in range(len(scores) + 1):
+            with self.subTest(position=position):
+                score, rescored = insertion_score(scores, position)
+                updated = [rescored.get(index, value) for index, value in enumerate(scores)]
+                self.assertEqual(updated, sorted(updated, reverse=True))
+                updated.insert(position, score)
+                neighbours = updated[max(position - 1, 0):position + 2]
+                self.assertEqual(len(set(neighbours)), len(neighbours))
+                self.assertEqual(neighbours, sorted(neighbours, reverse=True))
+
+class DiscoverPlanTests(TestCase):
+    def test_discover_queries_use_indexes(self):
+        # Raises CommandError if any discover query scans a table or sorts
+        call_command('check_discover_plan', stdout=StringIO())
+
+class FeedViewTests(TestCase):
+    def setUp(self):
+        self.viewer, self.friend, self.star, self.stranger = (
+            User.objects.create_user(username) for username in ('viewer', 'friend', 'star', 'stranger')
+        )
+        Follow.objects.create(follower=self.viewer, followee=self.friend)
+        Follow.objects.create(follower=self.viewer, followee=self.star)
+        self.content = Content.objects.create(title='Dune', image='https://example.com/dune.png', rating=4.5, year=2021, content_type='movie')
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def entry(self, user, actor, verb=FEED_WATCHED, outbox=False):
+        return FeedEntry.objects.create(user=user, actor=actor, verb=verb, content=self.content, outbox=outbox)
+
+    def test_fanned_out_entries_and_outboxes_merge_newest_first(self):
+        # star is below the celebrity threshold now, but its outbox entry
+        # was written while it was over it
+        first = self.entry(self.viewer, self.friend)
+        outbox = self.entry(self.star, self.star, outbox=True)
+        self.entry(self.stranger, self.stranger, outbox=True)
+        self.entry(self.friend, self.stranger)  # in friend's timeline, not an outbox
+        last = self.entry(self.viewer, self.friend, FEED_LISTED)
+        response = self.client.get(reverse('user-feed'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([entry['id'] for entry in response.data['results']], [last.id, outbox.id, first.id])
+
+    def test_pages_follow_the_cursor(self):
+        entries = [self.entry(self.viewer, self.friend) for _ in range(5)]
+        response = self.client.get(reverse('user-feed'), {'page_size': 3})
+        self.assertEqual([entry['id'] for entry in response.data['results']], [entry.id for entry in entries[:1:-1]])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([entry['id'] for entry in response.data['results']], [entries[1].id, entries[0].id])
+        self.assertIsNone(response.data['next'])
+
+    def test_pages_cover_timeline_and_outboxes_once(self):
+        entries = [self.entry(self.viewer, self.friend) if n % 3 else self.entry(self.star, self.star, outbox=True) for n in range(10)]
+        seen = []
+        url = reverse('user-feed') + '?page_size=3'
+        while url:
+            response = self.client.get(url)
+            seen += [entry['id'] for entry in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, [entry.id for entry in reversed(entries)])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(reverse('user-feed'), {'cursor': raw_cursor(['a'])})
+        self.assertEqual(response.status_code, 404)
+
+    def test_publish_trims_timelines(self):
+        # Trimmed back to the newest 3 once a timeline is 2 past it: the
+        # sixth event trims, the seventh makes four
+        oldest = self.entry(self.viewer, self.friend)
+        for _ in range(7):
+            publish_activity(self.friend.id, FEED_WATCHED, self.content.id, timeline_size=3, trim_slack=2)
+        kept = list(FeedEntry.objects.filter(user=self.viewer).order_by('-id').values_list('id', flat=True))
+        self.assertEqual(len(kept), 4)
+        self.assertEqual(kept[0], FeedEntry.objects.latest('id').id)
+        self.assertNotIn(oldest.id, kept)
+
+    def test_publish_trims_outboxes(self):
+        Profile.objects.filter(user=self.star).update(followers_count=CELEBRITY_THRESHOLD)
+        for _ in range(5):
+            publish_activity(self.star.id, FEED_WATCHED, self.content.id, timeline_size=3)
+        self.assertEqual(FeedEntry.objects.filter(user=self.viewer).count(), 0)
+        self.assertEqual(FeedEntry.objects.filter(outbox=True, actor=self.star).count(), 3)
+        response = self.client.get(reverse('user-feed'))
+        self.assertEqual(len(response.data['results']), 3)
+
+class FollowViewTests(TestCase):
+    def setUp(self):
+        self.viewer, self.friend, self.other = (User.objects.create_user(username) for username in ('viewer', 'friend', 'other'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.viewer)
+
+    def follow(self, user_id):
+        return self.client.post(reverse('user-follow'), {'user_id': user_id}, format='json')
+
+    def test_follow_updates_both_counts_once(self):
+        self.assertEqual(self.follow(self.friend.id).status_code, 200)
+        self.assertEqual(self.follow(self.friend.id).status_code, 200)
+        self.assertEqual(Profile.objects.get(user=self.friend).followers_count, 1)
+        self.assertEqual(Profile.objects.get(user=self.viewer).following_count, 1)
+        self.client.post(reverse('user-unfollow'), {'user_id': self.friend.id}, format='json')
+        self.assertEqual(Profile.objects.get(user=self.friend).followers_count, 0)
+
+    def test_missing_profiles_are_created_with_existing_edges(self):
+        Follow.objects.create(follower=self.other, followee=self.friend)
+        Profile.objects.filter(user=self.friend).delete()
+        self.follow(self.friend.id)
+        self.assertEqual(Profile.objects.get(user=self.friend).followers_count, 2)
+
+    def test_invalid_and_unknown_users_are_rejected(self):
+        self.assertEqual(self.follow('abc').status_code, 400)
+        self.assertEqual(self.follow(self.viewer.id).status_code, 400)
+        self.assertEqual(self.follow(10 ** 6).status_code, 404)
+        self.assertEqual(self.client.get(reverse('user-followers'), {'user_id': 'abc'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('user-followers'), {'user_id': 10 ** 6}).status_code, 404)
+        self.assertEqual(self.client.get(reverse('user-followed-by')).status_code, 400)
+
+    def test_followers_and_followed_by(self):
+        self.follow(self.friend.id)
+        Follow.objects.create(follower=self.friend, followee=self.other)
+        response = self.client.get(reverse('user-followers'), {'user_id': self.friend.id})
+        self.assertEqual([user['id'] for user in response.data['results']], [self.viewer.id])
+        response = self.client.get(reverse('user-followed-by'), {'user_id': self.other.id})
+        self.assertEqual([user['id'] for user in response.data['results']], [self.friend.id])
+
+class UserSearchViewTests(TestCase):
+    def setUp(self):
+        cache.clear()  # the next search reloads the index from this test's users
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice = User.objects.create_user('alice', first_name='Alice', last_name='Liddell')
+            self.alan = User.objects.create_user('alan', first_name='Alan', last_name='Turing')
+        self.client.force_authenticate(self.alice)
+
+    def search(self, query):
+        response = self.client.get(reverse('users-search'), {'query': query})
+        return [user['id'] for user in response.data]
+
+    def test_new_users_and_renames_are_found(self):
+        self.assertEqual(set(self.search('al')), {self.alice.id, self.alan.id})
+        # Published changes reach the index, not a post_save on this process
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.username = 'dodo'
+            self.alice.first_name = 'Dodo'
+            self.alice.save()
+            carol = User.objects.create_user('carol', first_name='Carol')
+        self.assertEqual(self.search('dodo'), [self.alice.id])
+        self.assertEqual(self.search('alan'), [self.alan.id])
+        self.assertEqual(self.search('car'), [carol.id])
+        self.assertNotIn(self.alice.id, self.search('alice'))
+
+    def test_followers_rank_results(self):
+        self.assertEqual(self.search('al'), [self.alice.id, self.alan.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('user-follow'), {'user_id': self.alan.id}, format='json')
+        self.assertEqual(self.search('al'), [self.alan.id, self.alice.id])
+
+class InsertionViewTests(TestCase):
+    # Eight titles already ranked, some of them tied, and a new one to place
+    SCORES = (90, 60, 60, 60, 10, 0, 0, -40)
+
+    def setUp(self):
+        self.user = User.objects.create_user('ranker')
+        titles = [
+            Content.objects.create(title=f'Title {n}', image='https://example.com/title.png', rating=4, year=2020, content_type='movie')
+            for n in range(len(self.SCORES) + 1)
+        ]
+        self.new = titles.pop()
+        for title, score in zip(titles, self.SCORES):
+            WatchedContent.objects.create(user=self.user, content=title, ranking_score=score)
+        WatchedContent.objects.create(user=self.user, content=self.new)
+        self.existing = [title.id for title in titles]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def ranking(self):
+        return list(WatchedContent.objects.filter(user=self.user).order_by('-ranking_score', 'id').values_list('content_id', flat=True))
+
+    def place(self, position):
+        # Answers every pivot as if the new title belongs at `position`
+        comparisons = 0
+        while True:
+            response = self.client.get(reverse('user-comparisons', args=[self.new.id]))
+            if not response.data:
+                return comparisons
+            pivot = response.data[0]['id']
+            preferred = 'new' if position <= self.existing.index(pivot) else 'existing'
+            response = self.client.post(
+                reverse('user-submit-comparison'),
+                {'new_content_id': self.new.id, 'existing_content_id': pivot, 'preferred': preferred}, format='json',
+            )
+            self.assertEqual(response.status_code, 200)
+            comparisons += 1
+
+    def test_placement_keeps_the_existing_order(self):
+        for position in range(len(self.existing) + 1):
+            with self.subTest(position=position):
+                cache.clear()
+                WatchedContent.objects.filter(user=self.user).delete()
+                for content_id, score in zip(self.existing, self.SCORES):
+                    WatchedContent.objects.create(user=self.user, content_id=content_id, ranking_score=score)
+                WatchedContent.objects.create(user=self.user, content=self.new)
+                comparisons = self.place(position)
+                self.assertLessEqual(comparisons, math.ceil(math.log2(len(self.existing) + 1)))
+                self.assertEqual(self.ranking(), self.existing[:position] + [self.new.id] + self.existing[position:])
+
+    def test_queue_stays_empty_after_placement(self):
+        self.place(3)
+        cache.clear()  # the placed marker is on the row, not in the cache
+        response = self.client.get(reverse('user-comparisons', args=[self.new.id]))
+        self.assertEqual(response.data, [])
+
+# search.py
+import bisect
+import heapq
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from itertools import chain, islice
+
+NON_ALNUM = re.compile(r'[^0-9a-z]+')
+EMPTY_POSTING = frozenset()
+
+def normalize_text(text):
+    text = text or ''
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return ' '.join(NON_ALNUM.sub(' ', text.lower()).split())
+
+def bigrams(normalized):
+    # Character pairs of the whole text, spaces included and padded at both
+    # ends, so every character is in at least one pair
+    padded = f' {normalized} '
+    return {padded[j:j + 2] for j in range(len(padded) - 1)}
+
+def trigrams(normalized, partial_last=False):
+    # Words are padded ("  dune ") so prefixes and short words get trigrams
+    # too. With partial_last the final word is treated as a prefix, which is
+    # what a search box sends while the user is still typing.
+    words = normalized.split()
+    grams = set()
+    for i, word in enumerate(words):
+        padded = '  ' + word
+        if not (partial_last and i == len(words) - 1):
+            padded += ' '
+        grams.update(padded[j:j + 3] for j in range(len(padded) - 2))
+    return grams
+
+class TrigramIndex:
+    # Inverted trigram index over content titles and descriptions. Results are
+    # ranked by trigram coverage of the query (title weighted above
+    # description), so misspellings still match, and titles containing the
+    # query verbatim rank first. Query trigrams are visited rarest first and
+    # at most `max_candidates` trigram candidates (plus as many verbatim
+    # matches) are scored, which keeps lookups flat as the catalog grows.
+    def __init__(self, max_candidates=5000, min_similarity=0.4):
+        self.max_candidates = max_candidates
+        self.min_similarity = min_similarity
+        self._titles = {}
+        self._descriptions = {}
+        self._title_sizes = {}
+        self._title_postings = defaultdict(set)
+        self._title_bigrams = defaultdict(set)  # for substring queries too short for trigrams
+        self._desc_postings = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._titles)
+
+    def add(self, doc_id, title, description=''):
+        with self._lock:
+            self._remove(doc_id)
+            title = normalize_text(title)
+            description = normalize_text(description)
+            title_grams = trigrams(title)
+            self._titles[doc_id] = title
+            self._descriptions[doc_id] = description
+            self._title_sizes[doc_id] = len(title_grams)
+            for gram in title_grams:
+                self._title_postings[gram].add(doc_id)
+            for gram in bigrams(title):
+                self._title_bigrams[gram].add(doc_id)
+            for gram in trigrams(description):
+                self._desc_postings[gram].add(doc_id)
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def clear(self):
+        with self._lock:
+            for mapping in (self._titles, self._descriptions, self._title_sizes, self._title_postings, self._title_bigrams, self._desc_postings):
+                mapping.clear()
+
+    def _remove(self, doc_id):
+        if doc_id not in self._titles:
+            return
+        title = self._titles.pop(doc_id)
+        description = self._descriptions.pop(doc_id)
+        for postings, grams in ((self._title_postings, trigrams(title)), (self._title_bigrams, bigrams(title)), (self._desc_postings, trigrams(description))):
+            for gram in grams:
+                postings[gram].discard(doc_id)
+                if not postings[gram]:
+                    del postings[gram]
+        del self._title_sizes[doc_id]
+
+    def search(self, query, limit=50):
+        query = normalize_text(query)
+        grams = trigrams(query, partial_last=True)
+        if not grams:
+            return []
+        with self._lock:
+            title_hits = Counter()
+            desc_hits = Counter()
+            seen = set()
+            ordered = sorted(grams, key=lambda g: len(self._title_postings.get(g, ())) + len(self._desc_postings.get(g, ())))
+            for gram in ordered:
+                for postings, hits in ((self._title_postings, title_hits), (self._desc_postings, desc_hits)):
+                    posting = postings.get(gram, ())
+                    room = self.max_candidates - len(seen)
+                    if len(posting) > room and len(posting) > len(seen):
+                        # Too common to walk in full: probe the existing
+                        # candidates and admit only enough new ones to fill up
+                        hits.update(doc_id for doc_id in seen if doc_id in posting)
+                        admitted = list(islice((doc_id for doc_id in posting if doc_id not in seen), room))
+                        seen.update(admitted)
+                        hits.update(admitted)
+                        continue
+                    for doc_id in posting:
+                        seen.add(doc_id)
+                        hits[doc_id] += 1
+
+            substring = self._substring_matches(query)
+            scored = []
+            for doc_id in seen | substring:
+                matched = title_hits[doc_id]
+                title_coverage = matched / len(grams)
+                desc_coverage = desc_hits[doc_id] / len(grams)
+                if max(title_coverage, desc_coverage) < self.min_similarity and doc_id not in substring:
+                    continue
+                # Jaccard term prefers titles that are close to the query overall
+                jaccard = matched / (len(grams) + self._title_sizes[doc_id] - matched)
+                score = 0.7 * title_coverage + 0.3 * jaccard + 0.4 * desc_coverage
+                if query in self._titles[doc_id]:
+                    score += 1
+                scored.append((-score, doc_id))
+        scored.sort()
+        return [doc_id for _, doc_id in scored[:limit]]
+
+    def _substring_matches(self, query):
+        # Titles containing the query verbatim, which a plain substring filter
+        # would find however few trigrams they share with it ("e" in "the
+        # bear"). Such a title has every inner trigram of each query word, or
+        # for queries of words under three letters every character pair of
+        # the query, so only titles in all of those postings are checked. A
+        # single character is looked up in the pairs that contain it. Stops
+        # at max_candidates matches, so short typeahead queries do bounded
+        # work. Callers hold the lock.
+        grams = {word[j:j + 3] for word in query.split() for j in range(len(word) - 2)}
+        if grams:
+            postings = [self._title_postings.get(gram, EMPTY_POSTING) for gram in grams]
+        elif len(query) > 1:
+            postings = [self._title_bigrams.get(query[j:j + 2], EMPTY_POSTING) for j in range(len(query) - 1)]
+        else:
+            postings = None
+        if postings is None:
+            candidates = chain.from_iterable(posting for gram, posting in self._title_bigrams.items() if query in gram)
+        else:
+            postings.sort(key=len)
+            candidates = postings[0].intersection(*postings[1:]) if len(postings) > 1 else postings[0]
+        matches = set()
+        for doc_id in candidates:
+            if query in self._titles[doc_id]:
+                matches.add(doc_id)
+                if len(matches) >= self.max_candidates:
+                    break
+        return matches
+
+class UserPrefixIndex:
+    # Typeahead over usernames and display names, ranked by followers_count.
+    # Every user contributes a few normalized keys (username, full display
+    # name and each of its words) to one sorted array, so a query prefix is a
+    # bisect range. Ranges of up to `scan_limit` keys are ranked on the fly;
+    # broader prefixes (the first letter or two) get a top list that is built
+    # once and then maintained as scores change, so every query does bounded
+    # work. Results are capped at `max_limit`.
+    def __init__(self, limit=10, max_limit=50, scan_limit=2000):
+        self.limit = limit
+        self.max_limit = max_limit
+        self.scan_limit = scan_limit
+        self._keys = []  # sorted (key, user_id)
+        self._user_keys = {}
+        self._scores = {}
+        self._top = {}  # broad prefix -> sorted [(-score, user_id)], at most max_limit long
+        self._lock = threading.Lock()
+        self.ready = True  # cleared by owners that rebuild the index in the background
+
+    @staticmethod
+    def keys_for(username, display_name=''):
+        keys = set()
+        for name in (normalize_text(username), normalize_text(display_name)):
+            if name:
+                keys.add(name)
+                keys.update(name.split())
+        return keys
+
+    def build(self, entries):
+        # Replaces the index with (user_id, username, display_name, score)
+        # entries, sorting the keys once instead of inserting one at a time
+        keys = []
+        user_keys = {}
+        scores = {}
+        for user_id, username, display_name, score in entries:
+            user_keys[user_id] = self.keys_for(username, display_name)
+            scores[user_id] = score
+            keys.extend((key, user_id) for key in user_keys[user_id])
+        keys.sort()
+        with self._lock:
+            self._keys, self._user_keys, self._scores, self._top = keys, user_keys, scores, {}
+
+    def score(self, user_id):
+        return self._scores.get(user_id)
+
+    def add(self, user_id, username, display_name='', score=0):
+        # Also used for renames: the user's old keys are replaced
+        with self._lock:
+            self._remove(user_id)
+            keys = self.keys_for(username, display_name)
+            self._user_keys[user_id] = keys
+            self._scores[user_id] = score
+            for key in keys:
+                bisect.insort(self._keys, (key, user_id))
+            self._update_top(user_id, keys, decreased=False)
+
+    def remove(self, user_id):
+        with self._lock:
+            self._remove(user_id)
+
+    def _remove(self, user_id):
+        keys = self._user_keys.pop(user_id, None)
+        if keys is None:
+            return
+        for key in keys:
+            i = bisect.bisect_left(self._keys, (key, user_id))
+            if i < len(self._keys) and self._keys[i] == (key, user_id):
+                del self._keys[i]
+        self._update_top(user_id, keys, decreased=True, removed=True)
+        del self._scores[user_id]
+
+    def set_score(self, user_id, score):
+        with self._lock:
+            if user_id not in self._scores:
+                return
+            decreased = score < self._scores[user_id]
+            self._scores[user_id] = score
+            self._update_top(user_id, self._user_keys[user_id], decreased)
+
+    def adjust_score(self, user_id, delta):
+        with self._lock:
+            if user_id not in self._scores:
+                return
+            self._scores[user_id] += delta
+            self._update_top(user_id, self._user_keys[user_id], delta < 0)
+
+    def _update_top(self, user_id, keys, decreased, removed=False):
+        prefixes = {key[:n] for key in keys for n in range(1, len(key) + 1)}
+        for prefix in prefixes & self._top.keys():
+            top = self._top[prefix]
+            was_member = any(member == user_id for _, member in top)
+            if was_member:
+                top[:] = [entry for entry in top if entry[1] != user_id]
+            if (removed or decreased) and was_member and len(top) + 1 >= self.max_limit:
+                # Someone outside the stored list may now rank higher; rebuild on next query
+                del self._top[prefix]
+                continue
+            if removed:
+                continue
+            bisect.insort(top, (-self._scores[user_id], user_id))
+            del top[self.max_limit:]
+
+    def search(self, query, limit=None):
+        prefix = normalize_text(query)
+        if not prefix:
+            return []
+        limit = min(limit or self.limit, self.max_limit)
+        with self._lock:
+            lo = bisect.bisect_left(self._keys, (prefix,))
+            hi = bisect.bisect_left(self._keys, (prefix + '\uffff',))
+            if hi - lo <= self.scan_limit:
+                user_ids = {user_id for _, user_id in self._keys[lo:hi]}
+                return heapq.nsmallest(limit, user_ids, key=lambda user_id: (-self._scores[user_id], user_id))
+            top = self._top.get(prefix)
+            if top is None:
+                user_ids = {user_id for _, user_id in self._keys[lo:hi]}
+                top = self._top[prefix] = sorted((-self._scores[user_id], user_id) for user_id in user_ids)[:self.max_limit]
+            return [user_id for _, user_id in top[:limit]]
+
+# pagination.py
+import base64
+import json
+import math
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, size=None):
+    # Raises ValueError for anything that isn't a cursor we issued: every key
+    # we page on is numeric, so a cursor is a non-empty list of finite
+    # numbers, `size` of them when given
+    values = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    if not isinstance(values, list) or not values or (size is not None and len(values) != size):
+        raise ValueError('Invalid cursor')
+    for value in values:
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError('Invalid cursor')
+    return tuple(values)
+
+def keyset_page(items, key, cursor=None, page_size=50, reverse=False):
+    # `items` is already sorted by `key` (descending when reverse). Returns the
+    # page that starts after `cursor` and the cursor for the page after it.
+    start = 0
+    if cursor is not None:
+        # Binary search for the first item past the cursor
+        end = len(items)
+        while start < end:
+            middle = (start + end) // 2
+            value = key(items[middle])
+            if value < cursor if reverse else value > cursor:
+                end = middle
+            else:
+                start = middle + 1
+    page = items[start:start + page_size]
+    next_cursor = encode_cursor(key(page[-1])) if page and start + page_size < len(items) else None
+    return page, next_cursor
+
+def iter_json_array(encoded_items, chunk_size=64 * 1024):
+    # Joins already-encoded JSON values into one array without holding the
+    # whole body in memory. The first item is flushed right away so time to
+    # first byte doesn't depend on the result size.
+    buffer = bytearray(b'[')
+    count = 0
+    for item in encoded_items:
+        if count:
+            buffer += b','
+        buffer += item
+        count += 1
+        if count == 1 or len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b']'
+    yield bytes(buffer)
+
+# ranking.py
+import math
+
+ELO_K = 32
+# Warm-start scores are clamped to this, so 10 ** (score / 400) stays finite
+ELO_SCORE_BOUND = 4000
+
+def elo_expected(score_a, score_b):
+    return 1 / (1 + 10 ** ((score_b - score_a) / 400))
+
+def elo_update(scores, winner, loser, k=ELO_K):
+    # Applies one judgment to `scores` in place
+    delta = k * (1 - elo_expected(scores[winner], scores[loser]))
+    scores[winner] += delta
+    scores[loser] -= delta
+
+def bradley_terry(judgments, iterations=500, tolerance=1e-4, initial=None):
+    # Fits Bradley-Terry strengths to (winner, loser) judgments using Newman's
+    # fixed-point iteration, which converges far faster than the classic MM
+    # update. Repeated pairs are collapsed first, so each sweep costs
+    # O(distinct pairs). Every item also gets one virtual win and one virtual
+    # loss against a reference of strength 1, which keeps unbeaten and winless
+    # items finite. Scores are on the Elo scale (400 * log10 strength, 0 for
+    # the reference) so they can keep being updated with elo_update.
+    # `initial` ({item: score} on the same scale, e.g. the previous fit)
+    # warm-starts the iteration, so a refit after a few new judgments needs
+    # only a few sweeps.
+    index = {}
+    pair_wins = {}  # (i, j) with i < j -> [wins of i over j, wins of j over i]
+    for winner, loser in judgments:
+        for item in (winner, loser):
+            if item not in index:
+                index[item] = len(index)
+        w, l = index[winner], index[loser]
+        if w < l:
+            pair_wins.setdefault((w, l), [0, 0])[0] += 1
+        else:
+            pair_wins.setdefault((l, w), [0, 0])[1] += 1
+    if not index:
+        return {}
+
+    first = [i for i, _ in pair_wins]
+    second = [j for _, j in pair_wins]
+    first_wins = [wins[0] for wins in pair_wins.values()]
+    second_wins = [wins[1] for wins in pair_wins.values()]
+    initial = initial or {}
+    strength = [10 ** (min(max(initial.get(item, 0), -ELO_SCORE_BOUND), ELO_SCORE_BOUND) / 400) for item in index]
+    for _ in range(iterations):
+        numerators = [1 / (s + 1) for s in strength]
+        denominators = list(numerators)
+        for i, j, wins_i, wins_j in zip(first, second, first_wins, second_wins):
+            inverse = 1 / (strength[i] + strength[j])
+            numerators[i] += wins_i * strength[j] * inverse
+            denominators[i] += wins_j * inverse
+            numerators[j] += wins_j * strength[i] * inverse
+            denominators[j] += wins_i * inverse
+        updated = [num / den for num, den in zip(numerators, denominators)]
+        change = max(abs(new - old) / old for new, old in zip(updated, strength))
+        strength = updated
+        if change < tolerance:
+            break
+    return {item: 400 * math.log10(strength[i]) for item, i in index.items()}
+
+def insertion_score(scores, position, k=ELO_K):
+    # Score for an item inserted at `position` into `scores`, a best-first
+    # (non-increasing) list, strictly between its neighbours so every other
+    # item keeps its place. Where the neighbours tie, the whole tied run is
+    # spread evenly over the gap around it. Returns (score, {index: new
+    # score}) for the items that have to move.
+    above = scores[position - 1] if position > 0 else None
+    below = scores[position] if position < len(scores) else None
+    if above is None:
+        return (0.0 if below is None else below + k), {}
+    if below is None:
+        return above - k, {}
+    if above > below:
+        return (above + below) / 2, {}
+    start, end = position - 1, position
+    while start > 0 and scores[start - 1] == above:
+        start -= 1
+    while end + 1 < len(scores) and scores[end + 1] == below:
+        end += 1
+    count = end - start + 2  # the tied run and the new item
+    top = scores[start - 1] if start > 0 else above + k * count
+    bottom = scores[end + 1] if end + 1 < len(scores) else below - k * count
+    step = (top - bottom) / (count + 1)
+    spread = [top - step * (n + 1) for n in range(count)]
+    rescored = {index: spread[index - start + (index >= position)] for index in range(start, end + 1)}
+    return spread[position - start], rescored
+
+class InsertionSession:
+    # Places a new item into an existing ranking (best first) by binary
+    # insertion: each judgment against the middle of the remaining range
+    # halves it, so an item lands after about log2(n) comparisons.
+    def __init__(self, ranking, lo=0, hi=None):
+        self.ranking = list(ranking)
+        self.lo = lo
+        self.hi = len(self.ranking) if hi is None else hi
+
+    @property
+    def done(self):
+        return self.lo >= self.hi
+
+    def pivot(self):
+        return None if self.done else self.ranking[(self.lo + self.hi) // 2]
+
+    def record(self, new_preferred):
+        mid = (self.lo + self.hi) // 2
+        if new_preferred:
+            self.hi = mid
+        else:
+            self.lo = mid + 1
+
+    def neighbours(self):
+        # Items directly above and below the insertion point (None at the ends)
+        above = self.ranking[self.lo - 1] if self.lo > 0 else None
+        below = self.ranking[self.lo] if self.lo < len(self.ranking) else None
+        return above, below
+
+    def to_dict(self):
+        return {'ranking': self.ranking, 'lo': self.lo, 'hi': self.hi}
+
+    @classmethod
+    def from_dict(cls, state):
+        return cls(state['ranking'], state['lo'], state['hi'])
+
+# recommender.py
+import heapq
+import math
+import random
+import sys
+import time
+from array import array
+from collections import defaultdict
+from itertools import accumulate
+from operator import itemgetter
+
+# Interaction weights for a user's row of the user x content matrix
+WATCHED_WEIGHT = 1.0
+LISTED_WEIGHT = 0.5
+PREFERRED_WEIGHT = 0.5
+
+def similar_key(content_id):
+    return f'recommender:similar:{content_id}'
+
+def recommendations_key(user_id):
+    return f'recommender:user:{user_id}'
+
+def item_neighbours(profiles, k=50, max_profile=200):
+    # Top-k cosine neighbours for every item of the sparse user x item matrix
+    # given as {user: {item: weight}}. X^T X is computed one item row at a
+    # time from an inverted index, so only a single row of co-occurrence sums
+    # is ever held in memory. Very long profiles are capped at their
+    # `max_profile` heaviest items, which bounds the quadratic per-user cost.
+    user_items = []
+    user_weights = []
+    item_users = defaultdict(lambda: array('l'))
+    item_user_weights = defaultdict(lambda: array('d'))
+    norms = defaultdict(float)
+    for profile in profiles.values():
+        if len(profile) > max_profile:
+            profile = dict(heapq.nlargest(max_profile, profile.items(), key=itemgetter(1)))
+        row = len(user_items)
+        user_items.append(array('l', profile.keys()))
+        user_weights.append(array('d', profile.values()))
+        for item, weight in profile.items():
+            item_users[item].append(row)
+            item_user_weights[item].append(weight)
+            norms[item] += weight * weight
+    norms = {item: math.sqrt(total) for item, total in norms.items()}
+
+    neighbours = {}
+    for item, rows in item_users.items():
+        dots = defaultdict(float)
+        for row, weight in zip(rows, item_user_weights[item]):
+            for other, other_weight in zip(user_items[row], user_weights[row]):
+                dots[other] += weight * other_weight
+        del dots[item]
+        norm = norms[item]
+        neighbours[item] = heapq.nlargest(
+            k, ((other, dot / (norm * norms[other])) for other, dot in dots.items()), key=itemgetter(1)
+        )
+    return neighbours
+
+def user_candidates(profile, neighbours, size=200):
+    # Scores unseen items by similarity-weighted sums over the user's profile
+    scores = defaultdict(float)
+    for item, weight in profile.items():
+        for other, similarity in neighbours.get(item, ()):
+            scores[other] += weight * similarity
+    for item in profile:
+        scores.pop(item, None)
+    return heapq.nlargest(size, scores.items(), key=itemgetter(1))
+
+def merge_candidates(candidates, item, weight, item_neighbours, exclude=(), size=200):
+    # Incremental form of user_candidates for one new interaction: only the
+    # new item's neighbours are added to the stored list. Scores that were
+    # truncated away earlier are not recovered until the next full build.
+    scores = dict(candidates)
+    for other, similarity in item_neighbours:
+        scores[other] = scores.get(other, 0) + weight * similarity
+    scores.pop(item, None)
+    for seen in exclude:
+        scores.pop(seen, None)
+    return heapq.nlargest(size, scores.items(), key=itemgetter(1))
+
+class ItemItemRecommender:
+    # In-memory holder for the mock server: neighbours come from build(),
+    # per-user candidate lists are computed on first use and then
+    # maintained by record()
+    def __init__(self, k=50, size=200):
+        self.k = k
+        self.size = size
+        self.profiles = {}
+        self.neighbours = {}
+        self.candidates = {}
+        self.listeners = []  # called after every candidate list change
+
+    def build(self, profiles):
+        self.profiles = {user: dict(profile) for user, profile in profiles.items()}
+        self.set_neighbours(item_neighbours(self.profiles, self.k))
+
+    def set_neighbours(self, neighbours):
+        self.neighbours = neighbours
+        self.candidates = {}
+        self._changed()
+
+    def record(self, user, item, weight=WATCHED_WEIGHT):
+        profile = self.profiles.setdefault(user, {})
+        profile[item] = profile.get(item, 0) + weight
+        if user in self.candidates:
+            self.candidates[user] = merge_candidates(
+                self.candidates[user], item, weight, self.neighbours.get(item, ()), profile, self.size
+            )
+        self._changed()
+
+    def recommend(self, user, exclude=()):
+        candidates = self.candidates.get(user)
+        if candidates is None:
+            candidates = self.candidates[user] = user_candidates(self.profiles.get(user, {}), self.neighbours, self.size)
+        return [item for item, _ in candidates if item not in exclude]
+
+    def _changed(self):
+        for listener in self.listeners:
+            listener()
+
+def peak_memory_mb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def benchmark_recommender(users=1_000_000, items=50_000, per_user=10, k=50, size=200, sample=10_000, seed=0):
+    # Synthetic watch histories with Zipf-like title popularity. Reports the
+    # offline neighbour build over all users; candidate lists are built for a
+    # sample of users and extrapolated, since at this scale they live in the
+    # shared cache rather than in one process.
+    rng = random.Random(seed)
+    cum_weights = list(accumulate(1 / (rank + 1) ** 0.8 for rank in range(items)))
+    start = time.perf_counter()
+    profiles = {
+        user: dict.fromkeys(rng.choices(range(items), cum_weights=cum_weights, k=per_user), WATCHED_WEIGHT)
+        for user in range(users)
+    }
+    generate_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    neighbours = item_neighbours(profiles, k)
+    neighbours_seconds = time.perf_counter() - start
+
+    sample_users = rng.sample(range(users), min(sample, users))
+    start = time.perf_counter()
+    for user in sample_users:
+        user_candidates(profiles[user], neighbours, size)
+    candidate_seconds = (time.perf_counter() - start) / len(sample_users)
+
+    candidates = user_candidates(profiles[sample_users[0]], neighbours, size)
+    start = time.perf_counter()
+    for _ in range(1000):
+        merge_candidates(candidates, 0, WATCHED_WEIGHT, neighbours.get(0, ()), profiles[sample_users[0]], size)
+    merge_seconds = (time.perf_counter() - start) / 1000
+
+    return {
+        "users": users,
+        "items": items,
+        "interactions": sum(len(profile) for profile in profiles.values()),
+        "generate_s": round(generate_seconds, 2),
+        "neighbour_build_s": round(neighbours_seconds, 2),
+        "candidates_per_user_ms": round(candidate_seconds * 1000, 3),
+        "candidates_all_users_s": round(candidate_seconds * users, 2),
+        "incremental_update_ms": round(merge_seconds * 1000, 3),
+        "peak_rss_mb": round(peak_memory_mb(), 1),
+    }
+
+# graph.py
+import heapq
+from collections import defaultdict
+
+class SocialGraph:
+    # Follow graph with forward and reverse adjacency sets plus an id -> user
+    # index. `relationships` ({follower: followees}) is converted to sets in
+    # place and stays the forward adjacency, so there is a single source of
+    # truth for who follows whom. followers_count/following_count on the user
+    # records are only changed together with an edge.
+    def __init__(self, users, relationships):
+        self.listeners = []  # called with the user record after its counters change
+        self.load(users, relationships)
+
+    def load(self, users, relationships, followers=None):
+        # `followers` may be passed in when it was saved with the graph
+        self.users = {u["id"]: u for u in users}
+        self.following = relationships
+        for follower, followees in list(relationships.items()):
+            if not isinstance(followees, set):
+                relationships[follower] = set(followees)
+        if followers is not None:
+            self.followers = defaultdict(set, followers)
+            return
+        self.followers = defaultdict(set)
+        for follower, followees in relationships.items():
+            for followee in followees:
+                self.followers[followee].add(follower)
+
+    def user(self, user_id):
+        return self.users.get(user_id)
+
+    def add_user(self, user):
+        self.users[user["id"]] = user
+
+    def is_following(self, follower, followee):
+        return followee in self.following.get(follower, ())
+
+    def follow(self, follower, followee):
+        if follower == followee or self.is_following(follower, followee):
+            return False
+        self.following.setdefault(follower, set()).add(followee)
+        self.followers[followee].add(follower)
+        self._bump(followee, "followers_count", 1)
+        self._bump(follower, "following_count", 1)
+        return True
+
+    def unfollow(self, follower, followee):
+        if not self.is_following(follower, followee):
+            return False
+        self.following[follower].discard(followee)
+        self.followers[followee].discard(follower)
+        self._bump(followee, "followers_count", -1)
+        self._bump(follower, "following_count", -1)
+        return True
+
+    def _bump(self, user_id, field, delta):
+        user = self.users.get(user_id)
+        if user is not None:
+            user[field] += delta
+            for listener in self.listeners:
+                listener(user)
+
+    def page(self, ids, after=None, limit=None):
+        # Ids in ascending order after the cursor id, without sorting the whole set
+        if after is not None:
+            ids = (user_id for user_id in ids if user_id > after)
+        return sorted(ids) if limit is None else heapq.nsmallest(limit, ids)
+
+    def followers_of(self, user_id, after=None, limit=None):
+        return self.page(self.followers.get(user_id, ()), after, limit)
+
+    def following_of(self, user_id, after=None, limit=None):
+        return self.page(self.following.get(user_id, ()), after, limit)
+
+    def mutuals(self, user_id):
+        return self.following.get(user_id, set()) & self.followers.get(user_id, set())
+
+    def followed_by_followees(self, viewer_id, user_id):
+        # People the viewer follows who also follow user_id
+        return self.followers.get(user_id, set()) & self.following.get(viewer_id, set())
+
+    def suggestions(self, user_id, limit=10):
+        # Accounts followed by the most of the people user_id follows
+        following = self.following.get(user_id, set())
+        counts = defaultdict(int)
+        for followee in following:
+            for candidate in self.following.get(followee, ()):
+                if candidate != user_id and candidate not in following:
+                    counts[candidate] += 1
+        return heapq.nsmallest(limit, counts, key=lambda candidate: (-counts[candidate], candidate))
+
+# feed.py
+import heapq
+import random
+import statistics
+import threading
+import time
+from collections import deque, namedtuple
+from itertools import islice
+from operator import attrgetter
+
+FEED_WATCHED = 'watched'
+FEED_LISTED = 'listed'
+# Accounts with at least this many followers are read by pull instead of fan-out
+CELEBRITY_THRESHOLD = 5000
+# Events kept per timeline and per outbox
+FEED_TIMELINE_SIZE = 500
+
+FeedEvent = namedtuple('FeedEvent', ['id', 'actor', 'verb', 'content_id', 'created_at'])
+
+def latency_percentiles(samples):
+    # p50/p95/p99 in ms of a list of durations in seconds
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return {"p50_ms": round(cuts[49] * 1000, 3), "p95_ms": round(cuts[94] * 1000, 3), "p99_ms": round(cuts[98] * 1000, 3)}
+
+class ActivityFeed:
+    # "What people you follow watched", fanned out on write. Each event gets
+    # an increasing id and is appended to a bounded timeline (a deque ring
+    # buffer) for every follower of its actor, so a read walks one short
+    # list. Events of accounts with `celebrity_threshold` or more followers
+    # are written once to the actor's outbox instead and merged in by their
+    # followers at read time (hybrid pull). Every event lives in exactly one
+    # place, so switching modes never duplicates it. Event ids are the
+    # pagination cursor.
+    def __init__(self, followers_of, following_of, timeline_size=FEED_TIMELINE_SIZE, celebrity_threshold=CELEBRITY_THRESHOLD):
+        self.followers_of = followers_of  # user -> collection of follower ids
+        self.following_of = following_of  # user -> set of followee ids
+        self.timeline_size = timeline_size
+        self.celebrity_threshold = celebrity_threshold
+        self.celebrities = set()
+        self._timelines = {}
+        self._outboxes = {}
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def _buffer(self, buffers, user):
+        buffer = buffers.get(user)
+        if buffer is None:
+            buffer = buffers[user] = deque(maxlen=self.timeline_size)
+        return buffer
+
+    def publish(self, actor, verb, content_id, created_at=None):
+        with self._lock:
+            self._last_id += 1
+            event = FeedEvent(self._last_id, actor, verb, content_id, time.time() if created_at is None else created_at)
+            followers = self.followers_of(actor)
+            if len(followers) >= self.celebrity_threshold:
+                self.celebrities.add(actor)
+                self._buffer(self._outboxes, actor).append(event)
+            else:
+                for follower in followers:
+                    self._buffer(self._timelines, follower).append(event)
+            return event
+
+    def dump(self):
+        # Timelines, outboxes and the id counter as plain tuples and lists,
+        # e.g. for a snapshot; load() restores them, so cursors stay valid
+        with self._lock:
+            return {
+                "last_id": self._last_id,
+                "celebrities": list(self.celebrities),
+                "timelines": {user: [tuple(event) for event in events] for user, events in self._timelines.items()},
+                "outboxes": {actor: [tuple(event) for event in events] for actor, events in self._outboxes.items()},
+            }
+
+    def load(self, state):
+        with self._lock:
+            self._last_id = state["last_id"]
+            self.celebrities = set(state["celebrities"])
+            self._timelines, self._outboxes = (
+                {owner: deque(map(FeedEvent._make, events), maxlen=self.timeline_size) for owner, events in buffers.items()}
+                for buffers in (state["timelines"], state["outboxes"])
+            )
+
+    @staticmethod
+    def _newest_first(events, before):
+        for event in reversed(events):
+            if before is None or event.id < before:
+                yield event
+
+    def read(self, user, before=None, limit=20):
+        # Returns (events newest first, cursor for the next page or None).
+        # Events from accounts the user has since unfollowed are skipped.
+        with self._lock:
+            following = self.following_of(user)
+            sources = [self._timelines.get(user, ())]
+            sources += [self._outboxes[actor] for actor in self.celebrities.intersection(following)]
+            merged = heapq.merge(*(self._newest_first(events, before) for events in sources), key=attrgetter('id'), reverse=True)
+            events = list(islice((event for event in merged if event.actor in following), limit + 1))
+        if len(events) > limit:
+            return events[:limit], events[limit - 1].id
+        return events, None
+
+def benchmark_feed(followers=10_000, accounts=20, events=1_000, reads=10_000, page_size=20, seed=0):
+    # Every account is followed by the same `followers` users. The events are
+    # published and read back once fanned out on write and once with every
+    # account over the celebrity threshold, reporting write and read latency.
+    rng = random.Random(seed)
+    follower_ids = range(accounts, accounts + followers)
+    followees = set(range(accounts))
+    results = {"followers": followers, "accounts": accounts, "events": events, "page_size": page_size}
+    for mode, threshold in (("fan_out", followers + 1), ("pull", followers)):
+        feed = ActivityFeed(lambda actor: follower_ids, lambda user: followees, celebrity_threshold=threshold)
+        publish_times = []
+        for _ in range(events):
+            start = time.perf_counter()
+            feed.publish(rng.randrange(accounts), FEED_WATCHED, rng.randrange(50_000))
+            publish_times.append(time.perf_counter() - start)
+        read_times = []
+        for _ in range(reads):
+            user = rng.choice(follower_ids)
+            start = time.perf_counter()
+            _, cursor = feed.read(user, limit=page_size)
+            feed.read(user, cursor, page_size)
+            read_times.append((time.perf_counter() - start) / 2)
+        results[mode] = {"publish": latency_percentiles(publish_times), "read": latency_percentiles(read_times)}
+    return results
+
+# cache.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from urllib.parse import parse_qsl, urlencode
+
+CachedResponse = namedtuple('CachedResponse', ['body', 'etag', 'expires'])
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return etag in candidates or 'W/' + etag in candidates
+
+class ResponseCache:
+    # Already-encoded JSON bodies keyed on route + normalized query string.
+    # Entries expire after `ttl` seconds and the least recently used ones are
+    # evicted once the stored bodies exceed `max_bytes`. clear() bumps the
+    # generation so a body rendered before an invalidation is never stored.
+    def __init__(self, max_bytes=32 * 1024 * 1024, ttl=300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(route, query_string=''):
+        return route + '?' + urlencode(sorted(parse_qsl(query_string, keep_blank_values=True)))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires < time.monotonic():
+                self._discard(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, generation=None):
+        entry = CachedResponse(body, '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest(), time.monotonic() + self.ttl)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return entry
+            if len(body) > self.max_bytes:
+                return entry
+            self._discard(key)
+            self._entries[key] = entry
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+        return entry
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry.body)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
+
+# importer.py
+import csv
+import gzip
+import json
+import math
+import os
+import time
+from collections import namedtuple
+
+# kind: int, float, str or list; choices: allowed values or None
+FieldSpec = namedtuple('FieldSpec', ['kind', 'required', 'max_length', 'choices'])
+
+# Mirrors Content; the Django command derives the same schema from the model
+CATALOG_SCHEMA = {
+    'id': FieldSpec(int, True, None, None),
+    'title': FieldSpec(str, True, 200, None),
+    'image': FieldSpec(str, True, 200, None),
+    'rating': FieldSpec(float, True, None, None),
+    'year': FieldSpec(int, True, None, None),
+    'content_type': FieldSpec(str, True, 20, {'movie', 'show', 'documentary', 'anime'}),
+    'genres': FieldSpec(list, False, None, None),
+    'platforms': FieldSpec(list, False, None, None),
+    'description': FieldSpec(str, False, None, None),
+}
+# Separator for list fields in CSV cells
+CSV_LIST_SEPARATOR = '|'
+
+def iter_catalog_records(path):
+    # Streams dicts from a .jsonl/.ndjson or .csv file, optionally gzipped,
+    # one line or row at a time. Lines that aren't valid JSON are yielded as
+    # ValueError instances so they are rejected without stopping the stream.
+    name = path[:-3] if path.endswith('.gz') else path
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8', newline='') as f:
+        if name.endswith('.csv'):
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                yield ValueError(f'invalid JSON: {exc}')
+
+def validate_row(row, schema=CATALOG_SCHEMA):
+    # Coerces a record to the schema's types; raises ValueError on the first problem
+    if not isinstance(row, dict):
+        raise ValueError('expected an object')
+    clean = {}
+    for name, spec in schema.items():
+        value = row.get(name)
+        if value is None or value == '':
+            if spec.required:
+                raise ValueError(f'{name} is required')
+            continue
+        if spec.kind is list:
+            if isinstance(value, str):
+                value = [part.strip() for part in value.split(CSV_LIST_SEPARATOR) if part.strip()]
+            if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+                raise ValueError(f'{name} must be a list of strings')
+        else:
+            if isinstance(value, (bool, list, dict)) or (spec.kind is int and isinstance(value, float) and not value.is_integer()):
+                raise ValueError(f'{name} must be {spec.kind.__name__}')
+            try:
+                value = spec.kind(value)
+            except (TypeError, ValueError):
+                raise ValueError(f'{name} must be {spec.kind.__name__}')
+            if spec.kind is float and not math.isfinite(value):
+                raise ValueError(f'{name} must be finite')
+        if spec.max_length is not None and len(value) > spec.max_length:
+            raise ValueError(f'{name} is longer than {spec.max_length}')
+        if spec.choices is not None and value not in spec.choices:
+            raise ValueError(f'{name} must be one of {sorted(spec.choices)}')
+        clean[name] = value
+    return clean
+
+def load_checkpoint(checkpoint_path, path):
+    # Rows of `path` already written, or 0 if there is no checkpoint for this file
+    try:
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return 0
+    if checkpoint.get('source') != os.path.abspath(path) or checkpoint.get('size') != os.path.getsize(path):
+        return 0
+    return checkpoint['rows']
+
+def save_checkpoint(checkpoint_path, path, rows):
+    tmp_path = checkpoint_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'source': os.path.abspath(path), 'size': os.path.getsize(path), 'rows': rows}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+def import_catalog(path, write_batch, schema=CATALOG_SCHEMA, batch_size=1000, checkpoint_path=None,
+                   progress=None, resume=True, max_errors=100):
+    # Streams `path`, validates every record and hands batches of clean rows
+    # (deduplicated on id, last one wins) to write_batch. Memory stays at one
+    # batch. After each batch the number of rows consumed is checkpointed,
+    # so an interrupted import resumes after the last written batch; the
+    # checkpoint is removed once the file is done. progress(stats) is called
+    # after every batch.
+    skip = load_checkpoint(checkpoint_path, path) if checkpoint_path and resume else 0
+    stats = {'rows': skip, 'imported': 0, 'rejected': 0, 'rows_per_s': 0.0, 'elapsed_s': 0.0, 'errors': []}
+    start = time.perf_counter()
+    batch = {}
+
+    def flush(rows_consumed):
+        if batch:
+            write_batch(list(batch.values()))
+            stats['imported'] += len(batch)
+            batch.clear()
+        stats['rows'] = rows_consumed
+        stats['elapsed_s'] = time.perf_counter() - start
+        stats['rows_per_s'] = (rows_consumed - skip) / stats['elapsed_s'] if stats['elapsed_s'] else 0.0
+        if checkpoint_path:
+            save_checkpoint(checkpoint_path, path, rows_consumed)
+        if progress is not None:
+            progress(dict(stats))
+
+    row_number = skip
+    for row_number, record in enumerate(iter_catalog_records(path), 1):
+        if row_number <= skip:
+            continue
+        try:
+            if isinstance(record, ValueError):
+                raise record
+            row = validate_row(record, schema)
+        except ValueError as exc:
+            stats['rejected'] += 1
+            if len(stats['errors']) < max_errors:
+                stats['errors'].append((row_number, str(exc)))
+            continue
+        batch[row['id']] = row
+        if len(batch) >= batch_size:
+            flush(row_number)
+    flush(row_number)
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return stats
+
+# profiles.py
+PROFILE_FIELDS = (
+    "id", "username", "display_name", "avatar", "bio", "followers_count", "following_count",
+    "is_following", "followed_by", "favorite_genres", "streaming_platforms",
+)
+VIEWER_FIELDS = ("is_following", "followed_by")
+
+class ProfileDocuments:
+    # Materialized profile payloads. A document holds the user's public
+    # fields and their watched/watchlist titles resolved through id-keyed
+    # lookups, and is only rebuilt when that user's data changes, so a read
+    # is a dict lookup plus the viewer-dependent fields. A catalog write can
+    # touch any document, so clear() drops them all and they are rebuilt on
+    # their next read. Writers must be serialized against readers (the mock
+    # server's db_lock does this).
+    def __init__(self, get_user, get_content, content_order=None):
+        self.get_user = get_user
+        self.get_content = get_content
+        self.content_order = content_order
+        self._docs = {}
+
+    def _resolve(self, content_ids):
+        items = [self.get_content(content_id) for content_id in dict.fromkeys(content_ids)]
+        items = [c for c in items if c is not None]
+        if self.content_order is not None:
+            items.sort(key=self.content_order)
+        return items
+
+    def build(self, user):
+        doc = {field: user.get(field) for field in PROFILE_FIELDS}
+        doc.update(dict.fromkeys(VIEWER_FIELDS))  # placeholders keep the payload's key order
+        doc["watched_content"] = self._resolve(user["watched_content_ids"])
+        doc["watchlist_content"] = self._resolve(user["watchlist_content_ids"])
+        return doc
+
+    def get(self, user_id, **viewer_fields):
+        doc = self._docs.get(user_id)
+        if doc is None:
+            user = self.get_user(user_id)
+            if user is None:
+                return None
+            doc = self._docs[user_id] = self.build(user)
+        return dict(doc, **viewer_fields) if viewer_fields else doc
+
+    def refresh(self, user_id, fields=None):
+        # Patch just `fields` when given (e.g. follow counts), else rebuild
+        user = self.get_user(user_id)
+        if user is None:
+            self._docs.pop(user_id, None)
+        elif fields is not None and user_id in self._docs:
+            self._docs[user_id].update({field: user[field] for field in fields})
+        else:
+            self._docs[user_id] = self.build(user)
+
+    def clear(self):
+        self._docs.clear()
+
+# store.py
+import gc
+import glob
+import json
+import marshal
+import mmap
+import os
+import struct
+import threading
+import zlib
+from contextlib import contextmanager, nullcontext
+from operator import itemgetter
+
+SNAPSHOT_MAGIC = b'MOCKSNAP'
+SNAPSHOT_HEADER = struct.Struct('<IQQ')  # format version, lsn, directory length
+SNAPSHOT_VERSION = 1
+# Version 2 writes no shared references, so every decoded list is its own object
+MARSHAL_VERSION = 2
+WAL_FRAME = struct.Struct('<QII')  # lsn, payload length, crc32 of payload
+
+@contextmanager
+def gc_paused():
+    # Building millions of containers triggers the cyclic collector over and
+    # over; pause it, then freeze what was loaded so later collections skip it
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.enable()
+        gc.freeze()
+
+def encode_table(rows):
+    # Column-oriented form of a list of dicts: one list per key instead of
+    # the keys repeated in every record. `shapes` remembers each distinct
+    # key order so rows decode exactly as they were.
+    shapes = {}
+    shape_ids = []
+    keys = {}
+    for row in rows:
+        shape = tuple(row)
+        shape_ids.append(shapes.setdefault(shape, len(shapes)))
+        keys.update(dict.fromkeys(shape))
+    return {
+        "shapes": list(shapes),
+        "shape_ids": shape_ids if len(shapes) > 1 else [],
+        "columns": {key: [row.get(key) for row in rows] for key in keys},
+    }
+
+def decode_table(table):
+    shapes, shape_ids, columns = table["shapes"], table["shape_ids"], table["columns"]
+    if len(shapes) == 1:
+        shape = shapes[0]
+        return [dict(zip(shape, values)) for values in zip(*(columns[key] for key in shape))]
+    rows = [None] * len(shape_ids)
+    for shape_id, shape in enumerate(shapes):
+        positions = [i for i, row_shape in enumerate(shape_ids) if row_shape == shape_id]
+        if not positions:
+            continue
+        pick = itemgetter(*positions) if len(positions) > 1 else (lambda column, i=positions[0]: (column[i],))
+        for position, values in zip(positions, zip(*(pick(columns[key]) for key in shape))):
+            rows[position] = dict(zip(shape, values))
+    return rows
+
+def fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_snapshot(path, lsn, sections):
+    # sections: {name: marshalled bytes}. Layout: magic, header, a marshalled
+    # {name: (offset, length)} directory, then the sections back to back.
+    # Written to a temporary file and renamed, so a crash leaves the
+    # previous snapshot in place.
+    offsets = {}
+    offset = 0
+    for name, blob in sections.items():
+        offsets[name] = (offset, len(blob))
+        offset += len(blob)
+    directory = marshal.dumps(offsets, MARSHAL_VERSION)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC + SNAPSHOT_HEADER.pack(SNAPSHOT_VERSION, lsn, len(directory)) + directory)
+        for blob in sections.values():
+            f.write(blob)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+def read_snapshot(path):
+    # Returns (lsn, {name: object}); sections are unmarshalled straight from
+    # the memory-mapped file without copying it into a bytes object first
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+        if view[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f'{path} is not a snapshot')
+        start = len(SNAPSHOT_MAGIC)
+        version, lsn, directory_length = SNAPSHOT_HEADER.unpack_from(view, start)
+        if version != SNAPSHOT_VERSION:
+            raise ValueError(f'unsupported snapshot version {version}')
+        start += SNAPSHOT_HEADER.size
+        offsets = marshal.loads(view[start:start + directory_length])
+        start += directory_length
+        with gc_paused():
+            sections = {
+                name: marshal.loads(view[start + offset:start + offset + length])
+                for name, (offset, length) in offsets.items()
+            }
+        return lsn, sections
+
+def read_wal(path):
+    # Yields (lsn, record) for every intact frame; stops at the first torn
+    # or corrupt one. The byte offset after the last good frame is left in
+    # the generator's return value for truncating the file.
+    good = 0
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(WAL_FRAME.size)
+            if len(header) < WAL_FRAME.size:
+                break
+            lsn, length, checksum = WAL_FRAME.unpack(header)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+            good = f.tell()
+            yield lsn, json.loads(payload)
+    return good
+
+class WriteAheadLog:
+    # Append-only log of JSON records framed with their lsn and a checksum.
+    # append() only buffers; sync(lsn) makes everything up to lsn durable.
+    # Concurrent sync() calls share fsyncs (group commit): the first caller
+    # flushes and fsyncs whatever has been appended, callers that arrive in
+    # the meantime wait and are covered by that fsync or the next one.
+    def __init__(self, path, lsn=0):
+        self.path = path
+        self.lsn = lsn
+        self.fsyncs = 0
+        self._durable = lsn
+        self._syncing = False
+        self._file = open(path, 'ab')
+        self._cond = threading.Condition()
+
+    def append(self, record):
+        payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        with self._cond:
+            self.lsn += 1
+            self._file.write(WAL_FRAME.pack(self.lsn, len(payload), zlib.crc32(payload)) + payload)
+            return self.lsn
+
+    def sync(self, lsn=None):
+        with self._cond:
+            lsn = self.lsn if lsn is None else lsn
+            while self._durable < lsn:
+                if self._syncing:
+                    self._cond.wait()
+                    continue
+                self._syncing = True
+                target = self.lsn
+                self._file.flush()
+                fd = self._file.fileno()
+                self._cond.release()
+                try:
+                    os.fsync(fd)
+                finally:
+                    self._cond.acquire()
+                    self._syncing = False
+                    self._cond.notify_all()
+                self._durable = max(self._durable, target)
+                self.fsyncs += 1
+
+    def rotate(self, segment_path):
+        # Makes the current file durable, moves it to segment_path and
+        # starts an empty one; lsns continue across files
+        with self._cond:
+            while self._syncing:
+                self._cond.wait()
+            self._file.flush()
+            if not self._file.tell():
+                return  # nothing since the last rotation; keep that segment
+            os.fsync(self._file.fileno())
+            self._file.close()
+            os.replace(self.path, segment_path)
+            self._file = open(self.path, 'ab')
+            self._durable = self.lsn
+
+    def close(self):
+        self.sync()
+        with self._cond:
+            self._file.close()
+
+class Store:
+    # Durable state for an in-memory db: a snapshot plus the write-ahead log
+    # of mutations since. dump_state() returns marshal-able sections and is
+    # called under read_locked(); load_state(sections) replaces the live
+    # state; apply(record) replays one logged mutation. Every
+    # `snapshot_every` records a new snapshot is written in the background
+    # and the log segments it covers are deleted.
+    def __init__(self, directory, dump_state, load_state, apply, read_locked=nullcontext, snapshot_every=100_000):
+        self.directory = directory
+        self.dump_state = dump_state
+        self.load_state = load_state
+        self.apply = apply
+        self.read_locked = read_locked
+        self.snapshot_every = snapshot_every
+        self.snapshot_path = os.path.join(directory, 'snapshot.bin')
+        self.wal = None
+        self.snapshot_lsn = 0
+        self._snapshot_lock = threading.Lock()
+
+    def _segments(self):
+        # Rotated log files, oldest first, then the live one
+        return sorted(glob.glob(os.path.join(self.directory, 'wal-*.log'))) + [os.path.join(self.directory, 'wal.log')]
+
+    def open(self):
+        # Loads the latest snapshot, replays the log after it and opens the
+        # log for appending. Returns True if there was saved state.
+        os.makedirs(self.directory, exist_ok=True)
+        restored = os.path.exists(self.snapshot_path)
+        lsn = 0
+        if restored:
+            lsn, sections = read_snapshot(self.snapshot_path)
+            self.load_state(sections)
+        self.snapshot_lsn = lsn
+        for path in self._segments():
+            if not os.path.exists(path):
+                continue
+            frames = read_wal(path)
+            while True:
+                try:
+                    record_lsn, record = next(frames)
+                except StopIteration as done:
+                    good = done.value
+                    break
+                if record_lsn > lsn:
+                    self.apply(record)
+                    lsn = record_lsn
+                    restored = True
+            if good < os.path.getsize(path):
+                os.truncate(path, good)  # drop a torn tail so new frames follow intact ones
+        self.wal = WriteAheadLog(os.path.join(self.directory, 'wal.log'), lsn)
+        if not os.path.exists(self.snapshot_path):
+            self.snapshot()
+        return restored
+
+    def log(self, op, args, at):
+        return self.wal.append({"op": op, "args": args, "at": at})
+
+    def commit(self, lsn):
+        # Waits for the log to be durable up to lsn; starts a snapshot when due
+        self.wal.sync(lsn)
+        if lsn - self.snapshot_lsn >= self.snapshot_every and not self._snapshot_lock.locked():
+            threading.Thread(target=self.snapshot, daemon=True).start()
+
+    def snapshot(self):
+        # State is encoded under the read lock (writers pause for that long);
+        # the file is written after it is released
+        with self._snapshot_lock:
+            with self.read_locked():
+                sections = {name: marshal.dumps(value, MARSHAL_VERSION) for name, value in self.dump_state().items()}
+                lsn = self.wal.lsn
+                self.wal.rotate(os.path.join(self.directory, f'wal-{lsn:020d}.log'))
+            write_snapshot(self.snapshot_path, lsn, sections)
+            self.snapshot_lsn = lsn
+            for path in self._segments()[:-1]:
+                if int(os.path.basename(path)[4:-4]) <= lsn:
+                    os.remove(path)
+
+    def close(self):
+        if self.wal is not None:
+            self.wal.close()
+
+# metrics.py
+# Per-route request metrics in the Prometheus text exposition format. The
+# mock server records every dispatch() and the Django app every request
+# through MetricsMiddleware; both serve render() on /metrics.
+import bisect
+import re
+import threading
+from collections import defaultdict
+
+# Upper bounds in seconds of the latency histogram buckets (+Inf is implied)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+NUMERIC_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+def route_template(path):
+    # '/api/user/profile/3' -> '/api/user/profile/{id}'
+    return NUMERIC_SEGMENT.sub('/{id}', path)
+
+def _labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped))
+
+class RouteMetrics:
+    # Request counts by status, latency histograms, response bytes and ORM
+    # query counts per (method, route). Routes must be templates or URL
+    # names rather than raw paths, so the number of series stays bounded.
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._requests = defaultdict(int)  # (method, route, status) -> count
+        self._latency = {}  # (method, route) -> [count per bucket and one over the last, sum of seconds]
+        self._bytes = defaultdict(int)
+        self._queries = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def observe(self, method, route, status, seconds, size=None, queries=None):
+        key = (method, route)
+        bucket = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._requests[(method, route, status)] += 1
+            histogram = self._latency.get(key)
+            if histogram is None:
+                histogram = self._latency[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            histogram[0][bucket] += 1
+            histogram[1] += seconds
+            if size is not None:
+                self._bytes[key] += size
+            if queries is not None:
+                self._queries[key] += queries
+
+    def add_bytes(self, method, route, size):
+        with self._lock:
+            self._bytes[(method, route)] += size
+
+    def count_stream(self, method, route, chunks):
+        # Passes a streamed body through and counts its size once it's sent
+        size = 0
+        try:
+            for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+        finally:
+            self.add_bytes(method, route, size)
+
+    def render(self):
+        with self._lock:
+            requests = sorted(self._requests.items())
+            latency = sorted((key, (list(counts), total)) for key, (counts, total) in self._latency.items())
+            sizes = sorted(self._bytes.items())
+            queries = sorted(self._queries.items())
+        lines = [
+            '# HELP http_requests_total Requests served, by route and status code.',
+            '# TYPE http_requests_total counter',
+        ]
+        for (method, route, status), count in requests:
+            lines.append(f'http_requests_total{{{_labels(method=method, route=route, status=status)}}} {count}')
+        lines += [
+            '# HELP http_request_duration_seconds Time to produce the response.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for (method, route), (counts, total) in latency:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f'http_request_duration_seconds_bucket{{{_labels(method=method, route=route, le=bound)}}} {cumulative}')
+            lines.append(f'http_request_duration_seconds_sum{{{_labels(method=method, route=route)}}} {total}')
+            lines.append(f'http_request_duration_seconds_count{{{_labels(method=method, route=route)}}} {cumulative}')
+        lines += [
+            '# HELP http_response_size_bytes_total Response body bytes sent.',
+            '# TYPE http_response_size_bytes_total counter',
+        ]
+        for (method, route), size in sizes:
+            lines.append(f'http_response_size_bytes_total{{{_labels(method=method, route=route)}}} {size}')
+        if queries:
+            lines += [
+                '# HELP db_queries_total ORM queries run while producing responses.',
+                '# TYPE db_queries_total counter',
+            ]
+            for (method, route), count in queries:
+                lines.append(f'db_queries_total{{{_labels(method=method, route=route)}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+# loadtest.py
+# Synthetic data and a concurrent load driver, shared by the mock server's
+# --load-test and the Django load_test command. A route's build(rng, data,
+# viewer) returns (method, path, JSON body or None); every client sends
+# weighted-random requests over its own connection as its own viewer.
+import http.client
+import json
+import random
+import statistics
+import threading
+import time
+from collections import Counter, defaultdict, namedtuple
+from itertools import accumulate
+
+SYNTHETIC_CONTENT_TYPES = ('movie', 'show', 'documentary', 'anime')
+SYNTHETIC_GENRES = ('Action', 'Comedy', 'Documentary', 'Drama', 'Horror', 'Romance', 'Sci-Fi', 'Thriller')
+SYNTHETIC_PLATFORMS = ('Netflix', 'Hulu', 'Prime Video', 'Disney+', 'HBO Max', 'Apple TV+')
+
+LoadRoute = namedtuple('LoadRoute', ['name', 'weight', 'build'])
+
+def synthetic_catalog(titles, rng):
+    # Records in the import_catalog format, ids 1..titles
+    for content_id in range(1, titles + 1):
+        yield {
+            "id": content_id,
+            "title": f"Title {content_id}",
+            "image": f"/placeholder.svg?height=450&width=300&text=Title+{content_id}",
+            "rating": round(rng.uniform(1, 5), 1),
+            "year": rng.randint(1990, 2024),
+            "content_type": rng.choice(SYNTHETIC_CONTENT_TYPES),
+            "genres": rng.sample(SYNTHETIC_GENRES, 2),
+            "platforms": rng.sample(SYNTHETIC_PLATFORMS, 2),
+            "description": "",
+        }
+
+def synthetic_users(users, titles, rng, watched=5, listed=2):
+    # Users 1..users with a few watched and watchlisted titles each
+    for user_id in range(1, users + 1):
+        yield {
+            "id": user_id,
+            "username": f"user{user_id}",
+            "display_name": f"User {user_id}",
+            "watched": rng.sample(range(1, titles + 1), min(watched, titles)),
+            "watchlist": rng.sample(range(1, titles + 1), min(listed, titles)),
+        }
+
+def synthetic_follows(users, per_user, rng):
+    # follower -> set of followees. Followees are skewed towards low ids, so a
+    # few accounts collect most of the followers as on a real social graph
+    # (at 10k users the most followed one is near the celebrity threshold).
+    return {
+        follower: {int(users * rng.random() ** 3) + 1 for _ in range(per_user)} - {follower}
+        for follower in range(1, users + 1)
+    }
+
+def latency_summary(samples):
+    # Mean, p50/p95/p99 and max in ms of a non-empty list of durations in seconds
+    cuts = statistics.quantiles(samples, n=100, method='inclusive') if len(samples) > 1 else samples * 99
+    return {
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3),
+    }
+
+class HTTPLoadClient:
+    # One keep-alive HTTP/1.1 connection, reopened by http.client whenever
+    # the server closes it
+    def __init__(self, host, port, viewer=None, timeout=30):
+        self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        self.viewer = viewer
+
+    def send(self, method, path, body=None):
+        headers = {}
+        if body is not None:
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.connection.request(method, path, body, headers)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            raise
+
+    def close(self):
+        self.connection.close()
+
+def run_load(connect, routes, data, clients=16, requests=200, seed=0):
+    # Sends clients * requests requests: connect(index) makes each client
+    # (send(method, path, body) -> (status, body bytes), viewer and close())
+    # and every client runs on its own thread. Requests that raise are
+    # recorded with status 0; they and 5xx responses count as errors.
+    cum_weights = list(accumulate(route.weight for route in routes))
+    connected = [connect(index) for index in range(clients)]
+    results = [None] * clients
+
+    def client_loop(index):
+        rng = random.Random(seed + index)
+        client = connected[index]
+        samples, statuses, sizes = defaultdict(list), defaultdict(Counter), Counter()
+        try:
+            for route in rng.choices(routes, cum_weights=cum_weights, k=requests):
+                method, path, body = route.build(rng, data, client.viewer)
+                start = time.perf_counter()
+                try:
+                    status, content = client.send(method, path, body)
+                except Exception:
+                    status, content = 0, b''
+                samples[route.name].append(time.perf_counter() - start)
+                statuses[route.name][status] += 1
+                sizes[route.name] += len(content)
+        finally:
+            client.close()
+        results[index] = samples, statuses, sizes
+
+    threads = [threading.Thread(target=client_loop, args=(index,)) for index in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    report_routes = {}
+    everything = []
+    errors = 0
+    for name in dict.fromkeys(route.name for route in routes):
+        samples = [sample for result in results for sample in result[0].get(name, ())]
+        if not samples:
+            continue
+        statuses = sum((result[1][name] for result in results), Counter())
+        route_errors = sum(count for status, count in statuses.items() if status == 0 or status >= 500)
+        report_routes[name] = {
+            "requests": len(samples),
+            "errors": route_errors,
+            "statuses": {str(status): count for status, count in sorted(statuses.items())},
+            "bytes": sum(result[2][name] for result in results),
+            "throughput_rps": round(len(samples) / elapsed, 1),
+            **latency_summary(samples),
+        }
+        everything += samples
+        errors += route_errors
+    return {
+        "clients": clients,
+        "requests": len(everything),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(everything) / elapsed, 1),
+        **latency_summary(everything),
+        "routes": report_routes,
+    }
+
+def check_load(report, max_p99_ms=None, max_error_rate=0.0):
+    # Budget violations of a run_load() report, e.g. to fail a CI job
+    failures = []
+    if max_p99_ms is not None and report["p99_ms"] > max_p99_ms:
+        failures.append(f'p99 {report["p99_ms"]}ms over {max_p99_ms}ms')
+    error_rate = report["errors"] / report["requests"]
+    if error_rate > max_error_rate:
+        failures.append(f'error rate {error_rate:.2%} over {max_error_rate:.2%}')
+    return failures
+
+# catalog.py
+import bisect
+import heapq
+from collections import defaultdict
+from itertools import islice
+
+class CatalogIndex:
+    # Secondary indexes over the mock catalog (db["content"]) so discover
+    # doesn't rescan the whole catalog for every filter. Items keep their
+    # catalog order via a sequence number assigned when they are indexed.
+    def __init__(self, content, search_index=None):
+        self.search_index = search_index
+        self.listeners = []  # called after every catalog write
+        self.load(content)
+
+    def load(self, content, index_search=True):
+        # (Re)builds every index over `content` in one pass, sorting the year
+        # and rating keys once. With index_search=False the search index is
+        # left to be filled separately and query() falls back to substring
+        # matching until search_ready is set.
+        self.content = content
+        ids = [item["id"] for item in content]
+        self._by_id = dict(zip(ids, content))
+        self._seq = dict(zip(ids, range(len(ids))))
+        self._next_seq = len(ids)
+        self._by_type = defaultdict(set)
+        self._by_platform = defaultdict(set)
+        for item in content:
+            self._by_type[item.get('type', '').lower()].add(item["id"])
+            for platform in item.get('platforms', []):
+                self._by_platform[platform].add(item["id"])
+        self._years = sorted(zip([item['year'] for item in content], ids))  # (year, id) pairs
+        self._ratings = sorted(zip([item['rating'] for item in content], ids))  # (rating, id) pairs
+        self.search_ready = index_search
+        if self.search_index is not None:
+            self.search_index.clear()
+            if index_search:
+                for item in content:
+                    self.search_index.add(item["id"], item['title'], item.get('description', ''))
+        self._changed()
+
+    def _index(self, item, insort=True):
+        # With insort=False the caller adds the (year, id)/(rating, id) keys,
+        # and with it False in _unindex removes them
+        content_id = item["id"]
+        self._by_id[content_id] = item
+        self._seq[content_id] = self._next_seq
+        self._next_seq += 1
+        self._by_type[item.get('type', '').lower()].add(content_id)
+        for platform in item.get('platforms', []):
+            self._by_platform[platform].add(content_id)
+        if insort:
+            bisect.insort(self._years, (item['year'], content_id))
+            bisect.insort(self._ratings, (item['rating'], content_id))
+        if self.search_index is not None:
+            self.search_index.add(content_id, item['title'], item.get('description', ''))
+
+    def _unindex(self, item, insort=True):
+        content_id = item["id"]
+        del self._by_id[content_id]
+        del self._seq[content_id]
+        self._by_type[item.get('type', '').lower()].discard(content_id)
+        for platform in item.get('platforms', []):
+            self._by_platform[platform].discard(content_id)
+        for keys, key in ((self._years, item['year']), (self._ratings, item['rating'])) if insort else ():
+            i = bisect.bisect_left(keys, (key, content_id))
+            if i < len(keys) and keys[i] == (key, content_id):
+                del keys[i]
+        if self.search_index is not None:
+            self.search_index.remove(content_id)
+
+    def _changed(self):
+        for listener in self.listeners:
+            listener()
+
+    def get(self, content_id):
+        return self._by_id.get(content_id)
+
+    def position(self, content_id):
+        return self._seq[content_id]
+
+    def add(self, item):
+        if item["id"] in self._by_id:
+            return self.update(item)
+        self.content.append(item)
+        self._index(item)
+        self._changed()
+        return item
+
+    def add_many(self, items):
+        # Bulk form of add(): the year and rating keys are edited in one pass
+        # per call and listeners run once, instead of an insort (and a del
+        # for updates) and a round of listeners per title. A title repeated
+        # in `items` keeps its last row.
+        fresh = {}
+        removed = {'year': [], 'rating': []}
+        added = {'year': [], 'rating': []}
+        for item in {item["id"]: item for item in items}.values():
+            current = self._by_id.get(item["id"])
+            if current is None:
+                fresh[item["id"]] = item
+                continue
+            seq = self._seq[current["id"]]
+            self._unindex(current, insort=False)
+            for field in removed:
+                removed[field].append((current[field], current["id"]))
+            current.update(item)
+            self._index(current, insort=False)
+            self._seq[current["id"]] = seq
+            for field in added:
+                added[field].append((current[field], current["id"]))
+        for item in fresh.values():
+            self.content.append(item)
+            self._index(item, insort=False)
+            for field in added:
+                added[field].append((item[field], item["id"]))
+        self._edit_keys(self._years, removed['year'], added['year'])
+        self._edit_keys(self._ratings, removed['rating'], added['rating'])
+        self._changed()
+
+    @staticmethod
+    def _edit_keys(keys, removed, added):
+        # Applies the removals and insertions to the sorted `keys` in one
+        # pass, copying the untouched runs between edits as slices
+        if not removed and not added:
+            return
+        merged = []
+        start = 0
+        for key, insert in sorted([(key, False) for key in removed] + [(key, True) for key in added]):
+            i = bisect.bisect_left(keys, key, start)
+            merged.extend(keys[start:i])
+            if insert:
+                merged.append(key)
+                start = i
+            else:
+                start = i + 1 if i < len(keys) and keys[i] == key else i
+        merged.extend(keys[start:])
+        keys[:] = merged
+
+    def update(self, item):
+        current = self._by_id[item["id"]]
+        seq = self._seq[item["id"]]
+        self._unindex(current)
+        current.update(item)
+        self._index(current)
+        self._seq[current["id"]] = seq  # updates keep their place in the catalog
+        self._changed()
+        return current
+
+    def remove(self, content_id):
+        item = self._by_id.get(content_id)
+        if item is None:
+            return None
+        self._unindex(item)
+        self.content.remove(item)
+        self._changed()
+        return item
+
+    def iter_by_rating(self, before=None):
+        # Items in (rating, id) descending order, starting after the optional
+        # (rating, id) cursor. Each step resumes from the last key rather than
+        # a position, so the walk stays valid if the catalog changes between
+        # steps (streams advance it under a fresh read lock per batch).
+        before = None if before is None else tuple(before)
+        while True:
+            end = len(self._ratings) if before is None else bisect.bisect_left(self._ratings, before)
+            if not end:
+                return
+            before = self._ratings[end - 1]
+            yield self._by_id[before[1]]
+
+    def _range(self, keys, low, high=None):
+        lo = bisect.bisect_left(keys, (low,))
+        if high is None:
+            hi = len(keys)
+        else:
+            hi = bisect.bisect_left(keys, (high, float('inf')))
+        return lo, max(lo, hi)
+
+    def _plans(self, content_type, platform, min_rating, year_start, year_end):
+        # (size, candidate ids) for each index that can drive the filters
+        year_lo, year_hi = self._range(self._years, year_start, year_end)
+        plans = [(year_hi - year_lo, lambda: [content_id for _, content_id in self._years[year_lo:year_hi]])]
+        if content_type != 'all':
+            plans.append((len(self._by_type.get(content_type, ())), lambda: self._by_type[content_type]))
+        if platform != 'all':
+            plans.append((len(self._by_platform.get(platform, ())), lambda: self._by_platform[platform]))
+        if min_rating > 0:
+            rating_lo, rating_hi = self._range(self._ratings, min_rating)
+            plans.append((rating_hi - rating_lo, lambda: [content_id for _, content_id in self._ratings[rating_lo:rating_hi]]))
+        return plans
+
+    @staticmethod
+    def _matches(c, content_type, platform, min_rating, year_start, year_end):
+        return (
+            year_start <= c['year'] <= year_end
+            and (content_type == 'all' or c.get('type', '').lower() == content_type)
+            and (platform == 'all' or platform in c.get('platforms', []))
+            and (min_rating <= 0 or c['rating'] >= min_rating)
+        )
+
+    def query(self, search='', content_type='all', platform='all', min_rating=0, year_start=1990, year_end=2024):
+        # Same semantics as the original list-comprehension filters, but the
+        # candidate set comes from whichever index is most selective and the
+        # remaining predicates are checked only against those candidates.
+        # With a search index, search matches are ranked by relevance instead
+        # of being a plain substring test in catalog order.
+        filters = (content_type, platform, min_rating, year_start, year_end)
+        plans = self._plans(*filters)
+        ranked = None
+        if search and self.search_index is not None and self.search_ready:
+            ranked = self.search_index.search(search, limit=None)
+            plans.append((len(ranked), lambda: ranked))
+        _, candidates = min(plans, key=lambda plan: plan[0])
+
+        results = []
+        for content_id in candidates():
+            c = self._by_id[content_id]
+            if not self._matches(c, *filters):
+                continue
+            if search and ranked is None and search not in c['title'].lower():
+                continue
+            results.append(c)
+        if ranked is not None:
+            rank = {content_id: i for i, content_id in enumerate(ranked)}
+            results = [c for c in results if c["id"] in rank]
+            results.sort(key=lambda c: rank[c["id"]])
+        else:
+            results.sort(key=lambda c: self._seq[c["id"]])
+        return results
+
+    def iter_top_rated(self, content_type='all', platform='all', min_rating=0, year_start=1990, year_end=2024, before=None):
+        # Matching items in (rating, id) descending order after the optional
+        # cursor, found by walking the rating index lazily
+        for c in self.iter_by_rating(before):
+            if c['rating'] < min_rating:
+                return
+            if self._matches(c, content_type, platform, min_rating, year_start, year_end):
+                yield c
+
+    def top_rated(self, content_type='all', platform='all', min_rating=0, year_start=1990, year_end=2024, before=None, limit=50):
+        # The next `limit` items of iter_top_rated(). Walking the rating index
+        # visits about limit * len(catalog) / matches items; when some index
+        # has fewer candidates than that (so C * C < limit * len(catalog),
+        # as there are at most C matches) its candidates are filtered and the
+        # top `limit` picked with a heap instead.
+        filters = (content_type, platform, min_rating, year_start, year_end)
+        size, candidates = min(self._plans(*filters), key=lambda plan: plan[0])
+        if size * size >= limit * len(self._by_id):
+            return list(islice(self.iter_top_rated(*filters, before=before), limit))
+        key = lambda c: (c['rating'], c["id"])
+        before = None if before is None else tuple(before)
+        matches = (self._by_id[content_id] for content_id in candidates())
+        return heapq.nlargest(limit, (c for c in matches if (before is None or key(c) < before) and self._matches(c, *filters)), key=key)
+
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import queue
+import random
+import selectors
+import socket
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from itertools import islice
+from urllib.parse import urlparse, parse_qs, urlencode
+from .cache import ResponseCache, etag_matches
+from .catalog import CatalogIndex
+from .feed import FEED_LISTED, FEED_WATCHED, ActivityFeed, benchmark_feed, latency_percentiles
+from .graph import SocialGraph
+from .importer import CATALOG_SCHEMA, import_catalog
+from .loadtest import (
+    SYNTHETIC_PLATFORMS, HTTPLoadClient, LoadRoute, check_load, run_load, synthetic_catalog, synthetic_follows, synthetic_users,
+)
+from .metrics import PROMETHEUS_CONTENT_TYPE, RouteMetrics, route_template
+from .pagination import encode_cursor, decode_cursor, keyset_page, iter_json_array
+from .profiles import ProfileDocuments
+from .recommender import WATCHED_WEIGHT, LISTED_WEIGHT, ItemItemRecommender, benchmark_recommender, item_neighbours
+from .search import TrigramIndex, UserPrefixIndex
+from .store import Store, decode_table, encode_table, gc_paused
+
+# Mock database for demonstration purposes
+db = {
+    "content": [
+        {"id": 1, "title": "Dune: Part Two", "image": "/placeholder.svg?height=450&width=300&text=Dune+Part+Two", "rating": 4.8, "year": 2024, "platforms": ["HBO Max", "Prime Video"], "type": "Movie", "watched": False},
+        {"id": 2, "title": "The Bear", "image": "/placeholder.svg?height=450&width=300&text=The+Bear", "rating": 4.9, "year": 2023, "platforms": ["Hulu", "Disney+"], "type": "TV Series", "watched": False},
+        {"id": 3, "title": "Slow Horses", "image": "/placeholder.svg?height=450&width=300&text=Slow+Horses", "rating": 4.7, "year": 2023, "platforms": ["Apple TV+"], "type": "TV Series", "watched": False},
+        {"id": 4, "title": "Oppenheimer", "image": "/placeholder.svg?height=450&width=300&text=Oppenheimer", "rating": 4.7, "year": 2023, "platforms": ["Prime Video"], "type": "Movie", "watched": False},
+        {"id": 5, "title": "Poor Things", "image": "/placeholder.svg?height=450&width=300&text=Poor+Things", "rating": 4.5, "year": 2023, "platforms": ["Hulu"], "type": "Movie", "watched": False},
+        {"id": 6, "title": "Shogun", "image": "/placeholder.svg?height=450&width=300&text=Shogun", "rating": 4.6, "year": 2024, "platforms": ["Hulu", "Disney+"], "type": "TV Series", "watched": False},
+        {"id": 7, "title": "The Gentlemen", "image": "/placeholder.svg?height=450&width=300&text=The+Gentlemen", "rating": 4.3, "year": 2024, "platforms": ["Netflix"], "type": "TV Series", "watched": False},
+        {"id": 8, "title": "Severance", "image": "/placeholder.svg?height=450&width=300&text=Severance", "rating": 4.8, "year": 2022, "platforms": ["Apple TV+"], "type": "TV Series", "watched": False},
+        {"id": 9, "title": "Past Lives", "image": "/placeholder.svg?height=450&width=300&text=Past+Lives", "rating": 4.6, "year": 2023, "platforms": ["Showtime"], "type": "Movie", "watched": False},
+        {"id": 10, "title": "Anatomy of a Fall", "image": "/placeholder.svg?height=450&width=300&text=Anatomy+of+a+Fall", "rating": 4.4, "year": 2023, "platforms": ["Hulu"], "type": "Movie", "watched": False},
+    ],
+    "users": [
+        {"id": 1, "username": "johndoe", "display_name": "John Doe", "avatar": "/placeholder.svg?height=100&width=100&text=JD", "followers_count": 156, "following_count": 89, "is_following": False, "bio": "Movie enthusiast and TV show binge-watcher. Always looking for the next great story to dive into!", "favorite_genres": ["Sci-Fi", "Thriller", "Drama", "Comedy"], "streaming_platforms": ["Netflix", "HBO Max", "Prime Video", "Disney+"], "watched_content_ids": [4, 5, 2], "watchlist_content_ids": [1, 7]},
+        {"id": 2, "username": "moviefanatic", "display_name": "Movie Fanatic", "avatar": "/placeholder.svg?height=50&width=50&text=MF", "followers_count": 230, "following_count": 120, "is_following": True, "bio": "Just a simple movie lover.", "favorite_genres": ["Action"], "streaming_platforms": ["Netflix"], "watched_content_ids": [1, 3], "watchlist_content_ids": [6]},
+        {"id": 3, "username": "tvjunkie", "display_name": "TV Junkie", "avatar": "/placeholder.svg?height=50&width=50&text=TJ", "followers_count": 80, "following_count": 45, "is_following": False, "bio": "TV shows are my life.", "favorite_genres": ["Comedy"], "streaming_platforms": ["Hulu"], "watched_content_ids": [7, 8], "watchlist_content_ids": [9]},
+        {"id": 4, "username": "filmlover", "display_name": "Film Lover", "avatar": "/placeholder.svg?height=50&width=50&text=FL", "followers_count": 300, "following_count": 200, "is_following": True, "bio": "Cinema is my passion.", "favorite_genres": ["Drama"], "streaming_platforms": ["Apple TV+"], "watched_content_ids": [9, 10], "watchlist_content_ids": [4]},
+    ],
+    "relationships": {
+        1: [2, 4], # User 1 follows users 2 and 4
+        2: [1],
+        4: [1]
+    },
+    "lists": {}, # user id -> {list name: [content ids]}, besides the watchlist
+    "ratings": {}, # user id -> {content id: rating}
+}
+
+title_search = TrigramIndex()
+catalog = CatalogIndex(db["content"], title_search)
+graph = SocialGraph(db["users"], db["relationships"])
+user_search = UserPrefixIndex()
+user_search.build((u["id"], u["username"], u["display_name"], u["followers_count"]) for u in db["users"])
+graph.listeners.append(lambda user: user_search.set_score(user["id"], user["followers_count"]))
+
+# Catalog feed content types as the mock's display labels
+MOCK_CONTENT_TYPES = {'movie': 'Movie', 'show': 'TV Series', 'documentary': 'Documentary', 'anime': 'Anime'}
+
+def mock_content(row):
+    # A record in the import_catalog format as a db["content"] item
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "image": row["image"],
+        "rating": row["rating"],
+        "year": row["year"],
+        "platforms": row.get("platforms", []),
+        "type": MOCK_CONTENT_TYPES[row["content_type"]],
+        "genres": row.get("genres", []),
+        "description": row.get("description", ""),
+        "watched": False,
+    }
+
+def hydrate_catalog(path, batch_size=1000, checkpoint_path=None, progress=None):
+    # Loads a catalog file in the import_catalog format into the mock db
+    def write_batch(rows):
+        with db_lock.write_locked():
+            catalog.add_many(mock_content(row) for row in rows)
+    return import_catalog(path, write_batch, CATALOG_SCHEMA, batch_size, checkpoint_path, progress)
+
+# Watch and list activity of followed users, fanned out on write
+feed = ActivityFeed(lambda user: graph.followers.get(user, ()), lambda user: graph.following.get(user, set()))
+
+# Profile payloads list titles in catalog order, like the original scans did
+profiles = ProfileDocuments(graph.user, catalog.get, lambda c: catalog.position(c["id"]))
+catalog.listeners.append(profiles.clear)
+graph.listeners.append(lambda user: profiles.refresh(user["id"], ("followers_count", "following_count")))
+
+def add_user(user):
+    # Adds or renames a user in every user index
+    graph.add_user(user)
+    user_search.add(user["id"], user["username"], user["display_name"], user["followers_count"])
+    profiles.refresh(user["id"])
+
+# Item-item recommendations for the mock users, built from their watched
+# titles and watchlists and updated as titles are marked watched
+def user_profiles():
+    return {
+        u["id"]: {
+            **dict.fromkeys(u["watchlist_content_ids"], LISTED_WEIGHT),
+            **dict.fromkeys(u["watched_content_ids"], WATCHED_WEIGHT),
+        }
+        for u in db["users"]
+    }
+
+recommender = ItemItemRecommender()
+recommender.build(user_profiles())
+
+# Responses that only change with the catalog (or recommendations) are served pre-encoded
+CACHED_ROUTES = {'/api/content/trending', '/api/content/recommended'}
+response_cache = ResponseCache()
+catalog.listeners.append(response_cache.clear)
+recommender.listeners.append(response_cache.clear)
+
+class RWLock:
+    # Any number of readers or a single writer. Waiting writers block new
+    # readers so a steady stream of GETs can't starve follow/unfollow.
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read_locked(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write_locked(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+db_lock = RWLock()
+
+# Writes go through mutate() so they can be logged and replayed. Each
+# MUTATIONS function applies one write to db and the indexes and must be
+# safe to replay.
+def apply_follow(follower, followee, at=None):
+    return graph.follow(follower, followee)
+
+def apply_unfollow(follower, followee, at=None):
+    return graph.unfollow(follower, followee)
+
+def apply_watched(user_id, content_id, at=None):
+    user_data = graph.user(user_id)
+    if not user_data or content_id in user_data["watched_content_ids"]:
+        return False
+    user_data["watched_content_ids"].append(content_id)
+    recommender.record(user_id, content_id)
+    profiles.refresh(user_id)
+    feed.publish(user_id, FEED_WATCHED, content_id, at)
+    return True
+
+def apply_rating(user_id, content_id, rating, at=None):
+    db["ratings"].setdefault(user_id, {})[content_id] = rating
+    return True
+
+def apply_list_add(user_id, list_name, content_id, at=None):
+    # "Watchlist" is the user's watchlist; any other name is a custom list
+    user_data = graph.user(user_id)
+    if not user_data:
+        return False
+    is_watchlist = str(list_name).lower() == 'watchlist'
+    items = user_data["watchlist_content_ids"] if is_watchlist else db["lists"].setdefault(user_id, {}).setdefault(list_name, [])
+    if content_id in items:
+        return False
+    items.append(content_id)
+    if is_watchlist:
+        recommender.record(user_id, content_id, LISTED_WEIGHT)
+        profiles.refresh(user_id)
+    feed.publish(user_id, FEED_LISTED, content_id, at)
+    return True
+
+MUTATIONS = {
+    "follow": apply_follow,
+    "unfollow": apply_unfollow,
+    "watched": apply_watched,
+    "rating": apply_rating,
+    "list_add": apply_list_add,
+}
+
+store = None # Store when running with --data-dir
+# Feed state of snapshots written before the feed was saved with them
+EMPTY_FEED = {"last_id": 0, "celebrities": [], "timelines": {}, "outboxes": {}}
+
+def mutate(op, *args):
+    # Applied, then logged; a write that raises is never logged, so replay
+    # can't trip over it. Callers hold db_lock for writing and validate args.
+    at = time.time()
+    result = MUTATIONS[op](*args, at=at)
+    if store is not None:
+        store.log(op, args, at)
+    return result
+
+def replay(record):
+    MUTATIONS[record["op"]](*record["args"], at=record["at"])
+
+def dump_state():
+    return {
+        "content": encode_table(db["content"]),
+        "users": encode_table(db["users"]),
+        "relationships": db["relationships"],
+        "followers": dict(graph.followers),
+        "lists": db["lists"],
+        "ratings": db["ratings"],
+        "feed": feed.dump(),
+    }
+
+def load_state(sections):
+    with gc_paused():
+        db["content"][:] = decode_table(sections["content"])
+        db["users"][:] = decode_table(sections["users"])
+        db["relationships"].clear()
+        db["relationships"].update(sections["relationships"])
+        db["lists"] = sections["lists"]
+        db["ratings"] = sections["ratings"]
+        reload_indexes(sections["followers"])
+        feed.load(sections.get("feed", EMPTY_FEED))
+
+def reload_indexes(followers=None):
+    # Rebuilds the in-memory indexes over db after it was replaced. The
+    # search indexes and recommender neighbours are left for warm_indexes();
+    # until then searches fall back to substring matching and recommended
+    # to the non-personalized list.
+    catalog.load(db["content"], index_search=False)
+    graph.load(db["users"], db["relationships"], followers)
+    user_search.ready = False
+    recommender.profiles = user_profiles()
+    recommender.set_neighbours({})
+    profiles.clear()
+    response_cache.clear()
+
+def warm_indexes(chunk_size=10_000):
+    # Fills the title search index in chunks, each under a short read lock;
+    # catalog writes in between index themselves. The user index and the
+    # recommender neighbours are built from copies and swapped in under the
+    # write lock, catching up on follower counts that changed meanwhile.
+    with db_lock.read_locked():
+        entries = [(u["id"], u["username"], u["display_name"], u["followers_count"]) for u in db["users"]]
+    user_search.build(entries)
+    with db_lock.write_locked():
+        for u in db["users"]:
+            if user_search.score(u["id"]) != u["followers_count"]:
+                user_search.set_score(u["id"], u["followers_count"])
+        user_search.ready = True
+    with db_lock.read_locked():
+        content_ids = [c["id"] for c in db["content"]]
+    for start in range(0, len(content_ids), chunk_size):
+        with db_lock.read_locked():
+            for content_id in content_ids[start:start + chunk_size]:
+                item = catalog.get(content_id)
+                if item is not None:
+                    title_search.add(content_id, item["title"], item.get("description", ""))
+    catalog.search_ready = True
+    with db_lock.read_locked():
+        snapshot = {user: dict(profile) for user, profile in recommender.profiles.items()}
+    neighbours = item_neighbours(snapshot, recommender.k)
+    with db_lock.write_locked():
+        recommender.set_neighbours(neighbours)
+
+def open_store(directory, snapshot_every=100_000):
+    global store
+    store = Store(directory, dump_state, load_state, replay, db_lock.read_locked, snapshot_every)
+    restored = store.open() # before serving, so nothing else touches db yet
+    if not (catalog.search_ready and user_search.ready):
+        threading.Thread(target=warm_indexes, daemon=True).start()
+    return restored
+
+RESPONSE_HEADERS = [
+    ('Content-type', 'application/json'),
+    ('Access-Control-Allow-Origin', '*'), # Allow CORS for development
+    ('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE, OPTIONS'),
+    ('Access-Control-Allow-Headers', 'Content-Type, Authorization'),
+]
+
+def response_headers(extra_headers):
+    # RESPONSE_HEADERS plus extra_headers, which replace defaults of the same name
+    replaced = {name.lower() for name, _ in extra_headers}
+    return [(name, value) for name, value in RESPONSE_HEADERS if name.lower() not in replaced] + list(extra_headers)
+
+class JSONStream:
+    # Handler payload that dispatch() encodes and writes incrementally (?stream=1)
+    def __init__(self, items):
+        self.items = items
+
+def page_params(query_params, default_size=50, max_size=200):
+    cursor = query_params.get('cursor', [None])[0]
+    page_size = int(query_params.get('page_size', [default_size])[0])
+    return (decode_cursor(cursor) if cursor else None), max(1, min(page_size, max_size))
+
+def page_envelope(path, query_params, results, next_cursor):
+    next_link = None
+    if next_cursor:
+        params = dict(query_params, cursor=[next_cursor])
+        next_link = path + '?' + urlencode(params, doseq=True)
+    return {"next": next_link, "results": results}
+
+def handle_get(path, query_params):
+    if path == '/api/content/trending':
+        return 200, db["content"][:5]
+    elif path == '/api/user/watchlist':
+        user_id = 1 # Mock current user ID
+        profile = profiles.get(user_id)
+        return 200, profile["watchlist_content"] if profile else []
+    elif path == '/api/user/watched':
+        user_id = 1 # Mock current user ID
+        profile = profiles.get(user_id)
+        return 200, profile["watched_content"] if profile else []
+    elif path == '/api/content/recommended':
+        # Personalized candidates for the current user when there are any,
+        # otherwise everything except the trending titles, paged by (rating,
+        # id) descending
+        try:
+            cursor, page_size = page_params(query_params)
+        except ValueError:
+            return 400, {"error": "Invalid pagination parameters"}
+        user_id = 1 # Mock current user ID
+        user_data = graph.user(user_id)
+        personalized = [catalog.get(content_id) for content_id in recommender.recommend(user_id, user_data["watched_content_ids"])]
+        personalized = [c for c in personalized if c is not None]
+        if personalized:
+            if 'stream' in query_params:
+                return 200, JSONStream(personalized)
+            rank = {c["id"]: i for i, c in enumerate(personalized)}
+            page, next_cursor = keyset_page(personalized, lambda c: (rank[c["id"]],), cursor, page_size)
+            return 200, page_envelope(path, query_params, page, next_cursor)
+        trending_ids = {c["id"] for c in db["content"][:5]}
+        items = (c for c in catalog.iter_by_rating(cursor) if c["id"] not in trending_ids)
+        if 'stream' in query_params:
+            return 200, JSONStream(items)
+        page = list(islice(items, page_size + 1))
+        next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            next_cursor = encode_cursor((page[-1]['rating'], page[-1]['id']))
+        return 200, page_envelope(path, query_params, page, next_cursor)
+    elif path == '/api/content/discover':
+        # Filtering for the discover page is answered from the catalog indexes
+        search_query = query_params.get('search', [''])[0].lower()
+        content_type = query_params.get('contentType', ['all'])[0].lower()
+        platform = query_params.get('platform', ['all'])[0]
+        min_rating = float(query_params.get('minRating', [0])[0])
+        year_range_start = int(query_params.get('yearRange[0]', [1990])[0])
+        year_range_end = int(query_params.get('yearRange[1]', [2024])[0])
+        try:
+            cursor, page_size = page_params(query_params)
+        except ValueError:
+            return 400, {"error": "Invalid pagination parameters"}
+
+        filters = (content_type, platform, min_rating, year_range_start, year_range_end)
+        if not search_query:
+            # (rating, id) descending pages come straight off the catalog indexes
+            if 'stream' in query_params:
+                return 200, JSONStream(catalog.iter_top_rated(*filters, before=cursor))
+            page = catalog.top_rated(*filters, before=cursor, limit=page_size + 1)
+            next_cursor = None
+            if len(page) > page_size:
+                page = page[:page_size]
+                next_cursor = encode_cursor((page[-1]['rating'], page[-1]['id']))
+            return 200, page_envelope(path, query_params, page, next_cursor)
+        # Search results stay in relevance order
+        results = catalog.query(search_query, *filters)
+        if 'stream' in query_params:
+            return 200, JSONStream(results)
+        rank = {c["id"]: i for i, c in enumerate(results)}
+        page, next_cursor = keyset_page(results, lambda c: (rank[c["id"]],), cursor, page_size)
+        return 200, page_envelope(path, query_params, page, next_cursor)
+    elif path.startswith('/api/content/'):
+        try:
+            content_id = int(path.split('/')[-1])
+        except ValueError:
+            return 400, {"error": "Invalid content ID"}
+        content = catalog.get(content_id)
+        if content:
+            return 200, content
+        return 404, {"error": "Content not found"}
+    elif path == '/api/user/feed':
+        user_id = 1 # Mock current user ID
+        try:
+            cursor, page_size = page_params(query_params, default_size=20)
+            before = int(cursor[0]) if cursor else None
+        except (ValueError, TypeError, IndexError):
+            return 400, {"error": "Invalid pagination parameters"}
+        events, next_before = feed.read(user_id, before, page_size)
+        results = [
+            {"id": e.id, "actor": graph.user(e.actor), "verb": e.verb, "content": catalog.get(e.content_id), "created_at": e.created_at}
+            for e in events
+        ]
+        return 200, page_envelope(path, query_params, results, encode_cursor((next_before,)) if next_before else None)
+    elif path == '/api/cache/stats':
+        return 200, response_cache.stats()
+    elif path == '/api/users/search':
+        search_query = query_params.get('query', [''])[0]
+        try:
+            limit = int(query_params.get('limit', [user_search.limit])[0])
+        except ValueError:
+            return 400, {"error": "Invalid limit"}
+        if not user_search.ready:
+            # Index still warming up after a restore
+            search_query = search_query.lower()
+            results = [u for u in db["users"] if search_query in u['username'].lower() or search_query in u['display_name'].lower()]
+            return 200, results[:min(limit, user_search.max_limit)]
+        return 200, [graph.user(user_id) for user_id in user_search.search(search_query, limit)]
+    elif path in ('/api/user/followers', '/api/user/following', '/api/user/mutuals', '/api/user/suggestions'):
+        user_id = 1 # Mock current user ID
+        try:
+            user_id = int(query_params.get('userId', [user_id])[0])
+            after = int(query_params['after'][0]) if 'after' in query_params else None
+            limit = int(query_params['limit'][0]) if 'limit' in query_params else None
+        except ValueError:
+            return 400, {"error": "Invalid query parameters"}
+        if graph.user(user_id) is None:
+            return 404, {"error": "User not found"}
+        if path == '/api/user/followers':
+            ids = graph.followers_of(user_id, after, limit)
+        elif path == '/api/user/following':
+            ids = graph.following_of(user_id, after, limit)
+        elif path == '/api/user/mutuals':
+            ids = graph.page(graph.mutuals(user_id), after, limit)
+        else:
+            ids = graph.suggestions(user_id, limit or 10)
+        return 200, [graph.user(u_id) for u_id in ids if graph.user(u_id) is not None]
+    elif path.startswith('/api/user/profile/'):
+        try:
+            user_id = int(path.split('/')[-1])
+        except ValueError:
+            return 400, {"error": "Invalid user ID"}
+        profile = profiles.get(
+            user_id,
+            is_following=graph.is_following(1, user_id), # Mock if current user (ID 1) follows this user
+            followed_by=sorted(graph.followed_by_followees(1, user_id)), # People the current user follows who follow this user
+        )
+        if not profile:
+            return 404, {"error": "User not found"}
+        return 200, profile
+    return 404, {"error": "Not Found"}
+
+def parse_id(value):
+    # Ids in request bodies are ints or numeric strings; anything else is
+    # rejected before it reaches the indexes or the write-ahead log
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f'invalid id {value!r}')
+    return int(value)
+
+def handle_post(path, post_data):
+    if not isinstance(post_data, dict):
+        return 400, {"error": "Expected a JSON object"}
+    if path in ('/api/content/mark-watched', '/api/content/update-watched', '/api/list/add-content', '/api/list/create-and-add'):
+        try:
+            content_id = parse_id(post_data.get('contentId'))
+        except ValueError:
+            return 400, {"error": "Invalid content ID"}
+    elif path in ('/api/user/follow', '/api/user/unfollow'):
+        try:
+            user_id = parse_id(post_data.get('userId'))
+        except ValueError:
+            return 400, {"error": "Invalid user ID"}
+        if graph.user(user_id) is None:
+            return 404, {"error": "User not found"}
+    if path == '/api/content/mark-watched':
+        user_id = 1 # Mock current user
+        mutate("watched", user_id, content_id)
+        return 200, {"message": f"Content {content_id} marked as watched"}
+    elif path == '/api/content/update-watched':
+        rating = post_data.get('rating')
+        if isinstance(rating, bool) or not isinstance(rating, (int, float)):
+            return 400, {"error": "Invalid rating"}
+        mutate("rating", 1, content_id, rating) # Mock current user
+        return 200, {"message": f"Content {content_id} updated with rating {rating}"}
+    elif path in ('/api/list/add-content', '/api/list/create-and-add'):
+        list_name = post_data.get('listName')
+        if not isinstance(list_name, str) or not list_name:
+            return 400, {"error": "Invalid list name"}
+        mutate("list_add", 1, list_name, content_id) # Mock current user; creates the list if needed
+        if path == '/api/list/add-content':
+            return 200, {"message": f"Content {content_id} added to list {list_name}"}
+        return 200, {"message": f"List {list_name} created and content {content_id} added"}
+    elif path == '/api/user/follow':
+        current_user_id = 1 # Mock current user
+        mutate("follow", current_user_id, user_id)
+        return 200, {"message": f"User {user_id} followed"}
+    elif path == '/api/user/unfollow':
+        current_user_id = 1 # Mock current user
+        mutate("unfollow", current_user_id, user_id)
+        return 200, {"message": f"User {user_id} unfollowed"}
+    return 404, {"error": "Not Found"}
+
+def _discover_target(rng):
+    params = {}
+    if rng.random() < 0.5:
+        params['contentType'] = rng.choice(list(MOCK_CONTENT_TYPES.values()))
+    if rng.random() < 0.3:
+        params['platform'] = rng.choice(SYNTHETIC_PLATFORMS)
+    if rng.random() < 0.3:
+        params['minRating'] = rng.choice([3, 4, 4.5])
+    if rng.random() < 0.2:
+        params['search'] = f'title {rng.randint(1, 999)}'
+    return '/api/content/discover?' + urlencode(params)
+
+def _get(path):
+    return lambda rng, data, viewer: ('GET', path, None)
+
+# Every route in handle_get/handle_post for load_test(), weighted roughly
+# like the app's traffic. data is {"titles": count, "users": count}; the
+# viewer is always the mock current user.
+MOCK_LOAD_ROUTES = [
+    LoadRoute('/api/content/trending', 10, _get('/api/content/trending')),
+    LoadRoute('/api/content/recommended', 10, _get('/api/content/recommended?page_size=20')),
+    LoadRoute('/api/content/discover', 10, lambda rng, data, viewer: ('GET', _discover_target(rng), None)),
+    LoadRoute('/api/content/{id}', 10, lambda rng, data, viewer: ('GET', f'/api/content/{rng.randint(1, data["titles"])}', None)),
+    LoadRoute('/api/user/watchlist', 5, _get('/api/user/watchlist')),
+    LoadRoute('/api/user/watched', 5, _get('/api/user/watched')),
+    LoadRoute('/api/user/feed', 5, _get('/api/user/feed')),
+    LoadRoute('/api/users/search', 5, lambda rng, data, viewer: (
+        'GET', '/api/users/search?' + urlencode({'query': f'user{rng.randint(1, data["users"])}'[:rng.randint(3, 8)]}), None,
+    )),
+    *(
+        LoadRoute(path, 2, lambda rng, data, viewer, path=path: ('GET', f'{path}?userId={rng.randint(1, data["users"])}', None))
+        for path in ('/api/user/followers', '/api/user/following', '/api/user/mutuals', '/api/user/suggestions')
+    ),
+    LoadRoute('/api/user/profile/{id}', 10, lambda rng, data, viewer: ('GET', f'/api/user/profile/{rng.randint(1, data["users"])}', None)),
+    LoadRoute('/api/cache/stats', 1, _get('/api/cache/stats')),
+    LoadRoute('/metrics', 1, _get('/metrics')),
+    LoadRoute('/api/content/mark-watched', 2, lambda rng, data, viewer: (
+        'POST', '/api/content/mark-watched', {"contentId": rng.randint(1, data["titles"])},
+    )),
+    LoadRoute('/api/content/update-watched', 1, lambda rng, data, viewer: (
+        'POST', '/api/content/update-watched', {"contentId": rng.randint(1, data["titles"]), "rating": rng.choice([3, 3.5, 4, 4.5, 5])},
+    )),
+    LoadRoute('/api/list/add-content', 1, lambda rng, data, viewer: (
+        'POST', '/api/list/add-content', {"contentId": rng.randint(1, data["titles"]), "listName": "Watchlist"},
+    )),
+    LoadRoute('/api/list/create-and-add', 1, lambda rng, data, viewer: (
+        'POST', '/api/list/create-and-add', {"contentId": rng.randint(1, data["titles"]), "listName": rng.choice(["Favorites", "Weekend"])},
+    )),
+    *(
+        LoadRoute(path, 2, lambda rng, data, viewer, path=path: ('POST', path, {"userId": rng.randint(2, data["users"])}))
+        for path in ('/api/user/follow', '/api/user/unfollow')
+    ),
+]
+# Metrics are labelled with these route templates; other paths are 'unmatched'
+MOCK_ROUTES = frozenset(route.name for route in MOCK_LOAD_ROUTES)
+
+# Per-route latency, status and response size of every request, on /metrics
+request_metrics = RouteMetrics()
+
+def dispatch(method, target, body=b'', headers=None):
+    # Shared by every server mode; returns (status, body, extra headers) and
+    # records the request in request_metrics. Streamed bodies are timed until
+    # they start and their size is counted once they have been sent.
+    start = time.perf_counter()
+    path = urlparse(target).path
+    if method == 'GET' and path == '/metrics':
+        status_code, response, extra_headers = 200, request_metrics.render().encode('utf-8'), [('Content-type', PROMETHEUS_CONTENT_TYPE)]
+    else:
+        try:
+            status_code, response, extra_headers = _dispatch(method, target, body, headers)
+        except ValueError:
+            # A malformed request (e.g. an unparseable number in the query)
+            # that a handler didn't turn into its own 400; every server mode
+            # answers it the same way
+            status_code, response, extra_headers = 400, json.dumps({"error": "Invalid request"}).encode('utf-8'), []
+    elapsed = time.perf_counter() - start
+    route = route_template(path)
+    if route not in MOCK_ROUTES:
+        route = 'unmatched'
+    if isinstance(response, bytes):
+        request_metrics.observe(method, route, status_code, elapsed, len(response))
+    else:
+        request_metrics.observe(method, route, status_code, elapsed)
+        response = request_metrics.count_stream(method, route, response)
+    return status_code, response, extra_headers
+
+def _dispatch(method, target, body=b'', headers=None):
+    # Handlers run under db_lock and the payload is encoded before the lock is
+    # released, so a response never observes a half-applied write and slow
+    # clients never hold the lock.
+    parsed_path = urlparse(target)
+    if method == 'OPTIONS':
+        return 200, b'', []
+    if method == 'GET':
+        query_params = parse_qs(parsed_path.query)
+        if parsed_path.path in CACHED_ROUTES and 'stream' not in query_params:
+            return _dispatch_cached(parsed_path, headers or {})
+        with db_lock.read_locked():
+            status_code, response = handle_get(parsed_path.path, query_params)
+            if isinstance(response, JSONStream):
+                return status_code, iter_json_array(_encode_stream(response.items)), []
+            return status_code, json.dumps(response).encode('utf-8'), []
+    if method == 'POST':
+        try:
+            post_data = json.loads(body)
+        except ValueError:
+            return 400, json.dumps({"error": "Invalid JSON body"}).encode('utf-8'), []
+        with db_lock.write_locked():
+            status_code, response = handle_post(parsed_path.path, post_data)
+            payload = json.dumps(response).encode('utf-8')
+            lsn = store.wal.lsn if store is not None else None
+        if store is not None:
+            # fsync after releasing the lock so concurrent writes share it
+            store.commit(lsn)
+        return status_code, payload, []
+    return 405, json.dumps({"error": "Method Not Allowed"}).encode('utf-8'), []
+
+def _encode_stream(items, batch_size=256):
+    # Each batch is encoded under its own short read lock, so a long stream
+    # to a slow client never holds off writers. `items` may be a lazy walk
+    # over the catalog; it is only advanced while the lock is held.
+    items = iter(items)
+    while True:
+        with db_lock.read_locked():
+            encoded = [json.dumps(c).encode('utf-8') for c in islice(items, batch_size)]
+        if not encoded:
+            return
+        yield from encoded
+
+def _dispatch_cached(parsed_path, headers):
+    key = ResponseCache.make_key(parsed_path.path, parsed_path.query)
+    entry = response_cache.get(key)
+    if entry is None:
+        with db_lock.read_locked():
+            generation = response_cache.generation
+            status_code, response = handle_get(parsed_path.path, parse_qs(parsed_path.query))
+            body = json.dumps(response).encode('utf-8')
+        if status_code != 200:
+            return status_code, body, []
+        entry = response_cache.put(key, body, generation)
+    cache_headers = [('ETag', entry.etag), ('Cache-Control', 'no-cache')]
+    if etag_matches(headers.get('if-none-match'), entry.etag):
+        return 304, b'', cache_headers
+    return 200, entry.body, cache_headers
+
+class RequestHandler(BaseHTTPRequestHandler):
+    # Set to drop the per-request log lines, e.g. under load_test()
+    quiet = False
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+    def _set_headers(self, status_code=200, content_length=0, extra_headers=()):
+        self.send_response(status_code)
+        for name, value in response_headers(extra_headers):
+            self.send_header(name, value)
+        if content_length is not None and status_code != 304:
+            self.send_header('Content-Length', str(content_length))
+        self.end_headers()
+
+    def _respond(self, method, body=b''):
+        status_code, response, extra_headers = dispatch(method, self.path, body, self.headers)
+        if isinstance(response, bytes):
+            self._set_headers(status_code, len(response), extra_headers)
+            self.wfile.write(response)
+            return
+        # Streamed body: chunked on HTTP/1.1, otherwise ended by closing the connection
+        chunked = self.protocol_version == 'HTTP/1.1' and self.request_version == 'HTTP/1.1'
+        if chunked:
+            extra_headers = extra_headers + [('Transfer-Encoding', 'chunked')]
+        else:
+            self.close_connection = True
+        self._set_headers(status_code, None, extra_headers)
+        for chunk in response:
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
+    def do_OPTIONS(self):
+        self._respond('OPTIONS')
+
+    def do_GET(self):
+        self._respond('GET')
+
+    def do_POST(self):
+        content_length = int(self.headers['Content-Length'])
+        self._respond('POST', self.rfile.read(content_length))
+
+class KeepAliveRequestHandler(RequestHandler):
+    # HTTP/1.1 persistent connections; idle clients are dropped after `timeout`
+    # seconds. Under ThreadPoolHTTPServer a connection with no request waiting
+    # is parked instead of blocking its worker on the next request line; the
+    # server resumes it on the pool once more data arrives.
+    protocol_version = 'HTTP/1.1'
+    timeout = 5
+    # Headers and body go out in separate writes; without TCP_NODELAY the
+    # body waits on the client's delayed ACK (~40ms) on a reused connection
+    disable_nagle_algorithm = True
+    parked = False
+
+    def handle(self):
+        self.parked = False
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if isinstance(self.server, ThreadPoolHTTPServer) and not self._input_pending():
+                self.parked = True
+                return
+            self.handle_one_request()
+
+    def _input_pending(self):
+        # A pipelined request already buffered in rfile, or bytes on the
+        # socket; peek() does at most one read, which doesn't block here
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def finish(self):
+        if not self.parked:
+            super().finish()
+
+class ThreadPoolHTTPServer(HTTPServer):
+    # Like ThreadingHTTPServer, but connections are served by a bounded pool
+    # instead of one new thread each. Idle keep-alive connections wait in a
+    # selector on one watcher thread rather than on a pool worker, so idle
+    # clients can't starve the pool; they are closed after the handler's
+    # timeout.
+    def __init__(self, server_address, handler_class, workers=8):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._selector = selectors.DefaultSelector()
+        self._parked = queue.SimpleQueue()
+        self._wake, self._waker = socket.socketpair()
+        self._selector.register(self._wake, selectors.EVENT_READ)
+        self._watcher = threading.Thread(target=self._watch_idle, daemon=True)
+        self._watcher.start()
+
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+            return
+        self._release(handler)
+
+    def _resume(self, handler):
+        try:
+            handler.handle()
+        except Exception:
+            handler.parked = False
+            self.handle_error(handler.request, handler.client_address)
+        finally:
+            handler.finish()
+        self._release(handler)
+
+    def _release(self, handler):
+        # Only the worker that last served a connection decides its fate
+        if getattr(handler, 'parked', False):
+            self._parked.put(handler)
+            self._waker.send(b'\0')
+        else:
+            self.shutdown_request(handler.request)
+
+    def _close_parked(self, handler):
+        self._selector.unregister(handler.connection)
+        handler.parked = False
+        handler.finish()
+        self.shutdown_request(handler.request)
+
+    def _watch_idle(self):
+        idle = {}  # parked handler -> deadline, oldest first
+        while True:
+            timeout = max(0, next(iter(idle.values())) - time.monotonic()) if idle else None
+            for key, _ in self._selector.select(timeout):
+                if key.fileobj is self._wake:
+                    self._wake.recv(4096)
+                    while True:
+                        try:
+                            handler = self._parked.get_nowait()
+                        except queue.Empty:
+                            break
+                        if handler is None:
+                            for handler in idle:
+                                self._close_parked(handler)
+                            return
+                        self._selector.register(handler.connection, selectors.EVENT_READ, handler)
+                        idle[handler] = time.monotonic() + handler.timeout
+                else:
+                    handler = key.data
+                    self._selector.unregister(handler.connection)
+                    del idle[handler]
+                    self.executor.submit(self._resume, handler)
+            now = time.monotonic()
+            while idle and next(iter(idle.values())) <= now:
+                handler = next(iter(idle))
+                del idle[handler]
+                self._close_parked(handler)
+
+    def server_close(self):
+        super().server_close()
+        self._parked.put(None)
+        self._waker.send(b'\0')
+        self._watcher.join()
+        self.executor.shutdown(wait=True)
+        # Connections parked by workers that finished after the watcher stopped
+        while True:
+            try:
+                handler = self._parked.get_nowait()
+            except queue.Empty:
+                break
+            if handler is not None:
+                handler.parked = False
+                handler.finish()
+                self.shutdown_request(handler.request)
+        for sock in (self._wake, self._waker):
+            sock.close()
+        self._selector.close()
+
+async def _serve_connection(reader, writer, executor):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                request_line = await asyncio.wait_for(reader.readline(), KeepAliveRequestHandler.timeout)
+            except asyncio.TimeoutError:
+                break
+            if not request_line.strip():
+                break
+            method, target, version = request_line.decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            # Handlers are synchronous and take db_lock, so they run on the pool
+            status_code, response, extra_headers = await loop.run_in_executor(executor, dispatch, method, target, body, headers)
+
+            connection = headers.get('connection', '').lower()
+            keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+            streamed = not isinstance(response, bytes)
+            chunked = streamed and version == 'HTTP/1.1'
+            lines = [f'HTTP/1.1 {status_code} {HTTPStatus(status_code).phrase}']
+            lines += [f'{name}: {value}' for name, value in response_headers(extra_headers)]
+            if chunked:
+                lines.append('Transfer-Encoding: chunked')
+            elif streamed:
+                keep_alive = False
+            elif status_code != 304:
+                lines.append(f'Content-Length: {len(response)}')
+            lines.append(f'Connection: {"keep-alive" if keep_alive else "close"}')
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+            if streamed:
+                # Chunks are encoded on the pool, like the handlers themselves
+                while (chunk := await loop.run_in_executor(executor, next, response, None)) is not None:
+                    writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+                    await writer.drain()
+                if chunked:
+                    writer.write(b'0\r\n\r\n')
+            else:
+                writer.write(response)
+            await writer.drain()
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+async def serve_async(port=8000, workers=8, started=None, host=''):
+    # started(port) is called once listening; port 0 picks a free one
+    executor = ThreadPoolExecutor(max_workers=workers)
+    server = await asyncio.start_server(lambda r, w: _serve_connection(r, w, executor), host, port)
+    if started is not None:
+        started(server.sockets[0].getsockname()[1])
+    async with server:
+        await server.serve_forever()
+
+def measure_ttfb(url, runs=5):
+    # Median time to first body byte and to the complete body, in ms; e.g. to
+    # compare /api/content/recommended?stream=1 with a paged request
+    parsed = urlparse(url)
+    target = parsed.path + ('?' + parsed.query if parsed.query else '')
+    first_byte, complete = [], []
+    for _ in range(runs):
+        conn = http.client.HTTPConnection(parsed.hostname, parsed.port or 80)
+        start = time.perf_counter()
+        conn.request('GET', target)
+        response = conn.getresponse()
+        response.read(1)
+        first_byte.append(time.perf_counter() - start)
+        response.read()
+        complete.append(time.perf_counter() - start)
+        conn.close()
+    return {"ttfb_ms": statistics.median(first_byte) * 1000, "total_ms": statistics.median(complete) * 1000}
+
+def seed_synthetic_db(titles, users, follows=5, seed=0):
+    # Replaces db with synthetic titles, users and follow graph (loadtest.py)
+    rng = random.Random(seed)
+    with gc_paused():
+        db["content"][:] = [mock_content(row) for row in synthetic_catalog(titles, rng)]
+        db["users"][:] = [
+            {"id": row["id"], "username": row["username"], "display_name": row["display_name"],
+             "avatar": "/placeholder.svg?height=50&width=50", "followers_count": 0, "following_count": 0,
+             "is_following": False, "bio": "", "favorite_genres": [], "streaming_platforms": [],
+             "watched_content_ids": row["watched"], "watchlist_content_ids": row["watchlist"]}
+            for row in synthetic_users(users, titles, rng)
+        ]
+        db["relationships"].clear()
+        db["relationships"].update(synthetic_follows(users, follows, rng))
+        db["lists"] = {}
+        db["ratings"] = {}
+        for u in db["users"]:
+            u["following_count"] = len(db["relationships"][u["id"]])
+        reload_indexes()
+        for followee, followers in graph.followers.items():
+            graph.users[followee]["followers_count"] = len(followers)
+
+def benchmark_store(titles=1_000_000, users=1_000_000, writers=16, writes=500, directory=None, seed=0):
+    # Replaces db with synthetic titles and users, writes the first snapshot,
+    # then times a cold start from it (snapshot load, log replay and index
+    # rebuild, i.e. everything before serving), the background index warm-up
+    # and concurrent logged writes sharing fsyncs
+    global store
+    rng = random.Random(seed)
+    directory = directory or tempfile.mkdtemp(prefix='mockdb-')
+    seed_synthetic_db(titles, users, seed=seed)
+
+    start = time.perf_counter()
+    store = Store(directory, dump_state, load_state, replay, db_lock.read_locked)
+    store.open()
+    snapshot_seconds = time.perf_counter() - start
+    store.close()
+
+    # Start from an empty db, as a freshly started process would
+    with gc_paused():
+        db["content"].clear()
+        db["users"].clear()
+        db["relationships"].clear()
+        reload_indexes()
+    start = time.perf_counter()
+    store = Store(directory, dump_state, load_state, replay, db_lock.read_locked)
+    store.open()
+    cold_start_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    warm_indexes()
+    warm_seconds = time.perf_counter() - start
+
+    latencies = []
+    def writer():
+        for _ in range(writes):
+            path = rng.choice(['/api/user/follow', '/api/user/unfollow'])
+            body = json.dumps({"userId": rng.randint(2, users)}).encode('utf-8')
+            request_start = time.perf_counter()
+            dispatch('POST', path, body)
+            latencies.append(time.perf_counter() - request_start)
+    fsyncs = store.wal.fsyncs
+    start = time.perf_counter()
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    write_seconds = time.perf_counter() - start
+    store.close()
+    return {
+        "titles": titles,
+        "users": users,
+        "snapshot_mb": round(os.path.getsize(store.snapshot_path) / 1e6, 1),
+        "snapshot_write_s": round(snapshot_seconds, 2),
+        "cold_start_s": round(cold_start_seconds, 2),
+        "warm_indexes_s": round(warm_seconds, 2),
+        "writes": len(latencies),
+        "writes_per_s": round(len(latencies) / write_seconds),
+        "fsyncs": store.wal.fsyncs - fsyncs,
+        "write_latency": latency_percentiles(latencies),
+    }
+
+def serve_in_background(mode='threaded', workers=8, port=0):
+    # Starts a server like run() on a daemon thread and returns its port;
+    # port 0 picks a free one
+    if mode == 'async':
+        bound = []
+        listening = threading.Event()
+        def started(port):
+            bound.append(port)
+            listening.set()
+        threading.Thread(target=asyncio.run, args=(serve_async(port, workers, started, '127.0.0.1'),), daemon=True).start()
+        listening.wait()
+        return bound[0]
+    if mode == 'threaded':
+        httpd = ThreadPoolHTTPServer(('127.0.0.1', port), KeepAliveRequestHandler, workers)
+    else:
+        httpd = HTTPServer(('127.0.0.1', port), RequestHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd.server_address[1]
+
+def load_test(titles=10_000, users=10_000, follows=10, clients=16, requests=200, mode='threaded', workers=8, seed=0):
+    # Replaces db with synthetic data, serves it in `mode` and drives every
+    # route in MOCK_LOAD_ROUTES with concurrent keep-alive clients. The
+    # indexes are warmed first, so this measures steady state.
+    seed_synthetic_db(titles, users, follows, seed)
+    warm_indexes()
+    RequestHandler.quiet = True
+    port = serve_in_background(mode, workers)
+    report = run_load(
+        lambda index: HTTPLoadClient('127.0.0.1', port, viewer=1), # Mock current user
+        MOCK_LOAD_ROUTES, {"titles": titles, "users": users}, clients, requests, seed,
+    )
+    return {"titles": titles, "users": users, "mode": mode, **report}
 
-def run(server_class=HTTPServer, handler_class=RequestHandler, port=8000):
+def run(server_class=HTTPServer, handler_class=RequestHandler, port=8000, mode='single', workers=8):
+    # mode: 'single' (one request at a time), 'threaded' (bounded thread pool)
+    # or 'async' (asyncio connection handling, handlers on a worker pool)
+    print(f'Starting httpd server on port {port} ({mode} mode)...')
+    if mode == 'async':
+        asyncio.run(serve_async(port, workers))
+        return
     server_address = ('', port)
-    httpd = server_class(server_address, handler_class)
-    print(f'Starting httpd server on port {port}...')
+    if mode == 'threaded':
+        if handler_class is RequestHandler:
+            handler_class = KeepAliveRequestHandler
+        httpd = ThreadPoolHTTPServer(server_address, handler_class, workers)
+    else:
+        httpd = server_class(server_address, handler_class)
     httpd.serve_forever()
 
 if __name__ == "__main__":
-    run()
+    parser = argparse.ArgumentParser(description='Mock API server')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--mode', choices=['single', 'threaded', 'async'], default='single')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--measure-ttfb', metavar='URL', help='report time to first byte for URL instead of serving')
+    parser.add_argument('--benchmark-recommender', metavar='USERS', type=int, help='report recommender build time and memory for USERS synthetic users')
+    parser.add_argument('--catalog', metavar='PATH', help='load a JSONL/CSV catalog file into the mock db before serving')
+    parser.add_argument('--data-dir', metavar='DIR', help='persist the db in DIR (write-ahead log + snapshots) and restore it on startup')
+    parser.add_argument('--snapshot-every', metavar='N', type=int, default=100_000, help='write a snapshot after every N logged writes')
+    parser.add_argument('--benchmark-store', metavar='TITLES', type=int, help='report snapshot size, cold start and logged write throughput with TITLES titles and as many users')
+    parser.add_argument('--benchmark-feed', metavar='FOLLOWERS', type=int, help='report feed write/read latency percentiles with FOLLOWERS followers per account')
+    parser.add_argument('--load-test', metavar='TITLES', type=int, help='serve TITLES synthetic titles and as many users in --mode and report per-route throughput and latency under load')
+    parser.add_argument('--follows', type=int, default=10, help='follows per synthetic user for --load-test')
+    parser.add_argument('--clients', type=int, default=16, help='concurrent clients for --load-test')
+    parser.add_argument('--requests', type=int, default=200, help='requests per client for --load-test')
+    parser.add_argument('--max-p99-ms', type=float, help='exit with status 1 if the --load-test p99 latency is higher')
+    parser.add_argument('--max-error-rate', type=float, default=0.0, help='exit with status 1 if a larger share of --load-test requests fail')
+    args = parser.parse_args()
+    if args.measure_ttfb:
+        print(json.dumps(measure_ttfb(args.measure_ttfb)))
+    elif args.benchmark_recommender:
+        print(json.dumps(benchmark_recommender(users=args.benchmark_recommender)))
+    elif args.benchmark_feed:
+        print(json.dumps(benchmark_feed(followers=args.benchmark_feed)))
+    elif args.benchmark_store:
+        print(json.dumps(benchmark_store(titles=args.benchmark_store, users=args.benchmark_store)))
+    elif args.load_test:
+        report = load_test(args.load_test, args.load_test, args.follows, args.clients, args.requests, args.mode, args.workers)
+        print(json.dumps(report))
+        failures = check_load(report, args.max_p99_ms, args.max_error_rate)
+        if failures:
+            parser.exit(1, 'Load test over budget: ' + '; '.join(failures) + '\n')
+    else:
+        if args.data_dir:
+            start = time.perf_counter()
+            restored = open_store(args.data_dir, args.snapshot_every)
+            print(f"{'Restored' if restored else 'Initialized'} {args.data_dir} in {time.perf_counter() - start:.2f}s")
+        if args.catalog:
+            stats = hydrate_catalog(args.catalog, progress=lambda stats: print(
+                f"{stats['rows']} rows, {stats['imported']} imported, {stats['rejected']} rejected, {stats['rows_per_s']:.0f} rows/s"
+            ))
+            for row_number, message in stats['errors']:
+                print(f'row {row_number}: {message}')
+            if store is not None:
+                store.snapshot() # catalog loads aren't logged
+        try:
+            run(port=args.port, mode=args.mode, workers=args.workers)
+        finally:
+            if store is not None:
+                store.close()